@@ -0,0 +1,111 @@
+"""
+Memory and serialization cost of a large result: the slotted models with interned additional_data keys against
+the plain dataclasses they replaced, and serialize.write_result against json.dumps(asdict(result)).
+
+    python benchmarks/bench_models.py            # 100k policies
+    python benchmarks/bench_models.py 500000
+"""
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from columnar import json_default
+from models import Policy, ScrapeResult
+from serialize import write_result
+
+
+# the models as they were before slots, for comparison
+@dataclass
+class PlainPolicy:
+    policy_number: Optional[str] = None
+    effective_date: Optional[str] = None
+    expiration_date: Optional[str] = None
+    premium: Optional[str] = None
+    status: Optional[str] = None
+    carrier: Optional[str] = None
+    coverage_type: Optional[str] = None
+    additional_data: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class PlainResult:
+    insured: Optional[object] = None
+    agency: Optional[object] = None
+    policies: List[PlainPolicy] = field(default_factory=list)
+    raw_data: Dict = field(default_factory=dict)
+
+
+def policy_rows(count: int):
+    for i in range(count):
+        # keys are built per row the way parsing a page or a stored json result makes them
+        extra = {"".join(("Agent", " Code")): f"A{i % 50}", "".join(("Line of", " Business")): "Auto"}
+        yield (f"POL-{i:07d}", f"01/{i % 28 + 1:02d}/2024", f"01/{i % 28 + 1:02d}/2025", f"${i % 5000}.00", "Active", extra)
+
+
+def build(count: int, policy_cls, result_cls, intern: bool):
+    result = result_cls()
+    for number, effective, expiration, premium, status, extra in policy_rows(count):
+        if intern:
+            extra = {sys.intern(k): v for k, v in extra.items()}
+        result.policies.append(policy_cls(policy_number=number, effective_date=effective, expiration_date=expiration,
+                                          premium=premium, status=status, additional_data=extra))
+    return result
+
+
+def measure_build(count: int, policy_cls, result_cls, intern: bool):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(count, policy_cls, result_cls, intern)
+    elapsed = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, held, elapsed
+
+
+def measure_serialize(label: str, write):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = write()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:28s} {elapsed:7.2f}s  peak {peak / 1e6:8.1f} MB  ({size / 1e6:.1f} MB of json)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    plain, plain_held, plain_time = measure_build(count, PlainPolicy, PlainResult, intern=False)
+    slotted, slotted_held, slotted_time = measure_build(count, Policy, ScrapeResult, intern=True)
+    print(f"holding {count} policies")
+    print(f"{'dataclasses':28s} {plain_time:7.2f}s  held {plain_held / 1e6:8.1f} MB")
+    print(f"{'slotted + interned keys':28s} {slotted_time:7.2f}s  held {slotted_held / 1e6:8.1f} MB")
+
+    def with_asdict():
+        return len(json.dumps(asdict(plain), default=json_default))
+
+    def with_writer():
+        out = io.StringIO()
+        write_result(out, slotted)
+        return out.tell()
+
+    print("serializing")
+    measure_serialize("json.dumps(asdict(result))", with_asdict)
+    measure_serialize("serialize.write_result", with_writer)
+
+    out = io.StringIO()
+    write_result(out, slotted)
+    same = out.getvalue() == json.dumps(asdict(slotted), default=json_default)
+    print(f"writer output {'identical to' if same else 'DIFFERS from'} json.dumps(asdict(result))")
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares BeautifulSoup tree builders on the same pages: time to build the tree and extract, and whether
+raw_data comes out identical to html.parser.
+
+    python benchmarks/bench_parsers.py                 # synthetic policy page
+    python benchmarks/bench_parsers.py page1.html ...  # saved carrier pages
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from generic_scraper import GenericScraper, PARSER_BACKENDS, resolve_parser
+
+
+def synthetic_page(rows: int = 2000) -> str:
+    body = ["<html><body><h1>Insured Details</h1>",
+            "<div><span>Insured Name:</span> <span>Jane Doe</span></div>",
+            "<dl><dt>Address:</dt><dd>1 Main St</dd><dt>Age:</dt><dd>42</dd></dl>",
+            "<h2>Agency</h2><ul><li>Agency Name: Acme Agency Producer Code: P-77</li></ul>",
+            "<h2>Policies</h2><table><tr><th>Policy Number</th><th>Effective Date</th><th>Premium</th><th>Status</th></tr>"]
+    for i in range(rows):
+        body.append(f"<tr><td>POL-{i:06d}</td><td>01/{i % 28 + 1:02d}/2024</td><td>${i * 3}.50</td><td>Active</td></tr>")
+    body.append("</table></body></html>")
+    return "".join(body)
+
+
+def run(pages, repeat: int = 3):
+    """Returns {backend: (best tree build seconds, raw_data per page)} for every installed backend"""
+    outputs = {}
+    for backend in PARSER_BACKENDS:
+        if resolve_parser(backend) != backend:
+            print(f"{backend:12s} not installed, skipped")
+            continue
+        scraper = GenericScraper(parser=backend)
+        best_build = best_extract = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            soups = [scraper.make_soup(html) for html in pages]
+            built = time.perf_counter()
+            raw = [scraper._extract_generic_data(soup) for soup in soups]
+            done = time.perf_counter()
+            best_build = built - start if best_build is None else min(best_build, built - start)
+            best_extract = done - built if best_extract is None else min(best_extract, done - built)
+        print(f"{backend:12s} build {best_build * 1000:9.1f} ms  extract {best_extract * 1000:9.1f} ms  ({len(pages)} page(s))")
+        outputs[backend] = (best_build, raw)
+    return outputs
+
+
+def main():
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sys.argv[1:]:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    else:
+        pages = [synthetic_page()]
+
+    outputs = run(pages)
+    reference = outputs['html.parser'][1]
+    identical = True
+    for backend, (_, raw) in outputs.items():
+        if backend == 'html.parser':
+            continue
+        same = raw == reference
+        identical = identical and same
+        print(f"{backend:12s} raw_data {'identical to' if same else 'DIFFERS from'} html.parser")
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Synthetic carrier sites for the benchmarks: every layout the generic scraper handles, with configurable size.
+
+A site is a dict of path -> html. Its policies are split over paginated pages /<site>/policies?page=N linked with
+numbered links and a "Next" link, and every page also carries the insured and agency details in a mix of
+header sections, dl/dt lists, "Label:" spans, mashed "Key: value Key: value" list items and nested lists.
+
+    python benchmarks/corpus.py out_dir --sites 3 --policies 5000   # write a corpus to disk
+"""
+import argparse
+import os
+import random
+from typing import Dict, List
+
+
+CARRIERS = ["Acme Mutual", "Northwind Casualty", "Blue Harbor Insurance", "Summit General", "Evergreen Assurance"]
+STATUSES = ["Active", "Cancelled", "Pending", "Expired"]
+COVERAGES = ["Auto", "Home", "Umbrella", "Commercial Property", "General Liability", "Workers Comp"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln"]
+FIRST = ["Jane", "John", "Maria", "Wei", "Aisha", "Carlos", "Priya", "Tom"]
+LAST = ["Doe", "Smith", "Garcia", "Chen", "Khan", "Rossi", "Patel", "Brown"]
+
+
+def _insured_block(rng: random.Random) -> str:
+    name = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+    address = f"{rng.randint(1, 9999)} {rng.choice(STREETS)}"
+    return (
+        "<h1>Insured Details</h1>"
+        f"<div><span>Insured Name:</span> <span>{name}</span></div>"
+        f"<dl><dt>Address:</dt><dd>{address}</dd><dt>Age:</dt><dd>{rng.randint(18, 90)}</dd>"
+        f"<dt>Email:</dt><dd>{name.split()[0].lower()}@example.com</dd></dl>"
+    )
+
+
+def _agency_block(rng: random.Random, carrier: str) -> str:
+    code = f"P-{rng.randint(100, 999)}"
+    return (
+        "<h2>Agency</h2>"
+        f"<ul><li>Agency Name: {carrier} Agency Producer Code: {code} Agency Code: AG{rng.randint(1000, 9999)}</li>"
+        f"<li><b>Producer:</b> <span>{rng.choice(FIRST)} {rng.choice(LAST)}</span></li>"
+        "<li>Offices<ul>"
+        + "".join(f"<li>Branch {i}: {rng.randint(1, 999)} {rng.choice(STREETS)}</li>" for i in range(1, 4))
+        + "</ul></li></ul>"
+    )
+
+
+def _notes_block(rng: random.Random) -> str:
+    return (
+        "<h2>Notes</h2>"
+        "<ol>"
+        + "".join(f"<li>Reviewed on 0{rng.randint(1, 9)}/1{rng.randint(0, 9)}/2024 by underwriting</li>" for _ in range(3))
+        + "</ol>"
+    )
+
+
+def _policy_rows(rng: random.Random, start: int, count: int, carrier: str) -> str:
+    rows: List[str] = []
+    for i in range(start, start + count):
+        month = rng.randint(1, 12)
+        rows.append(
+            f"<tr><td>POL-{i:07d}</td><td>{month:02d}/01/2024</td><td>{month:02d}/01/2025</td>"
+            f"<td>${rng.randint(200, 9000)}.{rng.randint(0, 99):02d}</td><td>{rng.choice(STATUSES)}</td>"
+            f"<td>{carrier}</td><td>{rng.choice(COVERAGES)}</td></tr>"
+        )
+        if rng.random() < 0.05:
+            # a detail row under the policy, the scraper folds it into the policy above
+            rows.append(f"<tr><td colspan=\"7\">Deductible: ${rng.randint(250, 2000)} Limit: ${rng.randint(10, 500)}000</td></tr>")
+    return "".join(rows)
+
+
+def _pagination(site: str, page: int, pages: int) -> str:
+    links = [f'<a href="/{site}/policies?page={n}">{n}</a>' for n in sorted({1, 2, 3, page, pages}) if 1 <= n <= pages]
+    if page < pages:
+        links.append(f'<a href="/{site}/policies?page={page + 1}">Next</a>')
+    return '<div class="pager">' + " ".join(links) + "</div>"
+
+
+def carrier_site(site: str, policies: int = 1000, per_page: int = 250, seed: int = 0) -> Dict[str, str]:
+    """path -> html for one carrier, policies spread over ceil(policies / per_page) pages"""
+    rng = random.Random(f"{site}:{seed}")
+    carrier = rng.choice(CARRIERS)
+    pages = max(1, -(-policies // per_page))
+    insured = _insured_block(rng)
+    agency = _agency_block(rng, carrier)
+    site_pages = {}
+    for page in range(1, pages + 1):
+        start = (page - 1) * per_page
+        count = min(per_page, policies - start)
+        html = (
+            f"<html><head><title>{carrier} policies</title></head><body>"
+            f"{insured}{agency}"
+            "<h2>Policies</h2><table>"
+            "<tr><th>Policy Number</th><th>Effective Date</th><th>Expiration Date</th><th>Premium</th>"
+            "<th>Status</th><th>Carrier</th><th>Coverage</th></tr>"
+            f"{_policy_rows(rng, start, count, carrier)}</table>"
+            f"{_notes_block(rng)}{_pagination(site, page, pages)}"
+            "</body></html>"
+        )
+        site_pages[f"/{site}/policies?page={page}"] = html
+    return site_pages
+
+
+def corpus(sites: int = 3, policies: int = 1000, per_page: int = 250, seed: int = 0) -> Dict[str, Dict[str, str]]:
+    """site name -> its pages, the first page of each is the crawl's start url"""
+    return {f"carrier{i}": carrier_site(f"carrier{i}", policies, per_page, seed) for i in range(sites)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic carrier corpus to disk")
+    parser.add_argument("out_dir")
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--policies", type=int, default=1000, help="policies per site")
+    parser.add_argument("--per-page", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for site, pages in corpus(args.sites, args.policies, args.per_page, args.seed).items():
+        for path, html in pages.items():
+            name = path.strip('/').replace('/', '_').replace('?', '_').replace('=', '') + '.html'
+            os.makedirs(args.out_dir, exist_ok=True)
+            with open(os.path.join(args.out_dir, name), 'w', encoding='utf-8') as f:
+                f.write(html)
+    print(f"Wrote {args.sites} sites to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+End to end benchmark on a synthetic corpus served from a local http server, no browser or network needed.
+
+Stages, each timed on its own over the whole corpus:
+    fetch   GenericScraper.fetch for every page (plain http tier against the local server)
+    parse   GenericScraper.parse_page on the fetched html
+    scrape  GenericScraper.scrape from each site's first page, fetch + parse + pagination + merge
+
+Reports pages/sec and policies/sec per stage and the process's peak RSS, and writes them to a json file.
+With --baseline the run is compared against an earlier results file and exits 1 when a stage got slower
+than --threshold allows.
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --baseline before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from corpus import corpus
+from generic_scraper import GenericScraper
+from scheduler import HostScheduler
+from server import CorpusServer
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def stage(seconds: float, pages: int, policies: int) -> Dict[str, Any]:
+    return {
+        "seconds": round(seconds, 4),
+        "pages": pages,
+        "policies": policies,
+        "pages_per_sec": round(pages / seconds, 2) if seconds else None,
+        "policies_per_sec": round(policies / seconds, 2) if seconds else None,
+    }
+
+
+def run_once(scraper: GenericScraper, server: CorpusServer, page_paths: List[str], start_paths: List[str]) -> Dict[str, Dict]:
+    results = {}
+
+    started = time.perf_counter()
+    fetched = [(server.url(path), scraper.fetch(server.url(path))) for path in page_paths]
+    results["fetch"] = stage(time.perf_counter() - started, len(fetched), 0)
+    missing = [url for url, html in fetched if not html]
+    if missing:
+        raise RuntimeError(f"{len(missing)} pages could not be fetched, e.g. {missing[0]}")
+
+    started = time.perf_counter()
+    policies = 0
+    for url, html in fetched:
+        result, _ = scraper.parse_page(html, url)
+        policies += len(result.policies)
+    results["parse"] = stage(time.perf_counter() - started, len(fetched), policies)
+
+    started = time.perf_counter()
+    requests_before = server.requests
+    policies = 0
+    # scrape() prints every next page it finds
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path in start_paths:
+            policies += len(scraper.scrape(server.url(path)).policies)
+    results["scrape"] = stage(time.perf_counter() - started, server.requests - requests_before, policies)
+    return results
+
+
+def best_of(runs: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+    return {name: min((r[name] for r in runs), key=lambda s: s["seconds"]) for name in runs[0]}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Prints the change per stage, False if any stage's pages/sec dropped by more than threshold"""
+    ok = True
+    print(f"\ncompared to {baseline.get('meta', {}).get('started', 'baseline')}:")
+    for name, now in current["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or not before.get("pages_per_sec") or not now.get("pages_per_sec"):
+            print(f"  {name:8s} no baseline")
+            continue
+        change = now["pages_per_sec"] / before["pages_per_sec"] - 1
+        regressed = change < -threshold
+        ok = ok and not regressed
+        print(f"  {name:8s} {before['pages_per_sec']:10.1f} -> {now['pages_per_sec']:10.1f} pages/s "
+              f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    before_rss = baseline.get("peak_rss_mb")
+    if before_rss:
+        print(f"  peak rss {before_rss:10.1f} -> {current['peak_rss_mb']:10.1f} MB")
+    return ok
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark fetch/parse/scrape on a synthetic carrier corpus")
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--policies", type=int, default=2000, help="policies per site")
+    parser.add_argument("--per-page", type=int, default=250, help="policies per paginated page")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before each response")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest one is reported")
+    parser.add_argument("--parser", default="lxml", help="BeautifulSoup tree builder")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier results json to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed pages/sec drop before a stage counts as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sites = corpus(args.sites, args.policies, args.per_page, args.seed)
+    pages = {}
+    for site_pages in sites.values():
+        pages.update(site_pages)
+    page_paths = list(pages)
+    start_paths = [next(iter(site_pages)) for site_pages in sites.values()]
+
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    # no politeness limits against our own server, they'd be all the benchmark measures
+    scheduler = HostScheduler(rate=0, initial_concurrency=8, max_concurrency=8)
+    with CorpusServer(pages, latency=args.latency) as server, GenericScraper(parser=args.parser, scheduler=scheduler) as scraper:
+        runs = [run_once(scraper, server, page_paths, start_paths) for _ in range(max(1, args.repeat))]
+
+    current = {
+        "meta": {
+            "started": started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parser": scraper.parser,
+            "sites": args.sites,
+            "policies_per_site": args.policies,
+            "per_page": args.per_page,
+            "latency": args.latency,
+            "repeat": args.repeat,
+        },
+        "stages": best_of(runs),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    for name, s in current["stages"].items():
+        print(f"{name:8s} {s['seconds']:8.3f}s  {s['pages_per_sec'] or 0:10.1f} pages/s  {s['policies_per_sec'] or 0:12.1f} policies/s")
+    print(f"peak rss {current['peak_rss_mb']:.1f} MB")
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
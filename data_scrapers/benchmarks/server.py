@@ -0,0 +1,107 @@
+"""
+Local http server standing in for carrier sites, serves a corpus (path -> html) with keep-alive and an optional
+per-request latency so network wait shows up in the numbers.
+
+    python benchmarks/server.py --port 8765 --sites 3 --policies 5000   # serve a generated corpus by hand
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, without this every response waits on delayed acks
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        html = self.server.pages.get(self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        if html is None:
+            body = b"not found"
+            self.send_response(404)
+        else:
+            body = html.encode('utf-8')
+            self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CorpusServer():
+    """
+    Serves pages on 127.0.0.1 from a background thread, use as a context manager:
+
+        with CorpusServer(pages, latency=0.05) as server:
+            server.url("/carrier0/policies?page=1")
+    """
+
+    def __init__(self, pages: Dict[str, str], port: int = 0, latency: float = 0.0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.pages = pages
+        self.httpd.latency = latency
+        self.httpd.requests = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def start(self) -> 'CorpusServer':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    from corpus import corpus
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic carrier corpus")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--policies", type=int, default=1000)
+    parser.add_argument("--per-page", type=int, default=250)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    pages = {}
+    for site_pages in corpus(args.sites, args.policies, args.per_page).values():
+        pages.update(site_pages)
+    server = CorpusServer(pages, port=args.port, latency=args.latency)
+    for path in sorted(p for p in pages if p.endswith("page=1")):
+        print(server.url(path))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import asyncio
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import ScrapeResult
+from browser_pool import AsyncBrowserPool
+from browser_extract import EXTRACT_SCRIPT, ExtractedPage
+from fetch_profile import navigate_async
+from scheduler import FetchError, network_time, raise_for_status
+
+
+class AsyncCrawlEngine():
+    """
+    Crawls many start urls and their pagination chains at the same time on top of async_playwright.
+    Pages of one chain are still visited in order so every start url gives the same ScrapeResult as GenericScraper.scrape,
+    the concurrency comes from running the chains side by side.
+    """
+
+    def __init__(self, scraper, concurrency: int = 8, per_host: Optional[int] = None, browsers: int = 2,
+                 max_pages_per_browser: int = 50, max_heap_mb: int = 512, prefetch_pages: int = 4):
+        # the scraper is only used for parsing and pagination detection, it never touches its own sync pool here
+        self.scraper = scraper
+        self.concurrency = concurrency
+        # per host limits, rates and retries come from the scraper's scheduler, per_host only sets where
+        # the adaptive limit starts for hosts it hasn't seen yet
+        self.scheduler = scraper.scheduler
+        if per_host is not None:
+            self.scheduler.initial_concurrency = per_host
+        self.prefetch_pages = prefetch_pages
+        self.pool = AsyncBrowserPool(size=browsers, max_pages_per_browser=max_pages_per_browser, max_heap_mb=max_heap_mb,
+                                     profile=scraper.fetch_profile)
+        self._global: Optional[asyncio.Semaphore] = None
+        # set by crawl_frontier, pages are checkpointed into it and chains resume from it
+        self.frontier = None
+
+    async def fetch(self, url: str) -> str:
+        if self.scraper.cache is not None:
+            cached = await asyncio.to_thread(self.scraper.cached_html, url)
+            if cached is not None:
+                return cached
+        try:
+            return await self.scheduler.run_async(url, self._fetch_live)
+        except FetchError as e:
+            print(f"Error fetching {url}: {e}")
+            return ""
+
+    async def _fetch_live(self, url: str) -> str:
+        async with self._global:
+            with self.scraper.metrics.profile("fetch", url):
+                tiers = self.scraper.tiers
+                if tiers is not None and tiers.wants_http(url):
+                    html = await asyncio.to_thread(tiers.try_http, url)
+                    if html is not None:
+                        tiers.served(tiers.HTTP)
+                        return html
+                html = await self.fetch_with_browser(url)
+                if html and tiers is not None:
+                    tiers.served(tiers.BROWSER)
+                return html
+
+    async def fetch_with_browser(self, url: str) -> str:
+        metrics = self.scraper.metrics
+        try:
+            async with self.pool.page() as page:
+                with metrics.timer("navigate", url):
+                    with network_time():
+                        response = await navigate_async(page, url, self.scraper.fetch_profile)
+                    if response is not None:
+                        raise_for_status(url, response.status, response.headers)
+                    if not self.scraper.browser_extract:
+                        content = await page.content()
+                if self.scraper.browser_extract:
+                    with metrics.timer("extract", url):
+                        return ExtractedPage(url, await page.evaluate(EXTRACT_SCRIPT))
+        except FetchError:
+            raise
+        except Exception as e:
+            raise FetchError(url, message=f"Browser fetch failed for {url}: {e}")
+        if content:
+            metrics.inc("bytes", len(content.encode('utf-8')), url)
+            if self.scraper.cache is not None:
+                await asyncio.to_thread(self.scraper.cache.put, url, content)
+        return content
+
+    async def load(self, url: str, on_links=None) -> Optional[Tuple[ScrapeResult, Optional[str]]]:
+        """Fetches and parses one page, None when it couldn't be fetched"""
+        html = await self.fetch(url)
+        if not html:
+            return None
+        return await asyncio.to_thread(self.scraper.parse_page, html, url, on_links, self.prefetch_pages)
+
+    async def scrape(self, start_url: str) -> Optional[ScrapeResult]:
+        """
+        Same bfs as GenericScraper.scrape, parsing runs in a worker thread so it doesn't stall other chains' network io.
+        None when crawling from a frontier and another worker took the chain over, it is left to that worker.
+
+        Pages are loaded ahead of their turn: the next page as soon as its link is found, and up to prefetch_pages
+        pages guessed from numbered links or the url's page param, fetched and parsed in parallel. Results are still
+        merged in chain order and a guessed page is only used once the chain's own next link reaches it. Guessing
+        stops for the chain once a page has no next link or a page couldn't be loaded, the guesses after it are dropped.
+        """
+        all_results = ScrapeResult()
+        visited_urls = set()
+        queue = [start_url]
+        page_index = 0
+        frontier = self.frontier
+        if frontier is not None:
+            all_results, visited_urls, resume_url, page_index = await asyncio.to_thread(frontier.restore, start_url)
+            queue = [resume_url] if resume_url else []
+        seen = all_results.policy_index()
+        loop = asyncio.get_running_loop()
+        # url -> task loading it, in the order they were started
+        ahead: Dict[str, asyncio.Task] = {}
+        current_url = None
+        # off once a page had no next link or a page couldn't be loaded, guesses would only run past the end
+        guessing = True
+
+        def start(url: str):
+            task = asyncio.ensure_future(self.load(url, partial(on_links, url)))
+            task.add_done_callback(partial(loaded_ahead, url))
+            ahead[url] = task
+
+        def cancel_after(url: Optional[str]):
+            """Cancels the pages started after url's, all of them when url isn't one of them"""
+            urls = list(ahead)
+            for later in urls[urls.index(url) + 1:] if url in ahead else urls:
+                ahead.pop(later).cancel()
+
+        def loaded_ahead(url: str, task: asyncio.Task):
+            nonlocal guessing
+            # pages nobody ends up waiting for shouldn't log "exception was never retrieved"
+            if task.cancelled() or (task.exception() is None and task.result() is not None):
+                return
+            # e.g. a 404 for a guess past the last page
+            guessing = False
+            if url in ahead:
+                cancel_after(url)
+
+        def links_found(source: str, next_link: Optional[str], predicted: List[str]):
+            nonlocal guessing
+            if source != current_url and source not in ahead:
+                # parsed by a guess that was cancelled in the meantime
+                return
+            if not next_link:
+                guessing = False
+                cancel_after(source)
+                return
+            if next_link not in visited_urls and next_link not in ahead:
+                if source == current_url:
+                    # the guesses missed this page, the ones after it are no better
+                    cancel_after(None)
+                    start(next_link)
+                elif guessing and len(ahead) <= self.prefetch_pages:
+                    start(next_link)
+            if not guessing:
+                return
+            for url in predicted:
+                if len(ahead) > self.prefetch_pages:
+                    break
+                if url not in visited_urls and url not in ahead:
+                    start(url)
+
+        def on_links(source: str, next_link: Optional[str], predicted: List[str]):
+            # called from the parser thread
+            loop.call_soon_threadsafe(links_found, source, next_link, predicted)
+
+        try:
+            while queue:
+                current_url = queue.pop(0)
+                if current_url in visited_urls:
+                    continue
+
+                visited_urls.add(current_url)
+
+                try:
+                    task = ahead.pop(current_url, None)
+                    loaded = await task if task is not None else await self.load(current_url, partial(on_links, current_url))
+                    if loaded is None:
+                        print(f"Failed to fetch {current_url}")
+                        self.scraper.metrics.inc("failures", url=current_url)
+                        continue
+
+                    result, next_link = loaded
+                    with self.scraper.metrics.timer("merge", current_url):
+                        self.scraper.metrics.inc("duplicates", all_results.merge(result, seen), current_url)
+                    if frontier is not None:
+                        if not await asyncio.to_thread(frontier.checkpoint, start_url, page_index, current_url,
+                                                       result, next_link):
+                            # our lease ran out and the chain was claimed again, the pages loading ahead go too
+                            print(f"{start_url} was taken over by another worker, stopping it here")
+                            return None
+                        page_index += 1
+
+                    if next_link and next_link not in visited_urls:
+                        print(f"Found next page: {next_link}")
+                        queue.append(next_link)
+
+                except Exception as e:
+                    print(f"Error scraping {current_url}: {e}")
+                    self.scraper.metrics.inc("failures", url=current_url)
+        finally:
+            for task in ahead.values():
+                task.cancel()
+            # links from parses still running in their threads are ignored from here on
+            ahead.clear()
+            current_url = None
+
+        return all_results
+
+    async def crawl(self, start_urls: List[str],
+                    on_result: Optional[Callable[[str, Optional[ScrapeResult]], None]] = None) -> List[Optional[ScrapeResult]]:
+        """
+        Returns one result per start url in the same order, None where the whole chain blew up.
+        With on_result every chain's result is handed over as soon as it finishes instead and nothing is kept.
+        """
+        # semaphores have to be created inside the running loop
+        self._global = asyncio.Semaphore(self.concurrency)
+        try:
+            return await asyncio.gather(*(self._run_chain(url, on_result) for url in start_urls))
+        finally:
+            await self.pool.close()
+
+    async def serve(self, start_urls: List[str], on_result: Callable[[str, Optional[ScrapeResult]], None]):
+        """
+        crawl() for an engine that stays up between calls, as the daemon's does: the browsers are left running for
+        the next call and the fetch limit is shared by every call in flight. close() once done with it.
+        """
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._run_chain(url, on_result) for url in start_urls))
+
+    async def close(self):
+        await self.pool.close()
+
+    async def _run_chain(self, url: str, on_result=None) -> Optional[ScrapeResult]:
+        error = None
+        try:
+            result = await self.scrape(url)
+            if result is None:
+                # taken over, the other worker hands the result over and completes the chain
+                return None
+            if self.frontier is not None and not await asyncio.to_thread(self.frontier.checkpointed, url):
+                # every page failed, e.g. the host is down, the chain goes back for another attempt
+                raise FetchError(url, message=f"No page of {url} could be loaded")
+        except Exception as e:
+            print(f"Error scraping {url}: {e}")
+            result, error = None, str(e)
+        if on_result is None:
+            return result
+        on_result(url, result)
+        if self.frontier is not None:
+            # only once the result is written out, a crash before this redoes the chain rather than losing it
+            if not await asyncio.to_thread(self.frontier.complete, url, result is not None, error):
+                print(f"{url} was taken over by another worker, its result may be written twice")
+        return None
+
+    async def crawl_frontier(self, frontier, on_result: Callable[[str, Optional[ScrapeResult]], None]):
+        """
+        Claims chains from the frontier and crawls them until there are none left. A few more chains than
+        fetch slots are kept going, so parsing and merging in one chain doesn't leave a slot idle.
+        """
+        self._global = asyncio.Semaphore(self.concurrency)
+        self.frontier = frontier
+        running = set()
+        try:
+            while True:
+                wanted = 2 * self.concurrency - len(running)
+                if wanted > 0:
+                    for url in await asyncio.to_thread(frontier.claim, wanted):
+                        running.add(asyncio.ensure_future(self._run_chain(url, on_result)))
+                if not running:
+                    break
+                _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in running:
+                task.cancel()
+            self.frontier = None
+            await self.pool.close()
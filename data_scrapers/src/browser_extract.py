@@ -0,0 +1,220 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from columnar import ColumnarTable
+from extraction import KEY_TAGS, LIST_TAGS
+from pagination import page_links
+
+
+HEADER_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# bs4 gives strings under these their own types, get_text() leaves them out unless it's called on one of them
+NON_TEXT_TAGS = ('script', 'style', 'template', 'rt', 'rp')
+# anchor texts longer than this can't be a next link or a page number, they stay in the page
+MAX_LINK_TEXT = 12
+
+# _extract_generic_data and DomExtractor run inside the rendered page. Text is what bs4's get_text(strip=True)
+# gives (python's whitespace for strip), everything ordering sensitive comes back as lists so python builds the
+# dicts: kv pairs as [key, value] lists, list items either such pairs or the li text for _parse_mashed_string,
+# tables as their headers and non header rows.
+_SCRIPT = """
+() => {
+    const HEADERS = new Set(%(headers)s);
+    const NON_TEXT = new Set(%(non_text)s);
+    const KEYS = %(keys)s.join(',');
+    const LISTS = new Set(%(lists)s);
+    const WS = /^[\\t\\n\\x0b\\x0c\\r\\x1c-\\x1f \\x85\\xa0\\u1680\\u2000-\\u200a\\u2028\\u2029\\u202f\\u205f\\u3000]+|[\\t\\n\\x0b\\x0c\\r\\x1c-\\x1f \\x85\\xa0\\u1680\\u2000-\\u200a\\u2028\\u2029\\u202f\\u205f\\u3000]+$/g;
+    const strip = s => s.replace(WS, '');
+    const isText = n => n.nodeType === 3 || n.nodeType === 4;
+    // bs4 counts comments and the like as strings when looking at a label's next sibling
+    const isString = n => isText(n) || n.nodeType === 7 || n.nodeType === 8;
+
+    // a string belongs to the innermost script, style, template, rt or rp around it, even above el. get_text()
+    // on a plain tag only takes strings outside all of those, on one of them only strings of its own kind
+    const kindOf = el => {
+        for (let n = el; n && n.nodeType === 1; n = n.parentNode) if (NON_TEXT.has(n.localName)) return n.localName;
+        return null;
+    };
+    const gather = (el, parts, want, kind) => {
+        for (let n = el.firstChild; n; n = n.nextSibling) {
+            if (isText(n)) {
+                if (kind === want) parts.push(n.data);
+            } else if (n.nodeType === 1) {
+                const inner = NON_TEXT.has(n.localName) ? n.localName : kind;
+                if (want !== null || inner === null) gather(n, parts, want, inner);
+            }
+        }
+    };
+    const texts = new Map();
+    const text = el => {
+        let t = texts.get(el);
+        if (t === undefined) {
+            const want = NON_TEXT.has(el.localName) ? el.localName : null;
+            const kind = kindOf(el);
+            const parts = [];
+            if (want !== null || kind === null) gather(el, parts, want, kind);
+            t = parts.map(strip).join('');
+            texts.set(el, t);
+        }
+        return t;
+    };
+    // whether get_text() without strip is at most limit characters, stops as soon as it's past
+    const shortText = (el, limit) => {
+        if (kindOf(el) !== null) return true;
+        let length = 0, chars = '';
+        const walk = el => {
+            for (let n = el.firstChild; n && length <= 2 * limit; n = n.nextSibling) {
+                if (isText(n)) { length += n.data.length; chars += n.data; }
+                else if (n.nodeType === 1 && !NON_TEXT.has(n.localName)) walk(n);
+            }
+        };
+        walk(el);
+        // utf-16 units, a python string counts astral characters once
+        return length <= limit || (length <= 2 * limit && Array.from(chars).length <= limit);
+    };
+    const unlabel = t => t.replace(/:+$/, '');
+
+    const pairs = new Map();
+    const labelPair = key => {
+        if (pairs.has(key)) return pairs.get(key);
+        let pair = null;
+        if (shortText(key, 50)) {
+            const t = text(key);
+            if (t.endsWith(':')) {
+                let sib = key.nextSibling;
+                while (sib && isString(sib) && !strip(sib.data)) sib = sib.nextSibling;
+                let value = null;
+                if (sib && isString(sib)) value = strip(sib.data);
+                else if (sib && sib.nodeType === 1) value = text(sib);
+                if (value) pair = [unlabel(t), value];
+            }
+        }
+        pairs.set(key, pair);
+        return pair;
+    };
+    const kvPairs = (dls, keys) => {
+        const found = [];
+        for (const dl of dls) {
+            const dts = dl.querySelectorAll('dt'), dds = dl.querySelectorAll('dd');
+            for (let i = 0; i < dts.length && i < dds.length; i++) found.push([unlabel(text(dts[i])), text(dds[i])]);
+        }
+        for (const key of keys) {
+            const pair = labelPair(key);
+            if (pair) found.push(pair);
+        }
+        return found;
+    };
+
+    const extract = root => {
+        const name = root.localName;
+        const tables = [];
+        for (const table of (name === 'table' ? [root] : root.querySelectorAll('table'))) {
+            const rows = [];
+            for (const tr of table.querySelectorAll('tr')) {
+                const cells = Array.from(tr.querySelectorAll('td, th'));
+                if (!cells.every(c => c.localName === 'th')) rows.push(cells.map(text));
+            }
+            if (rows.length) tables.push([Array.from(table.querySelectorAll('th'), text), rows]);
+        }
+        const lists = [];
+        for (const list of (LISTS.has(name) ? [root] : root.querySelectorAll('ul, ol'))) {
+            const items = [];
+            for (let li = list.firstChild; li; li = li.nextSibling) {
+                if (li.nodeType !== 1 || li.localName !== 'li') continue;
+                const local = kvPairs(li.querySelectorAll('dl'), li.querySelectorAll(KEYS));
+                items.push(local.length ? local : text(li));
+            }
+            if (items.length) lists.push(items);
+        }
+        const dls = name === 'dl' ? [root] : root.querySelectorAll('dl');
+        return [tables, lists, kvPairs(dls, root.querySelectorAll(KEYS))];
+    };
+
+    const anchors = [];
+    for (const a of document.querySelectorAll('a[href]')) {
+        const t = text(a);
+        if (t.length <= %(max_link)d) anchors.push([t, a.getAttribute('href')]);
+    }
+
+    const headers = document.querySelectorAll(Array.from(HEADERS).join(','));
+    if (!headers.length) return {general: extract(document), sections: null, anchors};
+    const sections = [];
+    for (const header of headers) {
+        const contents = [];
+        for (let sib = header.nextSibling; sib; sib = sib.nextSibling) {
+            if (sib.nodeType !== 1) continue;
+            if (HEADERS.has(sib.localName)) break;
+            contents.push(extract(sib));
+        }
+        sections.push([text(header), contents]);
+    }
+    return {general: null, sections, anchors};
+}
+"""
+
+EXTRACT_SCRIPT = _SCRIPT % {
+    "headers": json.dumps(list(HEADER_TAGS)),
+    "non_text": json.dumps(list(NON_TEXT_TAGS)),
+    "keys": json.dumps(sorted(KEY_TAGS)),
+    "lists": json.dumps(sorted(LIST_TAGS)),
+    "max_link": MAX_LINK_TEXT,
+}
+
+
+def _content(extracted: List, parse_mashed: Callable[[str], Dict[str, str]]) -> Dict[str, Any]:
+    """What DomExtractor.extract_nodes gives for the nodes the script extracted"""
+    tables = []
+    lists = []
+    kv_pairs = {}
+    for node_tables, node_lists, node_pairs in extracted:
+        for headers, rows in node_tables:
+            table = ColumnarTable(headers)
+            for row in rows:
+                table.add_row(row)
+            if table.row_count:
+                tables.append(table)
+        for items in node_lists:
+            list_data = []
+            for item in items:
+                if isinstance(item, str):
+                    parsed_kv = parse_mashed(item)
+                    list_data.append(parsed_kv if len(parsed_kv) > 1 else item)
+                else:
+                    list_data.append(dict(item))
+            lists.append(list_data)
+        kv_pairs.update(node_pairs)
+    return {"tables": tables, "lists": lists, "kv_pairs": kv_pairs}
+
+
+class ExtractedPage():
+    """
+    A rendered page as EXTRACT_SCRIPT brought it back from the browser, goes to parse_page in place of its html.
+    The DOM is never serialized with page.content() and parsed again, only the extracted strings cross over.
+
+    The extraction runs on the live DOM, which the browser built with the html5 parsing rules. That's what
+    html5lib gives, lxml can shape broken markup differently.
+    """
+    __slots__ = ('url', 'payload')
+
+    def __init__(self, url: str, payload: Dict[str, Any]):
+        self.url = url
+        self.payload = payload
+
+    def links(self) -> Tuple[Optional[str], Dict[int, str]]:
+        """The next page link and numbered page links, the same ones _find_next_page and numbered_links find"""
+        return page_links(self.url, self.payload["anchors"])
+
+    def raw_data(self, parse_mashed: Callable[[str], Dict[str, str]]) -> Dict[str, Any]:
+        """raw_data in the shape _extract_generic_data gives"""
+        data = {"General": {"tables": [], "kv_pairs": {}, "lists": []}}
+        if self.payload["sections"] is None:
+            data["General"] = _content([self.payload["general"]], parse_mashed)
+            return data
+        for name, extracted in self.payload["sections"]:
+            content = _content(extracted, parse_mashed)
+            if name in data:
+                data[name]["tables"].extend(content["tables"])
+                data[name]["lists"].extend(content["lists"])
+                data[name]["kv_pairs"].update(content["kv_pairs"])
+            else:
+                data[name] = content
+        return data
@@ -0,0 +1,244 @@
+import asyncio
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator, Deque, Iterator, List, Optional
+
+from playwright.sync_api import sync_playwright, Browser, BrowserContext, Page
+from playwright.async_api import async_playwright
+
+from fetch_profile import FetchProfile, install_routes, install_routes_async
+
+
+# Chromium only, returns 0 on engines that don't expose performance.memory
+JS_HEAP_SCRIPT = "() => (performance.memory && performance.memory.usedJSHeapSize) || 0"
+
+
+class PooledBrowser():
+    """
+    One warm browser with its own context. Pages are opened and closed per fetch, the browser and context stay alive.
+    """
+
+    def __init__(self, browser: Browser, context: BrowserContext):
+        self.browser = browser
+        self.context = context
+        self.pages_served = 0
+        self.needs_recycle = False
+        # pages currently open, only the async pool shares a browser between several pages
+        self.active = 0
+
+    def close(self):
+        try:
+            self.context.close()
+        except Exception:
+            pass
+        try:
+            self.browser.close()
+        except Exception:
+            pass
+
+
+class BrowserPool():
+    """
+    One warm headless chromium browser that is reused across fetch calls.
+    The browser is recycled (closed and relaunched) after max_pages_per_browser pages or when the
+    JS heap of a page it served grows past max_heap_mb.
+
+    Playwright's sync api is bound to the thread that started it so a pool must only be used from one thread, and
+    with one thread it serves a page at a time, a second browser would never be used. Threads that fetch in
+    parallel each have their own pool, AsyncBrowserPool shares several browsers between concurrent pages.
+    """
+
+    def __init__(self, max_pages_per_browser: int = 50, max_heap_mb: int = 512, headless: bool = True,
+                 profile: Optional[FetchProfile] = None):
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_heap_bytes = max_heap_mb * 1024 * 1024
+        self.headless = headless
+        # request blocking is set up once per context, not per page
+        self.profile = profile or FetchProfile()
+        self._playwright = None
+        self._idle: Deque[PooledBrowser] = deque()
+        self._all: List[PooledBrowser] = []
+        self.launches = 0
+
+    def _launch(self) -> PooledBrowser:
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        browser = self._playwright.chromium.launch(headless=self.headless)
+        context = browser.new_context()
+        install_routes(context, self.profile)
+        slot = PooledBrowser(browser, context)
+        self._all.append(slot)
+        self.launches += 1
+        return slot
+
+    def _retire(self, slot: PooledBrowser):
+        slot.close()
+        if slot in self._all:
+            self._all.remove(slot)
+
+    def acquire(self) -> PooledBrowser:
+        while self._idle:
+            slot = self._idle.popleft()
+            if slot.browser.is_connected():
+                return slot
+            # browser crashed or was killed while idle
+            self._retire(slot)
+        if self._all:
+            raise RuntimeError("BrowserPool exhausted, its browser is already in use")
+        return self._launch()
+
+    def release(self, slot: PooledBrowser):
+        if slot.needs_recycle or not slot.browser.is_connected() or slot.pages_served >= self.max_pages_per_browser:
+            self._retire(slot)
+            return
+        self._idle.append(slot)
+
+    @contextmanager
+    def page(self) -> Iterator[Page]:
+        """
+        Lends a fresh page from a warm browser, the page is closed and the browser goes back to the pool afterwards
+        """
+        slot = self.acquire()
+        page: Optional[Page] = None
+        try:
+            page = slot.context.new_page()
+            yield page
+            self._check_memory(slot, page)
+        except Exception:
+            # a failed navigation can leave the context in a weird state, start clean next time
+            if not slot.browser.is_connected():
+                slot.needs_recycle = True
+            raise
+        finally:
+            slot.pages_served += 1
+            if page is not None:
+                try:
+                    page.close()
+                except Exception:
+                    slot.needs_recycle = True
+            self.release(slot)
+
+    def _check_memory(self, slot: PooledBrowser, page: Page):
+        if not self.max_heap_bytes:
+            return
+        try:
+            used = page.evaluate(JS_HEAP_SCRIPT)
+        except Exception:
+            return
+        if used and used > self.max_heap_bytes:
+            slot.needs_recycle = True
+
+    def close(self):
+        for slot in list(self._all):
+            slot.close()
+        self._all.clear()
+        self._idle.clear()
+        if self._playwright is not None:
+            self._playwright.stop()
+            self._playwright = None
+
+
+class AsyncBrowserPool():
+    """
+    Async version of BrowserPool. A browser can serve several pages at once, new pages go to the
+    least busy browser. A browser due for recycling takes no new pages and is closed once its last page is done.
+    """
+
+    def __init__(self, size: int = 2, max_pages_per_browser: int = 50, max_heap_mb: int = 512, headless: bool = True,
+                 profile: Optional[FetchProfile] = None):
+        self.size = max(1, size)
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_heap_bytes = max_heap_mb * 1024 * 1024
+        self.headless = headless
+        # request blocking is set up once per context, not per page
+        self.profile = profile or FetchProfile()
+        self._playwright = None
+        self._slots: List[PooledBrowser] = []
+        self._lock = asyncio.Lock()
+        self.launches = 0
+
+    async def _launch(self) -> PooledBrowser:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        browser = await self._playwright.chromium.launch(headless=self.headless)
+        context = await browser.new_context()
+        await install_routes_async(context, self.profile)
+        slot = PooledBrowser(browser, context)
+        self._slots.append(slot)
+        self.launches += 1
+        return slot
+
+    async def _retire(self, slot: PooledBrowser):
+        if slot in self._slots:
+            self._slots.remove(slot)
+        try:
+            await slot.context.close()
+        except Exception:
+            pass
+        try:
+            await slot.browser.close()
+        except Exception:
+            pass
+
+    def _due(self, slot: PooledBrowser) -> bool:
+        return slot.needs_recycle or not slot.browser.is_connected() or slot.pages_served >= self.max_pages_per_browser
+
+    async def acquire(self) -> PooledBrowser:
+        async with self._lock:
+            for slot in list(self._slots):
+                if self._due(slot) and slot.active == 0:
+                    await self._retire(slot)
+            usable = [s for s in self._slots if not self._due(s)]
+            if len(self._slots) < self.size and (not usable or min(s.active for s in usable) > 0):
+                slot = await self._launch()
+            elif usable:
+                slot = min(usable, key=lambda s: s.active)
+            else:
+                # every browser is draining before a recycle, go over size briefly rather than block
+                slot = await self._launch()
+            slot.active += 1
+            return slot
+
+    async def release(self, slot: PooledBrowser):
+        async with self._lock:
+            slot.active -= 1
+            if slot.active == 0 and self._due(slot):
+                await self._retire(slot)
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator:
+        slot = await self.acquire()
+        page = None
+        try:
+            page = await slot.context.new_page()
+            yield page
+            await self._check_memory(slot, page)
+        except Exception:
+            if not slot.browser.is_connected():
+                slot.needs_recycle = True
+            raise
+        finally:
+            slot.pages_served += 1
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception:
+                    slot.needs_recycle = True
+            await self.release(slot)
+
+    async def _check_memory(self, slot: PooledBrowser, page):
+        if not self.max_heap_bytes:
+            return
+        try:
+            used = await page.evaluate(JS_HEAP_SCRIPT)
+        except Exception:
+            return
+        if used and used > self.max_heap_bytes:
+            slot.needs_recycle = True
+
+    async def close(self):
+        for slot in list(self._slots):
+            await self._retire(slot)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
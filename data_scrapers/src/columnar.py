@@ -0,0 +1,96 @@
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from models import TypedValue
+
+
+class ColumnarTable():
+    """
+    A scraped table with the header strings kept once and one list of cell values per column, instead of a dict
+    per row repeating every header. Rows whose cell count doesn't match the headers are kept as they are in
+    `fallback` (row position -> values), those are the {"values": [...]} rows of the list-of-dicts form.
+
+    to_rows()/to_dict() give back exactly what raw_data always held, json_default() does that for json.dumps.
+    """
+    __slots__ = ('headers', 'columns', 'row_count', 'fallback')
+
+    def __init__(self, headers: List[str]):
+        self.headers = headers
+        self.columns: List[List[str]] = [[] for _ in headers]
+        self.row_count = 0
+        self.fallback: Dict[int, List[str]] = {}
+
+    def add_row(self, values: List[str]):
+        if len(values) == len(self.headers):
+            # no headers and no cells gives an empty row dict, which was never kept
+            if not values:
+                return
+            for column, value in zip(self.columns, values):
+                column.append(value)
+        else:
+            self.fallback[self.row_count] = values
+        self.row_count += 1
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ColumnarTable):
+            return (self.headers == other.headers and self.columns == other.columns
+                    and self.fallback == other.fallback)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def keyed_columns(self) -> Tuple[Tuple[str, ...], List[List[str]]]:
+        """
+        The keys a row dict of this table has and the column behind each, a repeated header keeps its first
+        position and the last column's values like assigning into a dict does
+        """
+        last: Dict[str, int] = {}
+        for i, header in enumerate(self.headers):
+            last[header] = i
+        return tuple(last), [self.columns[i] for i in last.values()]
+
+    def iter_rows(self) -> Iterator[Tuple[Optional[Tuple[str, ...]], Optional[List[str]]]]:
+        """(keyed values, None) for full rows and (None, values) for fallback rows, in table order"""
+        _, columns = self.keyed_columns()
+        full_rows = zip(*columns)
+        fallback = self.fallback
+        for position in range(self.row_count):
+            values = fallback.get(position)
+            if values is None:
+                yield next(full_rows), None
+            else:
+                yield None, values
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        keys, _ = self.keyed_columns()
+        rows = []
+        for full, values in self.iter_rows():
+            if full is None:
+                rows.append({"values": values})
+            else:
+                rows.append(dict(zip(keys, full)))
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "table", "data": self.to_rows()}
+
+    def __repr__(self) -> str:
+        return f"ColumnarTable(headers={self.headers!r}, rows={self.row_count})"
+
+
+def json_default(obj):
+    """default= hook for json.dumps on anything holding raw_data or normalized policies"""
+    if isinstance(obj, ColumnarTable):
+        return obj.to_dict()
+    if isinstance(obj, TypedValue):
+        return {"value": obj.value, "confidence": obj.confidence}
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        # a string keeps the amount's digits exactly, a float wouldn't
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
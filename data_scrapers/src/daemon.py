@@ -0,0 +1,367 @@
+import asyncio
+import itertools
+import json
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from http.client import HTTPConnection, HTTPResponse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from models import ScrapeResult
+from serialize import dumps
+
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# job and queue wait latency buckets, seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# sent after a job's last result, the client stops reading there
+_DONE = object()
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """("unix", path) for unix:PATH or anything with a slash, ("tcp", (host, port)) for HOST:PORT or a bare port"""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if "/" in address:
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+class ScrapeDaemon():
+    """
+    A GenericScraper kept warm between scrape jobs: its browsers, keep-alive http connections, page cache, learned
+    site plans and mapping caches stay loaded, so a job only costs its own fetching and parsing.
+
+    One event loop thread owns an AsyncCrawlEngine that is never closed between jobs. Jobs are submitted from any
+    thread and at most max_jobs run at once, the rest wait their turn. Running jobs share the engine's fetch limit
+    and the scraper's per host scheduling like the chains of one crawl do. Every job's queue wait and run time go
+    into histograms for stats().
+    """
+
+    def __init__(self, scraper_kwargs: Dict[str, Any], concurrency: int = 8, browsers: int = 2, max_jobs: int = 4,
+                 prefetch_pages: int = 4):
+        self.scraper_kwargs = scraper_kwargs
+        self.concurrency = concurrency
+        self.browsers = browsers
+        self.max_jobs = max(1, max_jobs)
+        self.prefetch_pages = prefetch_pages
+        self.scraper = None
+        self.engine = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.urls_done = 0
+        self.urls_failed = 0
+        self.started_at = time.time()
+
+    def start(self):
+        # the heavy imports (playwright, bs4) happen here, once for the daemon's lifetime
+        from generic_scraper import GenericScraper
+        from async_engine import AsyncCrawlEngine
+        from metrics import Histogram
+
+        self.scraper = GenericScraper(**self.scraper_kwargs)
+        # every page url of every job would stay in the per url timings for the daemon's whole life
+        self.scraper.metrics.track_urls = False
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            # the engine's pool and semaphores belong to this loop
+            self.engine = AsyncCrawlEngine(self.scraper, concurrency=self.concurrency, browsers=self.browsers,
+                                           max_pages_per_browser=self.scraper.pool.max_pages_per_browser,
+                                           max_heap_mb=self.scraper.pool.max_heap_bytes // (1024 * 1024),
+                                           prefetch_pages=self.prefetch_pages)
+            self._slots = asyncio.Semaphore(self.max_jobs)
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="scrape-daemon", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def submit(self, urls: List[str], on_result: Callable[[str, Optional[ScrapeResult]], None]) -> Future:
+        """Queues a job, on_result gets every start url's result (None if it failed) from the daemon's loop thread"""
+        with self._lock:
+            self.queued += 1
+        return asyncio.run_coroutine_threadsafe(self._job(urls, on_result), self._loop)
+
+    async def _job(self, urls: List[str], on_result) -> Dict[str, Any]:
+        submitted = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.queue_wait.observe(started - submitted)
+        counts = {"results": 0, "failed": 0}
+
+        def handle(url: str, result: Optional[ScrapeResult]):
+            counts["results" if result is not None else "failed"] += 1
+            on_result(url, result)
+
+        try:
+            await self.engine.serve(urls, handle)
+        finally:
+            self._slots.release()
+            finished = time.perf_counter()
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.urls_done += counts["results"]
+                self.urls_failed += counts["failed"]
+                self.latency.observe(finished - started)
+        return dict(counts, queued_seconds=round(started - submitted, 3), seconds=round(finished - started, 3))
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "urls_done": self.urls_done,
+                "urls_failed": self.urls_failed,
+                "queue_wait": self._latency_summary(self.queue_wait),
+                "latency": self._latency_summary(self.latency),
+            }
+        stats["metrics"] = self.scraper.metrics.report()
+        stats["hosts"] = self.scraper.scheduler.report()
+        return stats
+
+    @staticmethod
+    def _latency_summary(hist) -> Dict[str, Any]:
+        # quantiles are bucket upper bounds
+        return {"count": hist.count, "avg": round(hist.sum / hist.count, 3) if hist.count else None,
+                "p50": hist.quantile(0.5), "p95": hist.quantile(0.95), "p99": hist.quantile(0.99)}
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.engine.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self.scraper.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    POST /jobs {"urls": [...], "raw": true} streams one json line per start url as it finishes (the record the jsonl
+    output has, or {"source_url": ..., "failed": true}) and a last {"done": true, ...} line with the job's counts.
+    GET /stats gives queue depth, job latency and the scraper's metrics.
+    """
+    server: 'DaemonServer'
+    # no content length for streamed results, the body ends when the connection closes
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._json(200, self.server.scrape_daemon.stats())
+        elif self.path == "/health":
+            self._json(200, {"ok": True})
+        else:
+            self._json(404, {"error": f"no such endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._json(404, {"error": f"no such endpoint {self.path}"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            urls = [url for url in job["urls"] if url]
+        except (ValueError, KeyError, TypeError):
+            self._json(400, {"error": 'expected {"urls": [...]}'})
+            return
+        include_raw = bool(job.get("raw", True))
+
+        daemon = self.server.scrape_daemon
+        job_id = daemon.next_id()
+        results: "queue.Queue" = queue.Queue()
+        future = daemon.submit(urls, lambda url, result: results.put((url, result)))
+        future.add_done_callback(lambda _: results.put(_DONE))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                url, result = item
+                # serialized on this thread, not on the daemon's loop
+                if result is None:
+                    line = json.dumps({"source_url": url, "failed": True})
+                else:
+                    line = dumps(result, include_raw=include_raw, source_url=url)
+                self.wfile.write(line.encode('utf-8') + b"\n")
+                self.wfile.flush()
+            if future.cancelled() or future.exception() is not None:
+                summary = {"done": True, "job": job_id, "error": str(future.exception()) if not future.cancelled() else "cancelled"}
+            else:
+                summary = dict(future.result(), done=True, job=job_id)
+            self.wfile.write(json.dumps(summary).encode('utf-8') + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client went away, nobody is reading the rest of the job
+            future.cancel()
+
+
+class DaemonServer(ThreadingHTTPServer):
+    """The daemon's job api on a local tcp port or a unix socket, a thread per connection"""
+    daemon_threads = True
+
+    def __init__(self, address: str, daemon: ScrapeDaemon):
+        kind, where = parse_address(address)
+        self.scrape_daemon = daemon
+        self.unix_path = None
+        if kind == "unix":
+            self.address_family = socket.AF_UNIX
+            if os.path.exists(where):
+                # left behind by a daemon that didn't shut down cleanly
+                os.unlink(where)
+            self.unix_path = where
+        super().__init__(where, _Handler)
+
+    def server_bind(self):
+        if self.unix_path is None:
+            super().server_bind()
+            return
+        # HTTPServer.server_bind wants a (host, port) to name itself by
+        self.socket.bind(self.unix_path)
+        self.server_address = self.unix_path
+        self.server_name, self.server_port = "localhost", 0
+
+    def server_close(self):
+        super().server_close()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+
+def serve(address: str, daemon: ScrapeDaemon):
+    """Runs the job api until interrupted or terminated"""
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # a service manager stops it with SIGTERM, the browsers and the socket file go away the same way as on ctrl-c
+    signal.signal(signal.SIGTERM, stop)
+    daemon.start()
+    server = DaemonServer(address, daemon)
+    print(f"Scrape daemon listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+
+
+# client side, only the standard library and the models, no browser or parser imports
+
+class _UnixConnection(HTTPConnection):
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DaemonClient():
+    """Talks to a running daemon, what the CLI uses instead of scraping in its own process"""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: Optional[float] = None):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> HTTPConnection:
+        kind, where = parse_address(self.address)
+        if kind == "unix":
+            return _UnixConnection(where, timeout=self.timeout)
+        return HTTPConnection(*where, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[HTTPConnection, HTTPResponse]:
+        conn = self._connection()
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+        if response.status != 200:
+            message = response.read().decode('utf-8', errors='replace')
+            conn.close()
+            raise RuntimeError(f"daemon answered {response.status}: {message}")
+        return conn, response
+
+    def stats(self) -> Dict[str, Any]:
+        conn, response = self._request("GET", "/stats")
+        try:
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def scrape(self, urls: List[str], include_raw: bool = True) -> Iterator[Tuple[str, Optional[ScrapeResult]]]:
+        """(start url, result or None) as the daemon finishes each, the job's summary ends up in last_summary"""
+        self.last_summary: Optional[Dict[str, Any]] = None
+        conn, response = self._request("POST", "/jobs", {"urls": urls, "raw": include_raw})
+        try:
+            for line in response:
+                record = json.loads(line)
+                if record.get("done"):
+                    self.last_summary = record
+                    break
+                url = record.pop("source_url")
+                yield url, None if record.get("failed") else ScrapeResult.from_dict(record)
+        finally:
+            conn.close()
+
+
+def stats_report(stats: Dict[str, Any]) -> str:
+    """A line for the daemon's /stats, quantiles are bucket upper bounds"""
+    def latency(name: str) -> str:
+        summary = stats[name]
+        if not summary["count"]:
+            return "none yet"
+        return f"avg {summary['avg']}s p50 <={summary['p50']}s p95 <={summary['p95']}s"
+    return (f"{stats['queued']} jobs queued, {stats['running']} running, {stats['completed']} completed "
+            f"({stats['urls_done']} urls done, {stats['urls_failed']} failed), queue wait {latency('queue_wait')}, "
+            f"job latency {latency('latency')}")
@@ -0,0 +1,283 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bs4.element import CData, NavigableString
+
+from columnar import ColumnarTable
+
+
+# tags whose text may be a "Label:" for the sibling that follows it
+KEY_TAGS = {'b', 'strong', 'label', 'span', 'div'}
+LIST_TAGS = {'ul', 'ol'}
+
+
+def _plain_text_tag(tag) -> bool:
+    """
+    get_text() on script/style/template/rt/rp collects a different kind of string than every other tag,
+    those few are left to bs4 instead of the cached text
+    """
+    types = getattr(tag, 'interesting_string_types', None)
+    return types is None or (len(types) == 2 and NavigableString in types and CData in types)
+
+
+class _Table():
+    __slots__ = ('headers', 'rows')
+
+    def __init__(self):
+        self.headers = []
+        self.rows = []
+
+
+class _DefinitionList():
+    __slots__ = ('dts', 'dds')
+
+    def __init__(self):
+        self.dts = []
+        self.dds = []
+
+
+class _KvScope():
+    """Collects what a key-value lookup on `node` would see: its dl's and its candidate label tags"""
+    __slots__ = ('node', 'dls', 'keys')
+
+    def __init__(self, node):
+        self.node = node
+        self.dls = []
+        self.keys = []
+
+
+class DomExtractor():
+    """
+    Extracts tables, lists and key-value pairs from a node in a single walk of its subtree.
+
+    The walk records which table, tr, dl, list item etc. every element belongs to and where its text starts and ends
+    in one flat list of stripped strings, so the text of any element is a slice of that list instead of a fresh
+    get_text() over its subtree. The output is the same tables/lists/kv_pairs structure the old per-kind find_all
+    scans produced, including their quirks (nested tables, rows and dl's are also counted by their ancestors),
+    except that tables come out as ColumnarTable (to_dict() gives the old {"type": "table", "data": rows} form).
+    """
+
+    def __init__(self, parse_mashed: Callable[[str], Dict[str, str]]):
+        self.parse_mashed = parse_mashed
+
+    def extract_nodes(self, nodes: List) -> Dict[str, Any]:
+        """Helper when we have a list of sibling nodes"""
+        tables = []
+        lists = []
+        kv_pairs = {}
+        for node in nodes:
+            if isinstance(node, str):
+                continue
+            if not getattr(node, 'name', None):
+                continue
+            content = self.extract(node)
+            tables.extend(content["tables"])
+            lists.extend(content["lists"])
+            kv_pairs.update(content["kv_pairs"])
+        return {"tables": tables, "lists": lists, "kv_pairs": kv_pairs}
+
+    def extract(self, node) -> Dict[str, Any]:
+        walk = _Walk(node)
+        walk.run()
+        return {
+            "tables": walk.tables_output(),
+            "lists": walk.lists_output(self.parse_mashed),
+            "kv_pairs": walk.kv_output(walk.root_scope),
+        }
+
+
+class _Walk():
+
+    def __init__(self, root):
+        self.root = root
+        self.root_is_table = root.name == 'table'
+        self.root_is_list = root.name in LIST_TAGS
+        self.root_is_dl = root.name == 'dl'
+
+        # flat text of the subtree, spans index into it
+        self.pieces: List[str] = []
+        self.raw_length = 0
+        self.spans: Dict[int, Tuple[int, int, int, int]] = {}
+        self._text_cache: Dict[int, str] = {}
+        self._pair_cache: Dict[int, Optional[Tuple[str, str]]] = {}
+
+        self.tables: List[_Table] = []
+        # list element id -> items, in document order of the lists
+        self.lists: Dict[int, List[Tuple[Any, _KvScope]]] = {}
+        self.root_scope = _KvScope(root)
+
+    def run(self):
+        root = self.root
+        open_tables: List[Tuple[Any, _Table]] = []
+        open_rows: List[Tuple[Any, list]] = []
+        open_dls: List[Tuple[Any, _DefinitionList]] = []
+        open_scopes: List[_KvScope] = [self.root_scope]
+        starts: Dict[int, Tuple[int, int]] = {}
+
+        self._enter(root, open_tables, open_rows, open_dls, open_scopes)
+        starts[id(root)] = (len(self.pieces), self.raw_length)
+        stack = [(root, iter(root.contents))]
+        while stack:
+            elem, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                piece_start, raw_start = starts.pop(id(elem))
+                self.spans[id(elem)] = (piece_start, len(self.pieces), raw_start, self.raw_length)
+                if open_tables and open_tables[-1][0] is elem:
+                    open_tables.pop()
+                if open_rows and open_rows[-1][0] is elem:
+                    open_rows.pop()
+                if open_dls and open_dls[-1][0] is elem:
+                    open_dls.pop()
+                if len(open_scopes) > 1 and open_scopes[-1].node is elem:
+                    open_scopes.pop()
+                continue
+
+            if isinstance(child, NavigableString):
+                kind = type(child)
+                if kind is NavigableString or kind is CData:
+                    self.raw_length += len(child)
+                    stripped = child.strip()
+                    if stripped:
+                        self.pieces.append(stripped)
+                continue
+
+            self._enter(child, open_tables, open_rows, open_dls, open_scopes)
+            starts[id(child)] = (len(self.pieces), self.raw_length)
+            stack.append((child, iter(child.contents)))
+
+    def _enter(self, elem, open_tables, open_rows, open_dls, open_scopes):
+        name = elem.name
+        is_root = elem is self.root
+
+        if name == 'table' and (is_root or not self.root_is_table):
+            table = _Table()
+            self.tables.append(table)
+            open_tables.append((elem, table))
+        elif name == 'tr':
+            row = []
+            for _, table in open_tables:
+                table.rows.append(row)
+            open_rows.append((elem, row))
+        elif name in ('td', 'th'):
+            if name == 'th':
+                for _, table in open_tables:
+                    table.headers.append(elem)
+            for _, row in open_rows:
+                row.append(elem)
+        elif name in LIST_TAGS and (is_root or not self.root_is_list):
+            self.lists[id(elem)] = []
+        elif name == 'li' and not is_root and id(elem.parent) in self.lists:
+            scope = _KvScope(elem)
+            self.lists[id(elem.parent)].append((elem, scope))
+            open_scopes.append(scope)
+        elif name == 'dl':
+            dl = _DefinitionList()
+            open_dls.append((elem, dl))
+            for scope in open_scopes:
+                if scope is self.root_scope and self.root_is_dl and not is_root:
+                    continue
+                scope.dls.append(dl)
+        elif name == 'dt':
+            for _, dl in open_dls:
+                dl.dts.append(elem)
+        elif name == 'dd':
+            for _, dl in open_dls:
+                dl.dds.append(elem)
+
+        if name in KEY_TAGS and not is_root:
+            for scope in open_scopes:
+                scope.keys.append(elem)
+
+    def text(self, elem) -> str:
+        """Same as elem.get_text(strip=True) but sliced out of the walk's text"""
+        key = id(elem)
+        cached = self._text_cache.get(key)
+        if cached is not None:
+            return cached
+        span = self.spans.get(key)
+        if span is None or not _plain_text_tag(elem):
+            text = elem.get_text(strip=True)
+        else:
+            text = "".join(self.pieces[span[0]:span[1]])
+        self._text_cache[key] = text
+        return text
+
+    def raw_length_of(self, elem) -> int:
+        span = self.spans.get(id(elem))
+        if span is None:
+            return len(elem.get_text())
+        return span[3] - span[2]
+
+    def tables_output(self) -> List[ColumnarTable]:
+        found = []
+        for table in self.tables:
+            columnar = ColumnarTable([self.text(th) for th in table.headers])
+            for cells in table.rows:
+                if all(c.name == 'th' for c in cells):
+                    continue
+                columnar.add_row([self.text(c) for c in cells])
+
+            if columnar.row_count:
+                found.append(columnar)
+        return found
+
+    def lists_output(self, parse_mashed) -> List[List]:
+        found = []
+        for items in self.lists.values():
+            list_data = []
+            for li, scope in items:
+                local_kvs = self.kv_output(scope)
+                if local_kvs:
+                    list_data.append(local_kvs)
+                else:
+                    text = self.text(li)
+                    parsed_kv = parse_mashed(text)
+                    if len(parsed_kv) > 1:
+                        list_data.append(parsed_kv)
+                    else:
+                        list_data.append(text)
+
+            if list_data:
+                found.append(list_data)
+        return found
+
+    def kv_output(self, scope: _KvScope) -> Dict[str, str]:
+        data = {}
+        for dl in scope.dls:
+            for dt, dd in zip(dl.dts, dl.dds):
+                data[self.text(dt).rstrip(':')] = self.text(dd)
+
+        for pk in scope.keys:
+            pair = self._label_pair(pk)
+            if pair:
+                data[pair[0]] = pair[1]
+        return data
+
+    def _label_pair(self, pk) -> Optional[Tuple[str, str]]:
+        key_id = id(pk)
+        if key_id in self._pair_cache:
+            return self._pair_cache[key_id]
+
+        pair = None
+        if self.raw_length_of(pk) <= 50:
+            text = self.text(pk)
+            if text.endswith(':'):
+                key = text.rstrip(':')
+
+                next_sib = pk.next_sibling
+                val = None
+
+                while next_sib and (isinstance(next_sib, str) and not next_sib.strip()):
+                    next_sib = next_sib.next_sibling
+
+                if isinstance(next_sib, str) and next_sib.strip():
+                    val = next_sib.strip()
+                elif next_sib and getattr(next_sib, 'name', None):
+                    val = self.text(next_sib)
+
+                if val:
+                    pair = (key, val)
+
+        self._pair_cache[key_id] = pair
+        return pair
@@ -0,0 +1,146 @@
+import json
+import re
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+
+# true once the page has something the extractors would pick up, the same markers http_fetch.looks_complete checks
+# on raw html: a filled table cell or dd, a short "Label:" tag, or a list item with several "key: value" pieces
+DATA_READY_SCRIPT = """() => {
+    const filled = el => /\\S/.test(el.textContent);
+    for (const cell of document.querySelectorAll('td, dd')) if (filled(cell)) return true;
+    for (const el of document.querySelectorAll('b, strong, label, span, div')) {
+        if (el.childElementCount > 2) continue;
+        const text = el.textContent.trim();
+        if (text.length > 1 && text.length <= 50 && text.endsWith(':')) return true;
+    }
+    for (const li of document.querySelectorAll('ul > li, ol > li')) {
+        if ((li.textContent.match(/:/g) || []).length >= 2) return true;
+    }
+    return false;
+}"""
+# how often the data check runs while waiting, ms
+DATA_POLL_MS = 100
+
+# resolves once the DOM had no mutations for quiet_ms, or after max_ms whatever happens
+DOM_STABLE_SCRIPT = """([quietMs, maxMs]) => new Promise(resolve => {
+    let timer = null;
+    const observer = new MutationObserver(() => { clearTimeout(timer); timer = setTimeout(done, quietMs); });
+    const cap = setTimeout(done, maxMs);
+    function done() { observer.disconnect(); clearTimeout(timer); clearTimeout(cap); resolve(true); }
+    observer.observe(document, {subtree: true, childList: true, characterData: true, attributes: true});
+    timer = setTimeout(done, quietMs);
+})"""
+
+
+@dataclass
+class FetchProfile:
+    """
+    How the browser loads a page: which requests get blocked and when the page counts as ready.
+    Readiness steps run in order after navigation and all of them share timeout_ms, the data and
+    dom stability waits are soft (the page is taken as is when they run out).
+    """
+    block_resource_types: List[str] = field(default_factory=lambda: ["image", "media", "font", "stylesheet"])
+    # regexes matched against request urls
+    block_url_patterns: List[str] = field(default_factory=lambda: [
+        r"google-analytics\.com", r"googletagmanager\.com", r"doubleclick\.net", r"facebook\.net",
+        r"hotjar\.com", r"segment\.(io|com)", r"newrelic\.com", r"nr-data\.net", r"optimizely\.com",
+    ])
+    # load / domcontentloaded / networkidle / commit
+    wait_until: str = "domcontentloaded"
+    # hard wait, the fetch fails if it never shows up
+    wait_for_selector: Optional[str] = None
+    # soft wait for the first thing the extractors recognize (DATA_READY_SCRIPT)
+    wait_for_data: bool = True
+    data_timeout_ms: int = 5000
+    # soft wait for the DOM to stop changing, 0 to skip
+    dom_stable_ms: int = 500
+    timeout_ms: int = 30000
+
+    def __post_init__(self):
+        self._blocked_urls = re.compile("|".join(self.block_url_patterns)) if self.block_url_patterns else None
+        self._blocked_types = set(self.block_resource_types)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'FetchProfile':
+        with open(path, 'r') as f:
+            return cls(**json.load(f))
+
+    @property
+    def blocks_anything(self) -> bool:
+        return bool(self._blocked_types or self._blocked_urls)
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self._blocked_types:
+            return True
+        return bool(self._blocked_urls and self._blocked_urls.search(url))
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def install_routes(context, profile: FetchProfile):
+    """Request interception for a sync BrowserContext, every page opened from it inherits the blocking"""
+    if not profile.blocks_anything:
+        return
+
+    def handle(route):
+        request = route.request
+        if profile.should_block(request.resource_type, request.url):
+            route.abort()
+        else:
+            route.continue_()
+
+    context.route("**/*", handle)
+
+
+async def install_routes_async(context, profile: FetchProfile):
+    if not profile.blocks_anything:
+        return
+
+    async def handle(route):
+        request = route.request
+        if profile.should_block(request.resource_type, request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", handle)
+
+
+def _remaining(deadline: float) -> int:
+    return max(1, int((deadline - time.monotonic()) * 1000))
+
+
+def navigate(page, url: str, profile: FetchProfile):
+    """goto plus the profile's readiness steps for a sync page, returns goto's response (None for same-document navigations)"""
+    deadline = time.monotonic() + profile.timeout_ms / 1000
+    response = page.goto(url, wait_until=profile.wait_until, timeout=profile.timeout_ms)
+    if profile.wait_for_selector:
+        page.wait_for_selector(profile.wait_for_selector, timeout=_remaining(deadline))
+    if profile.wait_for_data:
+        try:
+            page.wait_for_function(DATA_READY_SCRIPT, timeout=min(profile.data_timeout_ms, _remaining(deadline)),
+                                  polling=DATA_POLL_MS)
+        except Exception:
+            pass
+    if profile.dom_stable_ms:
+        page.evaluate(DOM_STABLE_SCRIPT, [profile.dom_stable_ms, _remaining(deadline)])
+    return response
+
+
+async def navigate_async(page, url: str, profile: FetchProfile):
+    deadline = time.monotonic() + profile.timeout_ms / 1000
+    response = await page.goto(url, wait_until=profile.wait_until, timeout=profile.timeout_ms)
+    if profile.wait_for_selector:
+        await page.wait_for_selector(profile.wait_for_selector, timeout=_remaining(deadline))
+    if profile.wait_for_data:
+        try:
+            await page.wait_for_function(DATA_READY_SCRIPT, timeout=min(profile.data_timeout_ms, _remaining(deadline)),
+                                        polling=DATA_POLL_MS)
+        except Exception:
+            pass
+    if profile.dom_stable_ms:
+        await page.evaluate(DOM_STABLE_SCRIPT, [profile.dom_stable_ms, _remaining(deadline)])
+    return response
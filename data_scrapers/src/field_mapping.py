@@ -0,0 +1,197 @@
+import copy
+import json
+import re
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from models import Agency, Insured, Policy
+
+
+# Synonym tables the scraper always used, a rules file passed to FieldMapper replaces any top level entry.
+# insured/agency keys are matched exactly against lowercased labels, "additional_data.x" targets go into additional_data.
+# policy field rules are tried in order and the first one that matches a lowercased column name wins.
+DEFAULT_RULES: Dict[str, Any] = {
+    "insured": {
+        "insured name": "name",
+        "business name": "name",
+        "customer name": "name",
+        "name": "name",
+        "address": "address",
+        "insured address": "address",
+        "age": "age",
+        "email": "email",
+    },
+    "insured_int_fields": ["age"],
+    "agency": {
+        "agency name": "name",
+        "agent": "name",
+        "broker": "name",
+        "agency address": "address",
+        "producer": "producer_name",
+        "producer code": "producer_code",
+        "agency code": "additional_data.agency_code",
+    },
+    "policy_indicators": ["policy", "effective", "expiration", "premium", "coverage", "id"],
+    # exact column names that make a bare "id" column count as a policy id
+    "policy_strong_columns": ["effective", "expiration", "premium", "date"],
+    "policy_fields": [
+        {"field": "policy_number", "all_of": ["policy", "number"], "marks_policy": True},
+        {"field": "policy_number", "exact": ["id"], "marks_policy": True},
+        {"field": "effective_date", "any_of": ["effective"], "marks_policy": True},
+        {"field": "expiration_date", "any_of": ["expiration", "termination"]},
+        {"field": "premium", "any_of": ["premium"], "marks_policy": True},
+        {"field": "carrier", "any_of": ["carrier"]},
+        {"field": "status", "any_of": ["status"]},
+    ],
+}
+
+
+def _alternation(words: Iterable[str]) -> Optional[re.Pattern]:
+    words = [w for w in words if w]
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(w) for w in words))
+
+
+class _FieldRule():
+    __slots__ = ('field', 'all_of', 'any_of', 'exact', 'marks_policy')
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.field = spec["field"]
+        self.all_of = list(spec.get("all_of", []))
+        self.any_of = _alternation(spec.get("any_of", []))
+        self.exact = set(spec.get("exact", []))
+        self.marks_policy = bool(spec.get("marks_policy", False))
+
+    def matches(self, key: str) -> bool:
+        if self.exact and key in self.exact:
+            return True
+        if self.all_of and all(word in key for word in self.all_of):
+            return True
+        return bool(self.any_of and self.any_of.search(key))
+
+
+class RowPlan():
+    """
+    How rows with one particular set of column names turn into a Policy, worked out once per header signature.
+    targets line up with the row's keys: a Policy attribute name, or None for additional_data.
+    """
+    __slots__ = ('keys', 'targets')
+
+    def __init__(self, keys: Tuple[str, ...], targets: List[Optional[str]]):
+        self.keys = keys
+        self.targets = targets
+
+    def build(self, values: Iterable[str]) -> Policy:
+        poly = Policy()
+        extra = poly.additional_data
+        for key, target, value in zip(self.keys, self.targets, values):
+            if target is None:
+                extra[key] = value
+            else:
+                setattr(poly, target, value)
+        return poly
+
+    def build_columns(self, columns: List[List[str]]) -> List[Policy]:
+        """A Policy per row of a columnar table whose keys are this plan's keys"""
+        return [self.build(values) for values in zip(*columns)]
+
+
+class FieldMapper():
+    """
+    Synonym tables compiled once: exact label lookups for insured/agency, one alternation regex for the policy
+    indicators and per column rules. Column names are classified once and every header signature (the tuple of a
+    row's keys) gets a cached RowPlan, so mapping a row is a dict lookup plus setattr per cell.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Any]] = None):
+        merged = copy.deepcopy(DEFAULT_RULES)
+        if rules:
+            merged.update(rules)
+        self.rules = merged
+
+        self.insured_lookup: Dict[str, str] = dict(merged["insured"])
+        self.insured_int_fields = set(merged["insured_int_fields"])
+        self.agency_lookup: Dict[str, str] = dict(merged["agency"])
+        self.indicators = _alternation(merged["policy_indicators"])
+        self.strong_columns = set(merged["policy_strong_columns"])
+        self.field_rules = [_FieldRule(spec) for spec in merged["policy_fields"]]
+
+        self._column_cache: Dict[str, Tuple[Optional[str], bool]] = {}
+        self._plan_cache: Dict[Tuple[str, ...], Optional[RowPlan]] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'FieldMapper':
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def insured(self, all_kvs: Dict[str, str]) -> Insured:
+        insured = Insured()
+        lookup = self.insured_lookup
+        for key, value in all_kvs.items():
+            attr = lookup.get(key)
+            if attr is None:
+                continue
+            self._assign(insured, attr, value, self.insured_int_fields)
+        return insured
+
+    def agency(self, all_kvs: Dict[str, str]) -> Agency:
+        agency = Agency()
+        lookup = self.agency_lookup
+        for key, value in all_kvs.items():
+            attr = lookup.get(key)
+            if attr is None:
+                continue
+            self._assign(agency, attr, value, ())
+        return agency
+
+    @staticmethod
+    def _assign(model, attr: str, value, int_fields):
+        """First label found wins for a model attribute, the additional_data bag always takes the latest value"""
+        if attr.startswith("additional_data."):
+            model.additional_data[attr[len("additional_data."):]] = value
+            return
+        if getattr(model, attr) is not None:
+            return
+        if attr in int_fields:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return
+        setattr(model, attr, value)
+
+    def classify_column(self, column: str) -> Tuple[Optional[str], bool]:
+        """(policy attribute or None, whether the column marks a row as a policy) for a lowercased column name"""
+        cached = self._column_cache.get(column)
+        if cached is None:
+            cached = (None, False)
+            for rule in self.field_rules:
+                if rule.matches(column):
+                    cached = (rule.field, rule.marks_policy)
+                    break
+            self._column_cache[column] = cached
+        return cached
+
+    def row_plan(self, keys: Tuple[str, ...]) -> Optional[RowPlan]:
+        """RowPlan for rows with these keys, None when such rows are never policies"""
+        if keys in self._plan_cache:
+            return self._plan_cache[keys]
+
+        plan = None
+        lowered = [k.lower() for k in keys]
+        if self.indicators is not None and any(self.indicators.search(k) for k in lowered):
+            has_dates_or_money = any(k in self.strong_columns for k in lowered)
+            bare_id = "id" in lowered and not has_dates_or_money and not any("policy" in k for k in lowered)
+            if not bare_id:
+                targets = []
+                marks = False
+                for column in lowered:
+                    field, marks_policy = self.classify_column(column)
+                    targets.append(field)
+                    marks = marks or marks_policy
+                if marks:
+                    # additional_data keys are shared by every policy built from this plan
+                    plan = RowPlan(tuple(sys.intern(k) for k in keys), targets)
+
+        self._plan_cache[keys] = plan
+        return plan
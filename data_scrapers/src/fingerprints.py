@@ -0,0 +1,193 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from columnar import json_default
+from models import Policy, ScrapeResult
+from serialize import dumps, to_dict
+
+
+# sections no run has seen for this long are dropped when a store is closed
+SECTION_TTL_DAYS = 30
+# part of every store's config, bumped when a change to the parsing code changes what a page parses to
+OUTPUT_VERSION = 1
+
+
+def page_fingerprint(html: str) -> str:
+    return hashlib.sha256(html.encode('utf-8', errors='replace')).hexdigest()
+
+
+def section_fingerprint(nodes: List) -> str:
+    """Hash of the markup under a header, i.e. everything the section's extraction looks at"""
+    digest = hashlib.sha256()
+    for node in nodes:
+        digest.update(str(node).encode('utf-8', errors='replace'))
+    return digest.hexdigest()
+
+
+def policy_content(policy: Policy) -> Dict[str, Any]:
+    """
+    A policy's fields for change and identity hashes. normalized is left out like policy_identity does, its
+    confidences depend on the batch the policy was read in, not on the policy
+    """
+    data = to_dict(policy)
+    del data["normalized"]
+    return data
+
+
+def policy_key(policy: Policy) -> str:
+    """
+    Identity of a policy between runs, its number and effective date when the page has a number. Renewals and
+    endorsements share the number, the date keeps them apart
+    """
+    if policy.policy_number:
+        if policy.effective_date:
+            return f"number:{policy.policy_number}@{policy.effective_date}"
+        return f"number:{policy.policy_number}"
+    payload = json.dumps(policy_content(policy), sort_keys=True, default=json_default)
+    return "hash:" + hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class FingerprintStore():
+    """
+    Remembers what earlier runs saw so unchanged content isn't extracted and mapped again.
+
+    Per page url: the html fingerprint with the parsed result and next page link, reused as is when the html matches.
+    Per section: the extracted tables/lists/kv_pairs keyed by the fingerprint of the section's markup, so a changed
+    page only re-extracts the sections that changed. Per start url: the policies of the last run, for change reports.
+    Sections not seen for section_ttl_days are pruned on close().
+
+    config describes the settings that shape a parsed page besides its html (see GenericScraper), pages and sections
+    stored under other settings don't match.
+    """
+
+    def __init__(self, path: str, section_ttl_days: float = SECTION_TTL_DAYS, config: str = ""):
+        self.path = path
+        self.section_ttl_days = section_ttl_days
+        self._config = hashlib.sha256(f"{OUTPUT_VERSION}:{config}".encode('utf-8')).hexdigest()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # sections reused since the last write, their last_seen goes in with the next commit instead of
+        # holding the write lock from a read
+        self._seen_sections: Dict[str, float] = {}
+        self.stats: Counter = Counter()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    next_link TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sections (
+                    fingerprint TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sections_last_seen ON sections (last_seen);
+                CREATE TABLE IF NOT EXISTS runs (
+                    start_url TEXT PRIMARY KEY,
+                    policies TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _keyed(self, fingerprint: str) -> str:
+        """A content fingerprint tied to this store's config"""
+        return hashlib.sha256(f"{self._config}:{fingerprint}".encode('utf-8')).hexdigest()
+
+    def page(self, url: str, fingerprint: str) -> Optional[Tuple[ScrapeResult, Optional[str]]]:
+        fingerprint = self._keyed(fingerprint)
+        with self._lock:
+            row = self.conn.execute("SELECT fingerprint, result, next_link FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None or row[0] != fingerprint:
+                self.stats["pages_parsed"] += 1
+                return None
+            self.stats["pages_reused"] += 1
+        return ScrapeResult.from_dict(json.loads(row[1])), row[2]
+
+    def save_page(self, url: str, fingerprint: str, result: ScrapeResult, next_link: Optional[str]):
+        payload = dumps(result)
+        fingerprint = self._keyed(fingerprint)
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages (url, fingerprint, result, next_link, updated_at) VALUES (?, ?, ?, ?, ?)",
+                              (url, fingerprint, payload, next_link, time.time()))
+            self._touch_sections()
+            self.conn.commit()
+
+    def section(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        fingerprint = self._keyed(fingerprint)
+        with self._lock:
+            row = self.conn.execute("SELECT content FROM sections WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row is None:
+                self.stats["sections_extracted"] += 1
+                return None
+            self._seen_sections[fingerprint] = time.time()
+            self.stats["sections_reused"] += 1
+        # a fresh copy every time, merge() extends the lists of the first page's raw_data in place
+        return json.loads(row[0])
+
+    def save_section(self, fingerprint: str, content: Dict[str, Any]):
+        fingerprint = self._keyed(fingerprint)
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO sections (fingerprint, content, last_seen) VALUES (?, ?, ?)",
+                              (fingerprint, json.dumps(content, default=json_default), time.time()))
+            self._touch_sections()
+            self.conn.commit()
+
+    def _touch_sections(self):
+        """Writes the pending last_seen updates into the open transaction, with the lock held"""
+        if self._seen_sections:
+            self.conn.executemany("UPDATE sections SET last_seen = ? WHERE fingerprint = ?",
+                                  [(seen, fingerprint) for fingerprint, seen in self._seen_sections.items()])
+            self._seen_sections.clear()
+
+    def diff_policies(self, start_url: str, policies: List[Policy]) -> Dict[str, List[str]]:
+        """
+        Compares a start url's policies with the previous run's and stores the new set.
+        Returns the keys that were added, changed and removed.
+        """
+        current = {policy_key(policy): policy_content(policy) for policy in policies}
+
+        with self._lock:
+            row = self.conn.execute("SELECT policies FROM runs WHERE start_url = ?", (start_url,)).fetchone()
+            previous = json.loads(row[0]) if row else {}
+            # runs stored before normalized was left out
+            for stored in previous.values():
+                stored.pop("normalized", None)
+            self.conn.execute("INSERT OR REPLACE INTO runs (start_url, policies, updated_at) VALUES (?, ?, ?)",
+                              (start_url, json.dumps(current), time.time()))
+            self.conn.commit()
+
+        return {
+            "added": [k for k in current if k not in previous],
+            "changed": [k for k in current if k in previous and previous[k] != current[k]],
+            "removed": [k for k in previous if k not in current],
+        }
+
+    def report(self) -> str:
+        return ", ".join(f"{name}={self.stats.get(name, 0)}"
+                         for name in ("pages_reused", "pages_parsed", "sections_reused", "sections_extracted"))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._touch_sections()
+                cutoff = time.time() - self.section_ttl_days * 86400
+                pruned = self._conn.execute("DELETE FROM sections WHERE last_seen < ?", (cutoff,)).rowcount
+                self.stats["sections_pruned"] += pruned
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
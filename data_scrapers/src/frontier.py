@@ -0,0 +1,272 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from models import ScrapeResult
+from serialize import dumps
+
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # someone else's process, but it's there
+        return True
+    return True
+
+
+class Frontier():
+    """
+    Crawl state on disk so a run can be stopped at any point and picked up again, by one worker or several.
+
+    Every start url is a chain, pending -> in_flight -> done (or failed once it has been tried max_attempts times).
+    Workers claim pending chains in one IMMEDIATE transaction, so two workers never get the same one, and hold
+    them on a lease that every page checkpoint renews. A worker that dies just stops renewing, its chains go back
+    to the pool when the lease runs out (right away for dead processes on the same host). Each parsed page of a
+    chain is checkpointed with its result and next link, a resumed chain merges those and carries on after the
+    last one instead of starting over.
+
+    WAL mode needs every process on the same host (readers and writers share memory through the -shm file).
+    For workers on several machines pointing at one file on a shared volume pass wal=False, that uses the
+    rollback journal and plain file locks, slower but safe wherever the filesystem's locking is.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300.0, max_attempts: int = 3, wal: bool = True,
+                 worker_id: Optional[str] = None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.wal = wal
+        self.worker_id = worker_id or default_worker_id()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # autocommit, the transactions below are opened by hand so claims can take the write lock up front
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            if self.wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+                # a commit per page, WAL only needs to sync at checkpoints to survive a crash of the process
+                conn.execute("PRAGMA synchronous=NORMAL")
+            else:
+                conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chains (
+                    start_url TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    pages INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chains_state ON chains (state, seq);
+                CREATE TABLE IF NOT EXISTS pages (
+                    start_url TEXT NOT NULL,
+                    page_index INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    next_link TEXT,
+                    PRIMARY KEY (start_url, page_index)
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _write(self, sql: str, params: Tuple = ()) -> int:
+        with self._lock:
+            return self.conn.execute(sql, params).rowcount
+
+    # filling
+
+    def add(self, urls: List[str]) -> int:
+        """Queues start urls that aren't in the frontier yet, urls from an earlier run keep their state"""
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM chains").fetchone()[0]
+                added = 0
+                for url in urls:
+                    cursor = conn.execute("INSERT OR IGNORE INTO chains (start_url, seq, state, updated_at) VALUES (?, ?, ?, ?)",
+                                          (url, seq + added + 1, PENDING, now))
+                    added += cursor.rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return added
+
+    # claiming
+
+    def claim(self, limit: int = 1) -> List[str]:
+        """
+        Takes up to limit pending chains, or chains whose lease ran out, for this worker. A chain whose lease ran out
+        on its last attempt fails instead, e.g. one that takes its worker down every time
+        """
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE chains SET state = ?, worker = NULL, lease_until = NULL, error = ?, updated_at = ? "
+                             "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                             (FAILED, "Lease ran out on the last attempt", now, IN_FLIGHT, now, self.max_attempts))
+                urls = [row[0] for row in conn.execute(
+                    "SELECT start_url FROM chains WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY seq LIMIT ?",
+                    (PENDING, IN_FLIGHT, now, limit))]
+                conn.executemany("UPDATE chains SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                                 "updated_at = ? WHERE start_url = ?",
+                                 [(IN_FLIGHT, self.worker_id, now + self.lease_seconds, now, url) for url in urls])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return urls
+
+    def release_dead(self) -> int:
+        """
+        Hands back chains claimed by processes on this host that aren't running anymore, without waiting on their
+        lease. Chains that were on their last attempt fail
+        """
+        host = socket.gethostname()
+        with self._lock:
+            rows = self.conn.execute("SELECT start_url, worker FROM chains WHERE state = ? AND worker LIKE ?",
+                                     (IN_FLIGHT, f"{host}:%")).fetchall()
+        dead = []
+        for url, worker in rows:
+            pid = worker.rsplit(':', 1)[1]
+            if pid.isdigit() and worker != self.worker_id and not _pid_alive(int(pid)):
+                dead.append((url, worker))
+        released = 0
+        for url, worker in dead:
+            released += self._write("UPDATE chains SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                                    "worker = NULL, lease_until = NULL, "
+                                    "error = CASE WHEN attempts >= ? THEN ? ELSE error END, updated_at = ? "
+                                    "WHERE start_url = ? AND state = ? AND worker = ?",
+                                    (self.max_attempts, FAILED, PENDING, self.max_attempts,
+                                     f"Worker {worker} died on the last attempt", time.time(), url, IN_FLIGHT, worker))
+        return released
+
+    # progress
+
+    def restore(self, start_url: str) -> Tuple[ScrapeResult, Set[str], Optional[str], int]:
+        """
+        What an earlier attempt of the chain got through: its pages merged, the page urls it visited,
+        the url to carry on from (None when the last page had no next link) and how many pages that was
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT url, result, next_link FROM pages WHERE start_url = ? ORDER BY page_index",
+                                     (start_url,)).fetchall()
+        all_results = ScrapeResult()
+        seen = set()
+        visited = set()
+        next_url: Optional[str] = start_url
+        for url, payload, next_link in rows:
+            all_results.merge(ScrapeResult.from_dict(json.loads(payload)), seen)
+            visited.add(url)
+            next_url = next_link if next_link and next_link not in visited else None
+        return all_results, visited, next_url, len(rows)
+
+    def checkpoint(self, start_url: str, page_index: int, url: str, result: ScrapeResult,
+                   next_link: Optional[str]) -> bool:
+        """Stores a parsed page and renews the chain's lease, False if another worker has taken the chain over"""
+        payload = dumps(result)
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                owned = conn.execute("UPDATE chains SET lease_until = ?, pages = ?, updated_at = ? "
+                                     "WHERE start_url = ? AND state = ? AND worker = ?",
+                                     (now + self.lease_seconds, page_index + 1, now, start_url, IN_FLIGHT,
+                                      self.worker_id)).rowcount
+                if owned:
+                    conn.execute("INSERT OR REPLACE INTO pages (start_url, page_index, url, result, next_link) VALUES (?, ?, ?, ?, ?)",
+                                 (start_url, page_index, url, payload, next_link))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return bool(owned)
+
+    def checkpointed(self, start_url: str) -> int:
+        """
+        How many pages of the chain are checkpointed, by this attempt or earlier ones. A chain with none got nothing
+        fetched and parsed, it's completed as failed rather than done with an empty result.
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT pages FROM chains WHERE start_url = ?", (start_url,)).fetchone()
+        return row[0] if row else 0
+
+    def complete(self, start_url: str, ok: bool = True, error: Optional[str] = None) -> bool:
+        """
+        Marks a chain done once its result has been written out and drops its checkpoints. A chain that failed
+        goes back to pending until it has been tried max_attempts times. False if the chain wasn't ours anymore.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if ok:
+                    owned = conn.execute("UPDATE chains SET state = ?, lease_until = NULL, error = NULL, updated_at = ? "
+                                         "WHERE start_url = ? AND state = ? AND worker = ?",
+                                         (DONE, now, start_url, IN_FLIGHT, self.worker_id)).rowcount
+                    if owned:
+                        conn.execute("DELETE FROM pages WHERE start_url = ?", (start_url,))
+                else:
+                    owned = conn.execute("UPDATE chains SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                                         "worker = NULL, lease_until = NULL, error = ?, updated_at = ? "
+                                         "WHERE start_url = ? AND state = ? AND worker = ?",
+                                         (self.max_attempts, FAILED, PENDING, error, now, start_url, IN_FLIGHT,
+                                          self.worker_id)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return bool(owned)
+
+    def retry_failed(self) -> int:
+        """Puts failed chains back to pending with a fresh attempt count"""
+        return self._write("UPDATE chains SET state = ?, attempts = 0, updated_at = ? WHERE state = ?",
+                           (PENDING, time.time(), FAILED))
+
+    # stats
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM chains GROUP BY state").fetchall()
+        counts = {state: 0 for state in STATES}
+        counts.update(rows)
+        return counts
+
+    def report(self) -> str:
+        return ", ".join(f"{state}={n}" for state, n in self.counts().items())
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,78 +1,427 @@
-from bs4 import BeautifulSoup
-from typing import Dict, List, Any, Optional
+from bs4 import BeautifulSoup, FeatureNotFound
+from typing import Callable, Dict, List, Any, Optional, Tuple
+import asyncio
 import json,re
-from models import ScrapeResult, Insured, Agency, Policy
-from playwright.sync_api import sync_playwright
-
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from models import ScrapeResult, Insured, Agency, Policy, intern_keys
+from browser_pool import BrowserPool
+from extraction import DomExtractor
+from http_fetch import TieredFetcher
+from fetch_profile import FetchProfile, navigate
+from page_cache import PageCache
+from fingerprints import FingerprintStore, page_fingerprint, section_fingerprint
+from field_mapping import FieldMapper
+from columnar import ColumnarTable
+from pagination import NEXT_LINK_TEXTS, page_links, predict_pages
+from metrics import Metrics
+from site_plans import SitePlans
+from browser_extract import EXTRACT_SCRIPT, ExtractedPage
+from streaming import ANCHOR, ITEM, KV, POLICY, SECTION, StreamingExtractor
+from normalize import normalize_policies
+from scheduler import FetchError, HostScheduler, network_time, raise_for_status
+
+
+# tree builders in order of preference, lxml and html5lib are optional installs
+PARSER_BACKENDS = ['lxml', 'html5lib', 'html.parser']
+
+
+def resolve_parser(parser: str) -> str:
+    """
+    Returns the requested tree builder if it is installed, otherwise falls back to the pure python html.parser
+    """
+    try:
+        BeautifulSoup("", parser)
+        return parser
+    except FeatureNotFound:
+        if parser != 'html.parser':
+            print(f"Parser '{parser}' is not installed, falling back to html.parser")
+        return 'html.parser'
 
 
 class GenericScraper():
 
+    def __init__(self, max_pages_per_browser: int = 50, max_heap_mb: int = 512, parser: str = 'lxml',
+                 http_tier: bool = True, fetch_profile: Optional[FetchProfile] = None,
+                 cache_dir: Optional[str] = None, cache_ttl: float = 24 * 3600, cache_max_mb: int = 1024, offline: bool = False,
+                 incremental: Optional[str] = None, mapping_rules: Optional[str] = None, metrics: Optional[Metrics] = None,
+                 scheduler: Optional[HostScheduler] = None, site_plans: Optional[str] = None, learn_plans: bool = True,
+                 browser_extract: bool = False, streaming: bool = False, normalize: bool = True):
+        # blocked requests and readiness conditions for browser fetches
+        self.fetch_profile = fetch_profile or FetchProfile()
+        # a warm browser reused across fetch calls and across urls, launched lazily on first fetch
+        self.pool = BrowserPool(max_pages_per_browser=max_pages_per_browser, max_heap_mb=max_heap_mb,
+                                profile=self.fetch_profile)
+        self.parser = resolve_parser(parser)
+        self.extractor = DomExtractor(self._parse_mashed_string)
+        # synonym tables compiled once, optionally replaced from a json rules file
+        self.mapper = FieldMapper.from_file(mapping_rules) if mapping_rules else FieldMapper()
+        # fetched pages are kept on disk between runs, offline replays a run from the cache only
+        self.cache = PageCache(cache_dir, ttl_seconds=cache_ttl, max_bytes=cache_max_mb * 1024 * 1024) if cache_dir else None
+        self.offline = offline
+        if offline and self.cache is None:
+            raise ValueError("offline replay needs a cache_dir")
+        # stage timings and counters, shared with whoever passed it in
+        self.metrics = metrics if metrics is not None else Metrics()
+        # per host rate limits, adaptive concurrency and retries for everything that goes to the network
+        self.scheduler = scheduler if scheduler is not None else HostScheduler(metrics=self.metrics)
+        # plain keep-alive http first, the browser only for pages that need javascript
+        self.tiers = TieredFetcher(cache=self.cache, metrics=self.metrics) if http_tier else None
+        # per host extraction plans, pages of a template seen before skip the heuristics. Learned as pages come in
+        # and kept in the site_plans json file between runs when there is one. Plans read pages with lxml, other
+        # tree builders can shape a broken page differently
+        self.plans = None
+        self.learn_plans = learn_plans
+        if (site_plans or learn_plans) and self.parser == 'lxml':
+            self.plans = SitePlans(site_plans, self.extractor)
+        # pages the browser renders are extracted right there instead of coming back as html to parse again.
+        # Nothing to cache or fingerprint for those, plain http pages are parsed as usual
+        self.browser_extract = browser_extract
+        # bounded memory parsing for huge pages, rows are mapped to policies as they're read and no tree is built.
+        # raw_data only keeps each section's key-value pairs then
+        self.streamer = None
+        if streaming:
+            self.streamer = StreamingExtractor(self.mapper, self._parse_mashed_string)
+            if not self.streamer.available():
+                print("Streaming needs lxml, parsing full trees instead")
+                self.streamer = None
+        # dates and premiums read into typed values once per table column, next to the page's strings
+        self.normalize = normalize
+        # fingerprints of pages and sections from earlier runs, unchanged ones reuse their old output when it was
+        # parsed with the same settings
+        self.fingerprints = FingerprintStore(incremental, config=self._output_config()) if incremental else None
+
+    def _output_config(self) -> str:
+        """The settings besides the html that shape what a page parses to"""
+        return json.dumps({"parser": self.parser, "streaming": self.streamer is not None, "normalize": self.normalize,
+                           "mapping_rules": self.mapper.rules}, sort_keys=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shuts down the pooled browsers, http connections and the cache index"""
+        self.pool.close()
+        if self.tiers is not None:
+            self.tiers.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+
+    def cached_html(self, url: str) -> Optional[str]:
+        """
+        html from the page cache when it can be used without the network, None to go fetch it.
+        In replay mode a page that was never cached comes back as "" so it counts as a failed fetch instead of going online
+        """
+        if self.cache is None:
+            return None
+        html = self.cache.lookup(url, allow_stale=self.offline)
+        if html is None and self.offline:
+            print(f"Not in cache, skipped in replay mode: {url}")
+            return ""
+        if html:
+            self.metrics.inc("cache_hits", url=url)
+        return html
+
     def fetch(self, url: str) -> str:
         """
-        Using Playwright to fetch content so it can wait for dynamic js content to load before scraping 
-        """
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            try:
-                page.goto(url, wait_until="networkidle")
-                content = page.content()
-            except Exception as e:
-                print(f"Error fetching {url}: {e}")
-                content = ""
-            finally:
-                browser.close()
+        Static pages come straight from plain http, anything that looks like it needs javascript goes through the browser.
+        Goes through the host scheduler, "" once the retries are used up
+        """
+        cached = self.cached_html(url)
+        if cached is not None:
+            return cached
+        try:
+            return self.scheduler.run(url, self._fetch_live)
+        except FetchError as e:
+            print(f"Error fetching {url}: {e}")
+            return ""
+
+    def _fetch_live(self, url: str) -> str:
+        with self.metrics.profile("fetch", url):
+            if self.tiers is not None:
+                return self.tiers.fetch(url, self.fetch_with_browser)
+            return self.fetch_with_browser(url)
+
+    def fetch_with_browser(self, url: str) -> str:
+        """
+        Using Playwright to fetch content so it can wait for dynamic js content to load before scraping.
+        With browser_extract the page comes back as an ExtractedPage instead of its html.
+        Raises FetchError on a 429/5xx or when the page can't be loaded at all, for the scheduler to retry
+        """
+        try:
+            with self.pool.page() as page:
+                with self.metrics.timer("navigate", url):
+                    with network_time():
+                        response = navigate(page, url, self.fetch_profile)
+                    if response is not None:
+                        raise_for_status(url, response.status, response.headers)
+                    if not self.browser_extract:
+                        content = page.content()
+                if self.browser_extract:
+                    with self.metrics.timer("extract", url):
+                        return ExtractedPage(url, page.evaluate(EXTRACT_SCRIPT))
+        except FetchError:
+            raise
+        except Exception as e:
+            raise FetchError(url, message=f"Browser fetch failed for {url}: {e}")
+        if content:
+            self.metrics.inc("bytes", len(content.encode('utf-8')), url)
+            if self.cache is not None:
+                self.cache.put(url, content)
         return content
 
+    def make_soup(self, html_content: str) -> BeautifulSoup:
+        return BeautifulSoup(html_content, self.parser)
+
     def parse(self, html_content: str) -> ScrapeResult:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
+        return self.parse_soup(self.make_soup(html_content))
+
+    def parse_soup(self, soup: BeautifulSoup, url: Optional[str] = None) -> ScrapeResult:
         # 1. Raw Extraction
-        raw_data = self._extract_generic_data(soup)
+        with self.metrics.timer("extract", url):
+            raw_data = self._extract_generic_data(soup)
         # print(f"Raw data: {raw_data}")
 
         # 2. Mapping tp a Data Model so its generic irrepective page has table or list objects
-        result = self._map_to_models(raw_data)
+        with self.metrics.timer("map", url):
+            result = self._map_to_models(raw_data)
         result.raw_data = raw_data
                 
         return result
 
-    def scrape(self, start_url: str) -> ScrapeResult:
+    def _parse_planned(self, page) -> Optional[ScrapeResult]:
+        """parse_soup() for a page its host's plan fits, None when it doesn't"""
+        with self.metrics.timer("extract", page.url):
+            raw_data = self.plans.extract(page)
+        if raw_data is None:
+            return None
+        self.metrics.inc("planned_pages", url=page.url)
+        with self.metrics.timer("map", page.url):
+            result = self._map_to_models(raw_data)
+        result.raw_data = raw_data
+        return result
+
+    def _parse_extracted(self, page: ExtractedPage, on_links, predict) -> Tuple[ScrapeResult, Optional[str]]:
+        """parse_page() for a page the browser already extracted, only the mapping is left"""
+        with self.metrics.timer("parse", page.url):
+            next_link, numbered = page.links()
+            raw_data = page.raw_data(self._parse_mashed_string)
+        if on_links is not None:
+            on_links(next_link, predict_pages(None, page.url, next_link, predict, numbered))
+        with self.metrics.timer("map", page.url):
+            result = self._map_to_models(raw_data)
+        result.raw_data = raw_data
+        return result, next_link
+
+    def _parse_streaming(self, html_content: str, current_url: str, on_links, predict) -> Tuple[ScrapeResult, Optional[str]]:
+        """parse_page() without a tree, policies and key-value pairs are taken from the stream as they come"""
+        result = ScrapeResult()
+        section = {"tables": [], "kv_pairs": {}, "lists": []}
+        raw_data = {"General": section}
+        all_kvs = {}
+        anchors = []
+        with self.metrics.timer("extract", current_url):
+            for kind, value in self.streamer.events(html_content):
+                if kind == POLICY:
+                    result.policies.append(value)
+                elif kind == KV:
+                    key, val = value
+                    section["kv_pairs"][key] = val
+                    all_kvs[key.lower()] = val
+                elif kind == ITEM:
+                    for key, val in value.items():
+                        all_kvs[key.lower()] = val
+                elif kind == SECTION:
+                    section = raw_data.setdefault(value, {"tables": [], "lists": [], "kv_pairs": {}})
+                elif kind == ANCHOR:
+                    anchors.append(value)
+        next_link, numbered = page_links(current_url, anchors)
+        if on_links is not None:
+            on_links(next_link, predict_pages(None, current_url, next_link, predict, numbered))
+        with self.metrics.timer("map", current_url):
+            result.insured = self._extract_insured(all_kvs)
+            result.agency = self._extract_agency(all_kvs)
+            if self.normalize:
+                # rows don't say which table they came from here, the page's policies are one batch
+                normalize_policies(result.policies)
+        result.raw_data = raw_data
+        return result, next_link
+
+    def parse_page(self, html_content: str, current_url: str,
+                   on_links: Optional[Callable[[Optional[str], List[str]], None]] = None,
+                   predict: int = 0) -> Tuple[ScrapeResult, Optional[str]]:
+        """
+        Parses one fetched page and also looks for the next page link, shared by the sync and async crawl.
+        The tree is built once and used for both. With incremental runs an unchanged page isn't parsed at all.
+        on_links gets the next link and up to `predict` guessed pages after it as soon as they are known,
+        before the slow extraction, so the caller can start fetching them.
+        A browser fetch in browser_extract mode hands over an ExtractedPage instead of html, only its mapping is left.
         """
-        Scrape a url and see if there are multiple pages to scrape then scrape them all and merge the results
+        with self.metrics.profile("parse", current_url):
+            result, next_link = self._parse_page(html_content, current_url, on_links, predict)
+            # the table and list passes, or a table repeated on the page, can find the same policy twice
+            duplicates = result.dedup_policies()
+        self.metrics.inc("pages", url=current_url)
+        self.metrics.inc("duplicates", duplicates, current_url)
+        self.metrics.inc("policies", len(result.policies), current_url)
+        return result, next_link
+
+    def _parse_page(self, html_content, current_url, on_links, predict) -> Tuple[ScrapeResult, Optional[str]]:
+        if isinstance(html_content, ExtractedPage):
+            return self._parse_extracted(html_content, on_links, predict)
+
+        if self.fingerprints is not None:
+            fingerprint = page_fingerprint(html_content)
+            reused = self.fingerprints.page(current_url, fingerprint)
+            if reused is not None:
+                if on_links is not None:
+                    on_links(reused[1], predict_pages(None, current_url, reused[1], predict))
+                return reused
+
+        if self.streamer is not None:
+            result, next_link = self._parse_streaming(html_content, current_url, on_links, predict)
+            if self.fingerprints is not None:
+                self.fingerprints.save_page(current_url, fingerprint, result, next_link)
+            return result, next_link
+
+        linked = False
+        # plans are learned for hosts without one and when a host's plan didn't fit the page, not from every
+        # page that goes through the heuristics
+        learn = self.plans is not None and self.learn_plans and not self.plans.has_plan(current_url)
+        planned_root = None
+        if self.plans is not None:
+            with self.metrics.timer("parse", current_url):
+                page = self.plans.page(html_content, current_url)
+            if page is not None:
+                next_link = page.next_link
+                if on_links is not None:
+                    on_links(next_link, predict_pages(None, current_url, next_link, predict, page.numbered))
+                    linked = True
+                result = self._parse_planned(page)
+                if result is not None:
+                    if self.fingerprints is not None:
+                        self.fingerprints.save_page(current_url, fingerprint, result, next_link)
+                    return result, next_link
+                # relearned from the tree that was just parsed, not a third parse of the page
+                learn, planned_root = self.learn_plans, page.root
+
+        with self.metrics.timer("parse", current_url):
+            soup = self.make_soup(html_content)
+            next_link = self._find_next_page(soup, current_url)
+        if on_links is not None and not linked:
+            on_links(next_link, predict_pages(soup, current_url, next_link, predict))
+        result = self.parse_soup(soup, current_url)
+        if learn:
+            self.plans.learn(html_content, current_url, result.raw_data, next_link, root=planned_root)
+
+        if self.fingerprints is not None:
+            self.fingerprints.save_page(current_url, fingerprint, result, next_link)
+        return result, next_link
+
+    def scrape(self, start_url: str, frontier=None) -> ScrapeResult:
+        """
+        Scrape a url and see if there are multiple pages to scrape then scrape them all and merge the results.
+        Parsing runs in a helper thread and the next page is fetched as soon as its link is found, while the
+        current page is still being extracted. Fetching stays on this thread, playwright's sync api is tied to it.
+        With a Frontier every page is checkpointed and a chain an earlier run got partway through resumes after
+        its last checkpointed page.
         """
         all_results = ScrapeResult()
         visited_urls = set()
         queue = [start_url]
+        page_index = 0
+        if frontier is not None:
+            all_results, visited_urls, resume_url, page_index = frontier.restore(start_url)
+            queue = [resume_url] if resume_url else []
+        # identities of the chain's policies, overlapping pages show some of them again
+        seen = all_results.policy_index()
+        # url -> (html, error) fetched ahead of its turn
+        prefetched: Dict[str, Tuple[str, Optional[Exception]]] = {}
         #bfs for looking for next page in case of pagination. bfs to go breadth first and manage repetition of urls if it comes up
-        while queue:
-            current_url = queue.pop(0)
-            if current_url in visited_urls:
-                continue
-            
-            visited_urls.add(current_url)
-            
-            try:
-                html = self.fetch(current_url)
-                if not html: 
-                    print(f"Failed to fetch {current_url}")
+        with ThreadPoolExecutor(max_workers=1) as parser:
+            while queue:
+                current_url = queue.pop(0)
+                if current_url in visited_urls:
                     continue
-                
-                result = self.parse(html)
-                all_results.merge(result)
-                
-                soup = BeautifulSoup(html, 'html.parser')
-                next_link = self._find_next_page(soup, current_url)
-                if next_link and next_link not in visited_urls:
-                    print(f"Found next page: {next_link}")
-                    queue.append(next_link)
-                    
-            except Exception as e:
-                print(f"Error scraping {current_url}: {e}")
-                
+
+                visited_urls.add(current_url)
+
+                try:
+                    if current_url in prefetched:
+                        html, error = prefetched.pop(current_url)
+                        if error is not None:
+                            raise error
+                    else:
+                        html = self.fetch(current_url)
+                    if not html:
+                        print(f"Failed to fetch {current_url}")
+                        self.metrics.inc("failures", url=current_url)
+                        continue
+
+                    found = Queue()
+                    parsing = parser.submit(self.parse_page, html, current_url,
+                                            lambda link, _predicted: found.put(link))
+                    parsing.add_done_callback(lambda _: found.put(None))
+                    early_link = found.get()
+                    if early_link and early_link not in visited_urls:
+                        try:
+                            prefetched[early_link] = (self.fetch(early_link), None)
+                        except Exception as e:
+                            prefetched[early_link] = ("", e)
+
+                    result, next_link = parsing.result()
+                    with self.metrics.timer("merge", current_url):
+                        self.metrics.inc("duplicates", all_results.merge(result, seen), current_url)
+                    if frontier is not None:
+                        frontier.checkpoint(start_url, page_index, current_url, result, next_link)
+                        page_index += 1
+
+                    if next_link and next_link not in visited_urls:
+                        print(f"Found next page: {next_link}")
+                        queue.append(next_link)
+
+                except Exception as e:
+                    print(f"Error scraping {current_url}: {e}")
+                    self.metrics.inc("failures", url=current_url)
+
         return all_results
 
+    def scrape_many(self, start_urls: List[str], concurrency: int = 8, per_host: Optional[int] = None, browsers: int = 2,
+                    on_result: Optional[Callable[[str, Optional[ScrapeResult]], None]] = None,
+                    prefetch_pages: int = 4) -> List[Optional[ScrapeResult]]:
+        """
+        Sync wrapper around the async engine, crawls all start urls and their pagination at once.
+        Returns a result per start url in input order (None if that url failed entirely), or streams
+        each one to on_result as soon as it's done
+        """
+        from async_engine import AsyncCrawlEngine
+
+        engine = AsyncCrawlEngine(self, concurrency=concurrency, per_host=per_host, browsers=browsers,
+                                  max_pages_per_browser=self.pool.max_pages_per_browser,
+                                  max_heap_mb=self.pool.max_heap_bytes // (1024 * 1024),
+                                  prefetch_pages=prefetch_pages)
+        return asyncio.run(engine.crawl(start_urls, on_result=on_result))
+
+    def crawl_frontier(self, frontier, concurrency: int = 8, browsers: int = 2,
+                       on_result: Optional[Callable[[str, Optional[ScrapeResult]], None]] = None,
+                       prefetch_pages: int = 4):
+        """
+        scrape_many over the chains claimed from a Frontier until none are left, each result goes to on_result
+        and its chain is marked done right after
+        """
+        from async_engine import AsyncCrawlEngine
+
+        engine = AsyncCrawlEngine(self, concurrency=concurrency, browsers=browsers,
+                                  max_pages_per_browser=self.pool.max_pages_per_browser,
+                                  max_heap_mb=self.pool.max_heap_bytes // (1024 * 1024),
+                                  prefetch_pages=prefetch_pages)
+        asyncio.run(engine.crawl_frontier(frontier, on_result=on_result))
+
     def _find_next_page(self, soup: BeautifulSoup, current_url: str) -> Optional[str]:
         """
         checking if there is pagination or a next page, using standard patterns but can also be custom numbers for pages
@@ -80,7 +429,7 @@ class GenericScraper():
         candidates = soup.find_all('a', href=True)
         for a in candidates:
             text = a.get_text(strip=True).lower()
-            if text in ['next', 'next >', '>', 'next page', 'more']:
+            if text in NEXT_LINK_TEXTS:
                 try:
                     from urllib.parse import urljoin
                     return urljoin(current_url, a['href'])
@@ -98,13 +447,9 @@ class GenericScraper():
         current_section = "General"
         data[current_section] = {"tables": [], "kv_pairs": {}, "lists": []}
         
-        all_elements = soup.find_all(recursive=True)
-        # print(f"All elements: {all_elements}")
-        
-        
         headers = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
         if not headers:
-            data["General"] = self._extract_section_content(soup)
+            data["General"] = self.extractor.extract(soup)
             return data
 
         first_header = headers[0]
@@ -120,7 +465,7 @@ class GenericScraper():
                 nodes.append(curr)
                 curr = curr.next_sibling
             
-            section_content = self._extract_from_nodes(nodes)
+            section_content = self._extract_section(nodes)
             
             if section_name in data:
                 data[section_name]["tables"].extend(section_content["tables"])
@@ -131,106 +476,17 @@ class GenericScraper():
                 
         return data
 
-    def _extract_section_content(self, container) -> Dict:
-        """Helper when we have a full section"""
-        return {
-            "tables": self._extract_tables(container),
-            "lists": self._extract_lists(container),
-            "kv_pairs": self._extract_key_values(container)
-        }
-
-    def _extract_from_nodes(self, nodes: List) -> Dict:
-        """Helper when we have a list of sibling nodes"""
-        
-        tables = []
-        lists = []
-        kv_pairs = {}
-        
-        for node in nodes:
-            if isinstance(node, str):
-                continue 
-            if not getattr(node, 'name', None):
-                continue
-
-            # Tables
-            extracted_tables = self._extract_tables(node)
-            tables.extend(extracted_tables)
-            
-            # Lists
-            extracted_lists = self._extract_lists(node)
-            lists.extend(extracted_lists)
-            
-            # Key-Values
-            extracted_kvs = self._extract_key_values(node)
-            kv_pairs.update(extracted_kvs)
-            
-        return {
-            "tables": tables,
-            "lists": lists,
-            "kv_pairs": kv_pairs
-        }
-
-    def _extract_tables(self, node) -> List[Dict]:
-        """ 
-        Finds tables within a node and converts them to list-of-dicts.
-        """
-        found = []
-        if node.name == 'table':
-            candidates = [node]
-        else:
-            candidates = node.find_all('table')
-            
-        for table in candidates:
-            headers = [th.get_text(strip=True) for th in table.find_all('th')]
-            rows = table.find_all('tr')
-            
-            table_data = []
-            for row in rows:
-                cells = row.find_all(['td', 'th'])
-                if all(c.name == 'th' for c in cells):
-                    continue
-                    
-                row_dict = {}
-                values = [c.get_text(strip=True) for c in cells]
-                
-                if len(headers) == len(values):
-                    for h, v in zip(headers, values):
-                        row_dict[h] = v
-                else:
-                    row_dict["values"] = values
-                
-                if row_dict:
-                    table_data.append(row_dict)
-            
-            if table_data:
-                found.append({"type": "table", "data": table_data})
-                
-        return found
-
-    def _extract_lists(self, node) -> List[List[str]]:
-        found = []
-        if node.name in ['ul', 'ol']:
-            candidates = [node]
-        else:
-            candidates = node.find_all(['ul', 'ol'])
-            
-        for l in candidates:
-            list_data = []
-            for li in l.find_all('li', recursive=False):
-                local_kvs = self._extract_key_values(li)
-                if local_kvs:
-                    list_data.append(local_kvs)
-                else:
-                    text = li.get_text(strip=True)
-                    parsed_kv = self._parse_mashed_string(text)
-                    if len(parsed_kv) > 1:
-                         list_data.append(parsed_kv)
-                    else:
-                        list_data.append(text)
+    def _extract_section(self, nodes: List) -> Dict[str, Any]:
+        """Extracts a header's sibling nodes, or takes last run's output when the section's markup hasn't changed"""
+        if self.fingerprints is None:
+            return self.extractor.extract_nodes(nodes)
 
-            if list_data:
-                found.append(list_data)
-        return found
+        fingerprint = section_fingerprint(nodes)
+        content = self.fingerprints.section(fingerprint)
+        if content is None:
+            content = self.extractor.extract_nodes(nodes)
+            self.fingerprints.save_section(fingerprint, content)
+        return content
 
     def _parse_mashed_string(self, text: str) -> Dict[str, str]:
         """
@@ -256,50 +512,6 @@ class GenericScraper():
             result[key] = val
         return result
 
-    def _extract_key_values(self, node) -> Dict[str, str]:
-        """
-        convert to key value pair from dt or lables or divs
-        """
-        data = {}
-        
-
-        dls = [node] if node.name == 'dl' else node.find_all('dl')
-        for dl in dls:
-            dts = dl.find_all('dt')
-            dds = dl.find_all('dd')
-            for dt, dd in zip(dts, dds):
-                key = dt.get_text(strip=True).rstrip(':')
-                val = dd.get_text(strip=True)
-                data[key] = val
-                
-        potential_keys = node.find_all(['b', 'strong', 'label', 'span', 'div'])
-        for pk in potential_keys:
-
-            if len(pk.get_text()) > 50: 
-                continue
-
-            text = pk.get_text(strip=True)
-            if text.endswith(':'):
-                key = text.rstrip(':')
-                
-
-                next_sib = pk.next_sibling
-                val = None
-                
-
-                while next_sib and (isinstance(next_sib, str) and not next_sib.strip()):
-                    next_sib = next_sib.next_sibling 
-
-                if isinstance(next_sib, str) and next_sib.strip():
-                   val = next_sib.strip()
-                elif next_sib and getattr(next_sib, 'name', None):
-                    val = next_sib.get_text(strip=True)
-                    
-                if val:
-                    data[key] = val
-                    
-        return data
-
     def _map_to_models(self, raw_data: Dict[str, Any]) -> ScrapeResult:
         """
         Mapping raw extracted data to structured Data models (Insured, Agency, Policy).
@@ -344,52 +556,13 @@ class GenericScraper():
         """
         forming data as per Insured model for consistency
         """
-        insured = Insured()
-        mapping = {
-            "insured name": "name", 
-            "business name": "name",
-            "customer name": "name", 
-            "name": "name", 
-            "address": "address",
-            "insured address": "address",
-            "age": "age",
-            "email": "email",
-        }
-        
-        for key, value in all_kvs.items():
-            for pattern, attr in mapping.items():
-                if getattr(insured, attr) is None and pattern in key:
-                     if key == pattern:
-                         if attr == 'age':
-                             try: value = int(value)
-                             except: continue
-                         setattr(insured, attr, value)
-        return insured
+        return self.mapper.insured(all_kvs)
 
     def _extract_agency(self, all_kvs: Dict[str, str]) -> Agency:
         """
         forming data as per Agency model for consistency
         """
-
-        agency = Agency()
-        mapping = {
-            "agency name": "name",
-            "agent": "name",
-            "broker": "name",
-            "agency address": "address",
-            "producer": "producer_name",
-            "producer code": "producer_code",
-            "agency code": "additional_data", 
-        }
-        
-        for key, value in all_kvs.items():
-            if key in mapping:
-                attr = mapping[key]
-                if attr == "additional_data":
-                    agency.additional_data["agency_code"] = value
-                elif getattr(agency, attr) is None:
-                    setattr(agency, attr, value)
-        return agency
+        return self.mapper.agency(all_kvs)
 
     def _find_policies(self, raw_data: Dict[str, Any], result: ScrapeResult):
         """
@@ -401,21 +574,28 @@ class GenericScraper():
             all_tables.extend(section.get('tables', []))
             
         for table_obj in all_tables:
-            rows = table_obj.get("data", [])
-            last_policy = None
-            for row in rows:
-                poly = self._extract_policy_from_row(row, result)
-                if poly:
-                    last_policy = poly
-                elif last_policy and "values" in row:
-                    for val_str in row["values"]:
-                        parsed = self._parse_mashed_string(val_str)
-                        if parsed:
-                            last_policy.additional_data.update(parsed)
+            # a table's policies are normalized together, its columns share one date and currency format
+            start = len(result.policies)
+            if isinstance(table_obj, ColumnarTable):
+                self._policies_from_columns(table_obj, result)
+            else:
+                rows = table_obj.get("data", [])
+                last_policy = None
+                for row in rows:
+                    poly = self._extract_policy_from_row(row, result)
+                    if poly:
+                        last_policy = poly
+                    elif last_policy and "values" in row:
+                        for val_str in row["values"]:
+                            parsed = self._parse_mashed_string(val_str)
+                            if parsed:
+                                last_policy.additional_data.update(intern_keys(parsed))
+            self._normalize(result, start)
 
         # look for lists with policy information      
         for section in raw_data.values():
             for list_obj in section.get('lists', []):
+                 start = len(result.policies)
                  for item in list_obj:
                      if isinstance(item, dict):
                          self._extract_policy_from_row(item, result)
@@ -423,61 +603,49 @@ class GenericScraper():
                          for sub in item:
                              if isinstance(sub, dict):
                                 self._extract_policy_from_row(sub, result)
+                 self._normalize(result, start)
 
-    def _extract_policy_from_row(self, row: Dict[str, str], result: ScrapeResult) -> Optional[Policy]:
-        """Helper to check if a dict represents a policy in a table row"""
-        keys = [k.lower() for k in row.keys()]
-        
-        policy_indicators = ["policy", "effective", "expiration", "premium", "coverage", "id"]
-        
-        is_policy_row = False
-        for key in keys:
-            for indicator in policy_indicators:
-                if indicator in key:
-                    is_policy_row = True
-                    break
-            if is_policy_row:
-                break
-
-        if not is_policy_row:
-            return None
+    def _normalize(self, result: ScrapeResult, start: int):
+        """Typed dates and premiums for the policies found from start on, one table's or list's"""
+        if self.normalize and len(result.policies) > start:
+            normalize_policies(result.policies[start:])
 
-        has_dates_or_money = False
-        for indicator in ["effective", "expiration", "premium", "date"]:
-            if indicator in keys:
-                has_dates_or_money = True
-                break
-            
-        if "id" in keys and not has_dates_or_money and not "policy" in str(keys):
-             return None
+    def _policies_from_columns(self, table: ColumnarTable, result: ScrapeResult):
+        """
+        Same policies as going through table.to_rows() row by row, but the columns are classified once for the whole
+        table and a table without fallback rows is built in one pass over its columns
+        """
+        keys, columns = table.keyed_columns()
+        plan = self.mapper.row_plan(keys)
+        values_plan = self.mapper.row_plan(("values",)) if table.fallback else None
+        if plan is None and values_plan is None:
+            return
+        if not table.fallback:
+            result.policies.extend(plan.build_columns(columns))
+            return
+
+        # fallback rows continue the policy above them, so those tables go row by row
+        last_policy = None
+        for full, values in table.iter_rows():
+            if full is not None:
+                if plan is not None:
+                    last_policy = plan.build(full)
+                    result.policies.append(last_policy)
+                continue
+            if values_plan is not None:
+                last_policy = values_plan.build((values,))
+                result.policies.append(last_policy)
+            elif last_policy:
+                for val_str in values:
+                    parsed = self._parse_mashed_string(val_str)
+                    if parsed:
+                        last_policy.additional_data.update(intern_keys(parsed))
 
-        poly = Policy()
-        is_poly = False
-        
-        for k, v in row.items():
-            kl = k.lower()
-            if "policy" in kl and "number" in kl:
-                poly.policy_number = v
-                is_poly = True
-            elif k.lower() == "id": 
-                poly.policy_number = v
-                is_poly = True
-            elif "effective" in kl:
-                poly.effective_date = v
-                is_poly = True
-            elif "expiration" in kl or "termination" in kl:
-                poly.expiration_date = v
-            elif "premium" in kl:
-                poly.premium = v
-                is_poly = True
-            elif "carrier" in kl:
-                poly.carrier = v
-            elif "status" in kl:
-                poly.status = v
-            else:
-                poly.additional_data[k] = v
-        
-        if is_poly:
-            result.policies.append(poly)
-            return poly
-        return None
+    def _extract_policy_from_row(self, row: Dict[str, str], result: ScrapeResult) -> Optional[Policy]:
+        """Helper to check if a dict represents a policy in a table row, the column checks are cached per set of keys"""
+        plan = self.mapper.row_plan(tuple(row))
+        if plan is None:
+            return None
+        poly = plan.build(row.values())
+        result.policies.append(poly)
+        return poly
@@ -0,0 +1,289 @@
+import http.client
+import re
+import ssl
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from scheduler import FetchError, network_time, raise_for_status
+
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+# what the extractors look for, checked on the raw html so deciding doesn't cost a tree build
+TABLE_CELL_MARKER = re.compile(r'<td\b[^>]*>\s*(?:<[^>]+>\s*)*[^<\s]', re.I)
+DL_MARKER = re.compile(r'<dd\b[^>]*>\s*(?:<[^>]+>\s*)*[^<\s]', re.I)
+LABEL_MARKER = re.compile(r'>\s*[A-Za-z][A-Za-z \t]{0,48}:\s*</', re.I)
+MASHED_MARKER = re.compile(r'<li\b[^>]*>[^<:]{1,60}:[^<:]{1,200}:', re.I)
+SCRIPT_OR_STYLE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.I | re.S)
+TAG = re.compile(r'<[^>]+>')
+NEEDS_JS = re.compile(r'enable javascript|requires javascript|javascript is (?:disabled|required)', re.I)
+
+# statuses saying the page isn't there, the browser would only render the same error page
+GONE_STATUSES = {404, 410}
+# a host on the browser tier gets plain http again for one page in this many, its shell page may have been a one-off
+REPROBE_EVERY = 25
+
+
+class HttpResponse():
+
+    def __init__(self, url: str, status: int, headers: Dict[str, str], body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self) -> str:
+        charset = 'utf-8'
+        match = re.search(r'charset=([\w-]+)', self.headers.get('content-type', ''), re.I)
+        if match:
+            charset = match.group(1)
+        try:
+            return self.body.decode(charset, errors='replace')
+        except LookupError:
+            return self.body.decode('utf-8', errors='replace')
+
+
+class HttpClient():
+    """
+    Small keep-alive http client on top of http.client. Idle connections are pooled per (scheme, host, port)
+    and reused, so a carrier's pages after the first one skip the tcp and tls handshakes. Thread safe.
+    """
+
+    def __init__(self, timeout: float = 15, max_idle_per_host: int = 4, max_redirects: int = 5, metrics=None):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.max_redirects = max_redirects
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._ssl = ssl.create_default_context()
+        # optional Metrics, counts retries
+        self.metrics = metrics
+
+    def _key(self, parts) -> Tuple[str, str, int]:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return parts.scheme, parts.hostname or '', port
+
+    def _connect(self, key) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _checkout(self, key) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request_once(self, url: str, headers: Dict[str, str]) -> HttpResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported scheme for {url}")
+        key = self._key(parts)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        send_headers = {"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml",
+                        "Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+        send_headers.update(headers)
+
+        conn, reused = self._checkout(key)
+        try:
+            conn.request("GET", path, headers=send_headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, http.client.BadStatusLine):
+            conn.close()
+            if not reused:
+                raise
+            # the server dropped an idle keep-alive connection, once more on a fresh one
+            if self.metrics is not None:
+                self.metrics.inc("retries", url=url)
+            conn = self._connect(key)
+            conn.request("GET", path, headers=send_headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except Exception:
+            conn.close()
+            raise
+
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+
+        encoding = resp_headers.get('content-encoding', '').lower()
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        return HttpResponse(url, resp.status, resp_headers, body)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """GET with redirects followed"""
+        headers = headers or {}
+        for _ in range(self.max_redirects + 1):
+            response = self._request_once(url, headers)
+            location = response.headers.get('location')
+            if response.status in REDIRECT_CODES and location:
+                url = urljoin(url, location)
+                continue
+            return response
+        raise RuntimeError(f"Too many redirects for {url}")
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+def looks_complete(html: str, min_text: int = 200) -> bool:
+    """
+    Heuristic for whether a plain http response already has the data or is a shell that javascript fills in.
+    Needs some visible text and at least one thing the extractors would pick up (a filled table cell, a dd, a Label: tag, a mashed list item).
+    """
+    visible = TAG.sub(' ', SCRIPT_OR_STYLE.sub(' ', html))
+    visible = ' '.join(visible.split())
+    if len(visible) < min_text:
+        return False
+    if NEEDS_JS.search(visible) and len(visible) < min_text * 5:
+        return False
+    return bool(TABLE_CELL_MARKER.search(html) or DL_MARKER.search(html)
+                or LABEL_MARKER.search(html) or MASHED_MARKER.search(html))
+
+
+class TieredFetcher():
+    """
+    Tries a pooled keep-alive http request first and only escalates to the browser when the response doesn't look
+    like it holds the data. Remembers per host which tier worked and counts pages served by each tier.
+
+    Only a 200 html page without the data moves a host to the browser tier, errors and other statuses send just
+    that page to the browser. Every REPROBE_EVERY-th page of a browser tier host tries plain http again and moves
+    the host back when it's enough.
+    """
+
+    HTTP = "http"
+    BROWSER = "browser"
+
+    def __init__(self, client: Optional[HttpClient] = None, cache=None, metrics=None):
+        self.client = client or HttpClient(metrics=metrics)
+        # optional PageCache, used for conditional requests and to store what plain http served
+        self.cache = cache
+        # optional Metrics, times plain http requests and counts the bytes they bring in
+        self.metrics = metrics
+        self.host_tier: Dict[str, str] = {}
+        # pages of each browser tier host since it was demoted or last reprobed
+        self._browser_pages: Counter = Counter()
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def wants_http(self, url: str) -> bool:
+        host = self.host(url)
+        if self.host_tier.get(host) != self.BROWSER:
+            return True
+        with self._lock:
+            self._browser_pages[host] += 1
+            return self._browser_pages[host] % REPROBE_EVERY == 0
+
+    def try_http(self, url: str) -> Optional[str]:
+        """
+        Returns the page if plain http was enough, otherwise None. The host is switched to the browser tier when
+        a 200 html page didn't look complete, other statuses and errors leave the tier alone.
+        A 429/5xx raises FetchError for the scheduler to retry and a 404/410 raises one that isn't retried.
+        """
+        html = None
+        # None while nothing says which tier the host needs
+        tier = None
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        try:
+            with network_time():
+                if self.metrics is not None:
+                    with self.metrics.timer("http", url):
+                        response = self.client.get(url, headers)
+                else:
+                    response = self.client.get(url, headers)
+            if self.metrics is not None:
+                self.metrics.inc("bytes", len(response.body), url)
+            content_type = response.headers.get('content-type', 'text/html')
+            # a busy host is no sign it needs a browser, the scheduler backs off and retries
+            raise_for_status(url, response.status, response.headers)
+            if response.status in GONE_STATUSES:
+                raise FetchError(url, response.status)
+            if response.status == 304 and cached is not None:
+                # unchanged since we cached it, and it only got cached because it was complete
+                self.cache.touch(url)
+                html = cached.body
+            elif response.status == 200 and 'html' in content_type:
+                text = response.text
+                if looks_complete(text):
+                    html = text
+                    if self.cache is not None:
+                        self.cache.put(url, text, etag=response.headers.get('etag'),
+                                       last_modified=response.headers.get('last-modified'))
+                else:
+                    # the page is there but its data isn't, the host renders it with javascript
+                    tier = self.BROWSER
+        except FetchError:
+            raise
+        except Exception as e:
+            print(f"Plain http failed for {url}, using browser: {e}")
+        if html is not None:
+            tier = self.HTTP
+        if tier is not None:
+            host = self.host(url)
+            with self._lock:
+                self.host_tier[host] = tier
+                self._browser_pages.pop(host, None)
+        return html
+
+    def served(self, tier: str):
+        with self._lock:
+            self.stats[tier] += 1
+
+    def fetch(self, url: str, browser_fetch: Callable[[str], str]) -> str:
+        if self.wants_http(url):
+            html = self.try_http(url)
+            if html is not None:
+                self.served(self.HTTP)
+                return html
+        html = browser_fetch(url)
+        if html:
+            self.served(self.BROWSER)
+        return html
+
+    def report(self) -> str:
+        return ", ".join(f"{tier}={self.stats.get(tier, 0)}" for tier in (self.HTTP, self.BROWSER))
+
+    def close(self):
+        self.client.close()
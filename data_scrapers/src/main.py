@@ -1,11 +1,147 @@
+import argparse
 import json
 import sys
 import os
-from dataclasses import asdict
+from typing import Optional
+
+# the scraping side (playwright, bs4, lxml) is imported where it's used, a --daemon client never loads it
+from models import ScrapeResult
+from sinks import ConsoleSink, JsonArraySink, JsonlSink, RAW_MODES
+from fingerprints import FingerprintStore
+from metrics import Metrics, PROFILE_MODES
+from result_store import ResultStore
+from daemon import DEFAULT_ADDRESS, DaemonClient, stats_report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape insurance carrier pages listed in urls.txt")
+    parser.add_argument("--parser", default="lxml", help="BeautifulSoup tree builder, falls back to html.parser if not installed")
+    parser.add_argument("--mapping-rules", default=None, help="json file overriding the insured/agency/policy synonym tables")
+    parser.add_argument("--site-plans", default=None, metavar="FILE",
+                        help="json file keeping the per host extraction plans learned from earlier pages between runs")
+    parser.add_argument("--no-site-plans", action="store_true",
+                        help="run the full extraction heuristics on every page instead of learned per host plans")
+    parser.add_argument("--streaming", action="store_true",
+                        help="parse pages without building a tree, rows become policies as they're read (bounded memory for huge pages)")
+    parser.add_argument("--no-normalize", action="store_true",
+                        help="leave policy dates and premiums as the page's strings, without typed values next to them")
+    parser.add_argument("--no-http-tier", action="store_true", help="always render with the browser, never try plain http first")
+    parser.add_argument("--browser-extract", action="store_true",
+                        help="extract browser rendered pages inside the page instead of parsing their html again (those aren't cached)")
+    parser.add_argument("--fetch-profile", default=None, help="json file with FetchProfile fields (blocked resources, readiness waits, timeout)")
+    parser.add_argument("--wait-until", default=None, choices=["commit", "domcontentloaded", "load", "networkidle"],
+                        help="navigation event to wait for, overrides the profile")
+    parser.add_argument("--cache-dir", default=None, help="keep fetched pages on disk here and reuse them across runs")
+    parser.add_argument("--cache-ttl", type=float, default=24 * 3600, help="seconds a cached page is used without refetching")
+    parser.add_argument("--cache-max-mb", type=int, default=1024, help="compressed cache size before least recently used pages are evicted")
+    parser.add_argument("--replay", action="store_true", help="scrape from --cache-dir only, no network")
+    parser.add_argument("--incremental", default=None, metavar="STATE_DB",
+                        help="sqlite file with fingerprints from earlier runs, unchanged pages/sections are not re-extracted")
+    parser.add_argument("--mode", choices=["async", "pipeline"], default="async",
+                        help="async: concurrent crawl engine, pipeline: fetch threads + parser process pool")
+    parser.add_argument("--concurrency", type=int, default=8, help="max pages fetched at once (async mode)")
+    parser.add_argument("--per-host", type=int, default=2, help="pages fetched at once per host to start with, adapts from there")
+    parser.add_argument("--max-per-host", type=int, default=8, help="most pages fetched at once per host however fast it answers")
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second per host on average, 0 for no limit")
+    parser.add_argument("--burst", type=float, default=4, help="requests a host may get back to back before --rate applies")
+    parser.add_argument("--retries", type=int, default=3, help="retries for 429/5xx answers and failed loads, with jittered backoff")
+    parser.add_argument("--prefetch-pages", type=int, default=4,
+                        help="pages of a paginated listing guessed and loaded ahead of their turn (async mode), 0 turns it off")
+    parser.add_argument("--frontier", default=None, metavar="STATE_DB",
+                        help="sqlite file tracking which urls are pending/in flight/done, a rerun resumes where the last one stopped "
+                             "and several workers can share it (give each worker its own --output)")
+    parser.add_argument("--frontier-shared", action="store_true",
+                        help="the frontier file is used from several machines over a shared volume, don't use WAL mode")
+    parser.add_argument("--lease", type=float, default=300, help="seconds a claimed url stays with a worker without a checkpoint")
+    parser.add_argument("--max-attempts", type=int, default=3, help="times a url is claimed before it is marked failed")
+    parser.add_argument("--retry-failed", action="store_true", help="give urls the frontier marked failed another go")
+    parser.add_argument("--worker-id", default=None, help="name of this worker in the frontier, defaults to host:pid")
+    parser.add_argument("--serve", nargs="?", const=DEFAULT_ADDRESS, default=None, metavar="ADDRESS",
+                        help=f"run as a daemon that keeps the scraper and its browsers warm and takes scrape jobs on "
+                             f"ADDRESS (host:port or a unix socket path, default {DEFAULT_ADDRESS})")
+    parser.add_argument("--daemon", default=None, metavar="ADDRESS",
+                        help="send the urls to a daemon started with --serve instead of scraping in this process, "
+                             "the daemon's scraper options apply")
+    parser.add_argument("--max-jobs", type=int, default=4, help="jobs a daemon runs at once, later ones wait in its queue")
+    parser.add_argument("--fetch-workers", type=int, default=2, help="fetch threads (pipeline mode)")
+    parser.add_argument("--parse-workers", type=int, default=None, help="parser processes, defaults to cpu count (pipeline mode)")
+    parser.add_argument("--queue-size", type=int, default=8, help="fetched pages waiting to be parsed before fetchers block (pipeline mode)")
+    parser.add_argument("--format", choices=["jsonl", "json"], default="jsonl",
+                        help="jsonl: one line per url written as it finishes, json: the original output.json array")
+    parser.add_argument("--output", default=None, help="output file, defaults to output.jsonl / output.json")
+    parser.add_argument("--gzip", action="store_true", help="gzip the jsonl output")
+    parser.add_argument("--raw", choices=RAW_MODES, default="inline",
+                        help="raw_data inline in each record, in a separate .raw.jsonl file, or not at all")
+    parser.add_argument("--print", action="store_true", help="also print every result to the console")
+    parser.add_argument("--store", default=None, metavar="RESULTS_DB",
+                        help="also keep results in this sqlite file, indexed by policy number/carrier/url and upserted on re-scrapes")
+    parser.add_argument("--metrics-prom", default=None, metavar="FILE", help="write stage timings and counters in prometheus text format")
+    parser.add_argument("--metrics-json", default=None, metavar="FILE", help="write stage timings and counters as a json summary")
+    parser.add_argument("--profile-url", action="append", default=[], metavar="REGEX",
+                        help="profile fetching and parsing of urls matching this, can be repeated")
+    parser.add_argument("--profile-mode", choices=PROFILE_MODES, default="cprofile",
+                        help="cprofile: .prof files for pstats/snakeviz, sample: collapsed stacks for flamegraphs")
+    parser.add_argument("--profile-dir", default="profiles", help="where profiles of --profile-url pages go")
+    return parser.parse_args(argv)
+
+
+def carrier_name(url: str) -> str:
+    try:
+        path_parts = url.split('/')
+        if len(path_parts) > 2:
+            carrier_slug = path_parts[-2]
+            carrier = carrier_slug.replace('_', ' ').title()
+        else:
+            carrier = "Unknown Carrier"
+    except:
+        carrier = "Unknown URL"
+    return carrier
+
+
+def open_sinks(args) -> list:
+    sinks = []
+    if args.format == "jsonl":
+        # a frontier run may be a resumed one, what earlier runs wrote stays
+        sinks.append(JsonlSink(args.output or "output.jsonl", compress=args.gzip, raw=args.raw,
+                               append=bool(args.frontier)))
+    else:
+        # the original single json array, raw_data can only be inline or left out here
+        sinks.append(JsonArraySink(args.output or "output.json", include_raw=args.raw != "none"))
+    if args.print:
+        sinks.append(ConsoleSink(include_raw=args.raw == "inline"))
+    if args.store:
+        sinks.append(ResultStore(args.store))
+    return sinks
+
+
+def scraper_kwargs_from(args, metrics: Metrics) -> dict:
+    from fetch_profile import FetchProfile
+    from scheduler import HostScheduler
+
+    fetch_profile = FetchProfile.from_file(args.fetch_profile) if args.fetch_profile else FetchProfile()
+    if args.wait_until:
+        fetch_profile.wait_until = args.wait_until
+    return {"parser": args.parser, "http_tier": not args.no_http_tier, "fetch_profile": fetch_profile,
+            "cache_dir": args.cache_dir, "cache_ttl": args.cache_ttl, "cache_max_mb": args.cache_max_mb,
+            "offline": args.replay, "incremental": args.incremental,
+            "mapping_rules": args.mapping_rules, "metrics": metrics,
+            "site_plans": None if args.no_site_plans else args.site_plans, "learn_plans": not args.no_site_plans,
+            "browser_extract": args.browser_extract, "streaming": args.streaming,
+            "normalize": not args.no_normalize,
+            "scheduler": HostScheduler(rate=args.rate, burst=args.burst, initial_concurrency=args.per_host,
+                                       max_concurrency=args.max_per_host, max_retries=args.retries,
+                                       metrics=metrics)}
 
-from generic_scraper import GenericScraper
 
 def main():
+    args = parse_args()
+    metrics = Metrics(profile_urls=args.profile_url, profile_mode=args.profile_mode, profile_dir=args.profile_dir)
+    if args.serve:
+        from daemon import ScrapeDaemon, serve
+        serve(args.serve, ScrapeDaemon(scraper_kwargs_from(args, metrics), concurrency=args.concurrency,
+                                       max_jobs=args.max_jobs, prefetch_pages=args.prefetch_pages))
+        return
+
     input_urls = []
     # Create a text file called urls.txt with the urls to scrape    
     input_file = 'urls.txt'
@@ -14,47 +150,107 @@ def main():
     with open(input_file, 'r') as f:
         input_urls = [line.strip() for line in f if line.strip()]
 
-    scraper = GenericScraper()
-    results = []
-
     print(f"Starting generic scrape for {len(input_urls)} urls...")
 
-    for url in input_urls:
+    scraper_kwargs = None
+    if args.daemon:
+        if args.frontier:
+            sys.exit("--frontier runs in this process, it can't be used with --daemon")
+    else:
+        scraper_kwargs = scraper_kwargs_from(args, metrics)
+
+    frontier = None
+    if args.frontier:
+        from frontier import Frontier
+        if args.format != "jsonl":
+            sys.exit("--frontier needs --format jsonl, a resumed run appends to the output")
+        frontier = Frontier(args.frontier, lease_seconds=args.lease, max_attempts=args.max_attempts,
+                            wal=not args.frontier_shared, worker_id=args.worker_id)
+        added = frontier.add(input_urls)
+        released = frontier.release_dead()
+        if args.retry_failed:
+            frontier.retry_failed()
+        print(f"Frontier: {added} new urls, {released} released from stopped workers, {frontier.report()}")
+
+    sinks = open_sinks(args)
+    store = FingerprintStore(args.incremental) if args.incremental else None
+    changes = {}
+
+    def handle_result(url: str, result: Optional[ScrapeResult]):
+        # results are written out as each url finishes, nothing is collected in memory
+        if result is None:
+            print(f"Failed to scrape {carrier_name(url)}")
+            return
 
-        try:
-            path_parts = url.split('/')
-            if len(path_parts) > 2:
-                carrier_slug = path_parts[-2]
-                carrier = carrier_slug.replace('_', ' ').title()
+        if store is not None:
+            changes[url] = store.diff_policies(url, result.policies)
+            print(f"{url}: {len(changes[url]['added'])} added, {len(changes[url]['changed'])} changed, "
+                  f"{len(changes[url]['removed'])} removed policies")
+
+        for sink in sinks:
+            sink.write(url, result)
+            if frontier is not None:
+                # the frontier marks the url done right after this, it has to be in the file by then
+                sink.flush()
+
+    daemon = None
+    try:
+        if args.daemon:
+            # results come back over the socket as the daemon finishes them and go to the same sinks
+            daemon = DaemonClient(args.daemon)
+            for url, result in daemon.scrape(input_urls, include_raw=args.raw != "none"):
+                handle_result(url, result)
+            print(f"Daemon job: {daemon.last_summary}")
+        elif args.mode == "pipeline":
+            from pipeline import PipelinedScraper
+            pipeline = PipelinedScraper(fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                                        queue_size=args.queue_size, scraper_kwargs=scraper_kwargs, frontier=frontier)
+            if frontier is not None:
+                pipeline.run_frontier(on_result=handle_result)
             else:
-                carrier = "Unknown Carrier"
-        except:
-            carrier = "Unknown URL"
-        
-        try:
-            print(f"\nProcessing ({url})...")
-            result = scraper.scrape(url)
-         
-            result_dict = asdict(result)
-            
-         
-            result_dict["source_url"] = url
-            
-
-            results.append(result_dict)
-            # print(f"Successfully scraped {carrier}")
-            
-        except Exception as e:
-            print(f"Failed to scrape {carrier}: {e}")
-
-
-    print("\n--- Final JSON Output ---")
-    print(json.dumps(results, indent=2))
-    
-    # Save to file
-    with open('output.json', 'w') as f:
-        json.dump(results, f, indent=2)
-        print("\nSaved to output.json")
+                pipeline.run(input_urls, on_result=handle_result)
+        else:
+            from generic_scraper import GenericScraper
+            # one scraper for the whole run, all urls and their pages are crawled concurrently
+            with GenericScraper(**scraper_kwargs) as scraper:
+                if frontier is not None:
+                    scraper.crawl_frontier(frontier, concurrency=args.concurrency,
+                                           on_result=handle_result, prefetch_pages=args.prefetch_pages)
+                else:
+                    scraper.scrape_many(input_urls, concurrency=args.concurrency,
+                                        on_result=handle_result, prefetch_pages=args.prefetch_pages)
+                if scraper.tiers is not None:
+                    print(f"Pages served per tier: {scraper.tiers.report()}")
+                if scraper.fingerprints is not None:
+                    print(f"Incremental: {scraper.fingerprints.report()}")
+                if scraper.plans is not None:
+                    print(f"Site plans: {scraper.plans.report()}")
+    finally:
+        for sink in sinks:
+            if isinstance(sink, ResultStore):
+                sink.flush()
+                print(f"Store: {sink.report()}")
+            sink.close()
+
+    print(f"\nSaved {sinks[0].count} results to {sinks[0].path}")
+    if daemon is not None:
+        print(f"Daemon: {stats_report(daemon.stats())}")
+    else:
+        print(f"Metrics: {metrics.report()}")
+        print(f"Hosts: {scraper_kwargs['scheduler'].report()}")
+    if frontier is not None:
+        print(f"Frontier: {frontier.report()}")
+        frontier.close()
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+
+    if store is not None:
+        store.close()
+        with open('changes.json', 'w') as f:
+            json.dump(changes, f, indent=2)
+        print("Policy changes saved to changes.json")
 
 if __name__ == "__main__":
     main()
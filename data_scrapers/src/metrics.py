@@ -0,0 +1,327 @@
+import bisect
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+# seconds, roughly log spaced from a fast mapping pass to a slow browser navigation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGES = ("http", "navigate", "parse", "extract", "map", "merge")
+COUNTERS = ("pages", "planned_pages", "policies", "duplicates", "retries", "failures", "bytes", "cache_hits")
+PROFILE_MODES = ("cprofile", "sample")
+
+
+class Histogram():
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # per bucket, not cumulative, the +Inf bucket is the last one
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: 'Histogram'):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket the q-th observation falls in"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": list(self.buckets), "counts": list(self.counts)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Histogram':
+        hist = cls(tuple(data["buckets"]))
+        hist.counts = list(data["counts"])
+        hist.count = data["count"]
+        hist.sum = data["sum"]
+        return hist
+
+
+def _host(url: Optional[str]) -> str:
+    return urlsplit(url).netloc.lower() if url else ""
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in labels.items()) + "}"
+
+
+class Metrics():
+    """
+    Stage timings and counters for a run, thread safe.
+
+    Every timed stage goes into a histogram per (stage, host) and a running total per (stage, url). Counters are kept
+    overall and per host. At the end of a run it all comes out as prometheus text (per host series only) or a json
+    summary (with the slowest urls). Urls matching one of profile_urls also get profiled while they are fetched and
+    parsed, with cProfile or a sampling profiler.
+
+    Parser processes have their own copy (pickling only keeps the settings), drain() hands what they recorded back
+    to the parent's merge(). Without track_urls nothing is kept per url, for processes that run for good.
+    """
+
+    def __init__(self, profile_urls: Optional[Iterable[str]] = None, profile_mode: str = "cprofile",
+                 profile_dir: str = "profiles", sample_interval: float = 0.005, track_urls: bool = True):
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError(f"profile_mode must be one of {PROFILE_MODES}")
+        self.profile_patterns = [re.compile(p) for p in (profile_urls or [])]
+        self.profile_mode = profile_mode
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.track_urls = track_urls
+        self._lock = threading.Lock()
+        # one cProfile at a time, a second one would take the first's hook over (or raise, on python 3.12+)
+        self._cprofiling = False
+        self._reset()
+
+    def _reset(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.url_times: Dict[str, Dict[str, List[float]]] = {}
+        self.counters: Counter = Counter()
+        self.host_counters: Dict[str, Counter] = {}
+
+    def __getstate__(self):
+        return {"profile_patterns": [p.pattern for p in self.profile_patterns], "profile_mode": self.profile_mode,
+                "profile_dir": self.profile_dir, "sample_interval": self.sample_interval, "track_urls": self.track_urls}
+
+    def __setstate__(self, state):
+        self.__init__(state["profile_patterns"], state["profile_mode"], state["profile_dir"], state["sample_interval"],
+                      state["track_urls"])
+
+    def observe(self, stage: str, seconds: float, url: Optional[str] = None):
+        host = _host(url)
+        with self._lock:
+            hist = self.histograms.get((stage, host))
+            if hist is None:
+                hist = self.histograms[(stage, host)] = Histogram()
+            hist.observe(seconds)
+            if url and self.track_urls:
+                # [count, total seconds]
+                per_stage = self.url_times.setdefault(url, {})
+                totals = per_stage.setdefault(stage, [0, 0.0])
+                totals[0] += 1
+                totals[1] += seconds
+
+    @contextmanager
+    def timer(self, stage: str, url: Optional[str] = None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, url)
+
+    def inc(self, name: str, amount: int = 1, url: Optional[str] = None):
+        with self._lock:
+            self.counters[name] += amount
+            if url:
+                self.host_counters.setdefault(_host(url), Counter())[name] += amount
+
+    def drain(self) -> Dict[str, Any]:
+        """Everything recorded so far as plain data, and starts over"""
+        with self._lock:
+            snapshot = {
+                "histograms": [[stage, host, hist.to_dict()] for (stage, host), hist in self.histograms.items()],
+                "url_times": self.url_times,
+                "counters": dict(self.counters),
+                "host_counters": {host: dict(c) for host, c in self.host_counters.items()},
+            }
+            self._reset()
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]):
+        with self._lock:
+            for stage, host, data in snapshot["histograms"]:
+                other = Histogram.from_dict(data)
+                hist = self.histograms.get((stage, host))
+                if hist is None:
+                    self.histograms[(stage, host)] = other
+                else:
+                    hist.merge(other)
+            for url, stages in snapshot["url_times"].items():
+                per_stage = self.url_times.setdefault(url, {})
+                for stage, (count, seconds) in stages.items():
+                    totals = per_stage.setdefault(stage, [0, 0.0])
+                    totals[0] += count
+                    totals[1] += seconds
+            self.counters.update(snapshot["counters"])
+            for host, counts in snapshot["host_counters"].items():
+                self.host_counters.setdefault(host, Counter()).update(counts)
+
+    # profiling
+
+    def wants_profile(self, url: str) -> bool:
+        return any(p.search(url) for p in self.profile_patterns)
+
+    @contextmanager
+    def profile(self, stage: str, url: str):
+        """
+        Profiles the block when the url was asked for, writes <profile_dir>/<stage>-<url>.prof or .folded.
+        Both profilers watch the calling thread only: a block that awaits (an async fetch) also shows what the other
+        tasks of the event loop ran meanwhile, and what it hands to another thread isn't in it. A cProfile asked for
+        while another one runs is skipped.
+        """
+        if not self.profile_patterns or not self.wants_profile(url):
+            yield
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', url)[:150]
+        path = os.path.join(self.profile_dir, f"{stage}-{name}")
+        if self.profile_mode == "cprofile":
+            with self._lock:
+                busy, self._cprofiling = self._cprofiling, True
+            if busy:
+                print(f"Not profiling {stage} of {url}, another profile is running")
+                yield
+                return
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                with self._lock:
+                    self._cprofiling = False
+                profiler.dump_stats(path + ".prof")
+        else:
+            sampler = _Sampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                sampler.write(path + ".folded")
+
+    # export
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages: Dict[str, Dict[str, Any]] = {}
+            for (stage, host), hist in sorted(self.histograms.items()):
+                entry = stages.setdefault(stage, {"count": 0, "seconds": 0.0, "hosts": {}})
+                entry["count"] += hist.count
+                entry["seconds"] += hist.sum
+                entry["hosts"][host or "-"] = {"count": hist.count, "seconds": round(hist.sum, 6),
+                                               "p50": hist.quantile(0.5), "p95": hist.quantile(0.95),
+                                               "p99": hist.quantile(0.99)}
+            for entry in stages.values():
+                entry["seconds"] = round(entry["seconds"], 6)
+            # the slowest urls by total time over all stages
+            slowest = sorted(self.url_times.items(), key=lambda kv: -sum(t for _, t in kv[1].values()))[:20]
+            return {
+                "counters": dict(self.counters),
+                "hosts": {host: dict(c) for host, c in self.host_counters.items()},
+                "stages": stages,
+                "slowest_urls": [{"url": url, "stages": {s: {"count": c, "seconds": round(t, 6)} for s, (c, t) in times.items()}}
+                                 for url, times in slowest],
+            }
+
+    def write_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append("# HELP scraper_stage_seconds Time spent per stage and host")
+            lines.append("# TYPE scraper_stage_seconds histogram")
+            for (stage, host), hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f"scraper_stage_seconds_bucket{_labels(stage=stage, host=host, le=bound)} {cumulative}")
+                lines.append(f"scraper_stage_seconds_bucket{_labels(stage=stage, host=host, le='+Inf')} {hist.count}")
+                lines.append(f"scraper_stage_seconds_sum{_labels(stage=stage, host=host)} {hist.sum}")
+                lines.append(f"scraper_stage_seconds_count{_labels(stage=stage, host=host)} {hist.count}")
+
+            # per url timings stay in the json summary, a series per url would have no bound
+            for name in sorted(set(COUNTERS) | set(self.counters)):
+                lines.append(f"# TYPE scraper_{name}_total counter")
+                # only per host series so they sum to the total, what was counted without a url goes under host=""
+                unattributed = self.counters.get(name, 0)
+                for host, counts in sorted(self.host_counters.items()):
+                    if name in counts:
+                        lines.append(f"scraper_{name}_total{_labels(host=host)} {counts[name]}")
+                        unattributed -= counts[name]
+                if unattributed or not any(name in counts for counts in self.host_counters.values()):
+                    lines.append(f"scraper_{name}_total{_labels(host='')} {unattributed}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        # written next to the target and renamed so a node exporter textfile collector never reads half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def report(self) -> str:
+        with self._lock:
+            totals: Dict[str, float] = {}
+            for (stage, _), hist in self.histograms.items():
+                totals[stage] = totals.get(stage, 0.0) + hist.sum
+            stages = ", ".join(f"{stage}={totals[stage]:.2f}s" for stage in STAGES if stage in totals)
+            counters = ", ".join(f"{name}={self.counters.get(name, 0)}" for name in COUNTERS)
+        return f"{stages}; {counters}"
+
+
+class _Sampler():
+    """Samples one thread's stack every interval, counts collapsed stacks (the flamegraph.pl input format)"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -1,7 +1,37 @@
+import sys
 from dataclasses import dataclass, field
-from typing import List, Optional, Dict
+from datetime import date
+from decimal import Decimal
+from typing import Any, List, Optional, Dict, Set, Tuple
 
-@dataclass
+# __slots__ instead of a __dict__ per instance, a big carrier's result holds hundreds of thousands of policies
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+# Policy fields the normalize stage reads into dates and amounts, next to the page's strings
+DATE_FIELDS = ("effective_date", "expiration_date")
+AMOUNT_FIELDS = ("premium",)
+
+
+def intern_keys(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Same dict with its keys interned, the same few labels repeat in every policy's additional_data"""
+    return {sys.intern(k): v for k, v in data.items()}
+
+
+def policy_identity(policy: 'Policy') -> Tuple:
+    """Everything a policy holds as one hashable value, two policies with the same identity are the same record"""
+    return (policy.policy_number, policy.effective_date, policy.expiration_date, policy.premium, policy.status,
+            policy.carrier, policy.coverage_type, frozenset(policy.additional_data.items()))
+
+
+@dataclass(**_SLOTS)
+class TypedValue:
+    # a date or Decimal, None when the string couldn't be read. Shared by every policy of a batch with the same
+    # string, so not to be changed in place
+    value: Any
+    # how sure the reading is, one of normalize's EXACT/AMBIGUOUS/GUESSED/FAILED
+    confidence: str
+
+@dataclass(**_SLOTS)
 class Insured:
     name: Optional[str] = None
     address: Optional[str] = None
@@ -10,7 +40,7 @@ class Insured:
     email: Optional[str] = None
     additional_data: Dict[str, str] = field(default_factory=dict)
 
-@dataclass
+@dataclass(**_SLOTS)
 class Agency:
     name: Optional[str] = None
     address: Optional[str] = None
@@ -19,7 +49,7 @@ class Agency:
     producer_code: Optional[str] = None
     additional_data: Dict[str, str] = field(default_factory=dict)
 
-@dataclass
+@dataclass(**_SLOTS)
 class Policy:
     policy_number: Optional[str] = None
     effective_date: Optional[str] = None
@@ -29,8 +59,10 @@ class Policy:
     carrier: Optional[str] = None
     coverage_type: Optional[str] = None
     additional_data: Dict[str, str] = field(default_factory=dict)
+    # field name -> TypedValue for the date and premium fields, the strings above stay as the page had them
+    normalized: Optional[Dict[str, TypedValue]] = None
 
-@dataclass
+@dataclass(**_SLOTS)
 class ScrapeResult:
     # A single page might contain info about one insured, one agency, and multiple policies
     insured: Optional[Insured] = None
@@ -38,7 +70,42 @@ class ScrapeResult:
     policies: List[Policy] = field(default_factory=list)
     raw_data: Dict = field(default_factory=dict)
 
-    def merge(self, other: 'ScrapeResult'):
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScrapeResult':
+        """Rebuilds a result from its asdict() form, e.g. one stored by an earlier run"""
+        return cls(
+            insured=_from_dict(Insured, data["insured"]) if data.get("insured") else None,
+            agency=_from_dict(Agency, data["agency"]) if data.get("agency") else None,
+            policies=[_from_dict(Policy, p) for p in data.get("policies", [])],
+            raw_data=data.get("raw_data", {}),
+        )
+
+    def policy_index(self) -> Set[Tuple]:
+        """Identities of the policies held so far, for merge() to skip ones it already has"""
+        return {policy_identity(p) for p in self.policies}
+
+    def dedup_policies(self) -> int:
+        """Drops repeats of a policy, e.g. one found in both a table and a list of the page. Returns how many"""
+        seen = set()
+        unique = []
+        for policy in self.policies:
+            identity = policy_identity(policy)
+            if identity not in seen:
+                seen.add(identity)
+                unique.append(policy)
+        dropped = len(self.policies) - len(unique)
+        if dropped:
+            self.policies = unique
+        return dropped
+
+    def merge(self, other: 'ScrapeResult', seen: Optional[Set[Tuple]] = None) -> int:
+        """
+        Adds another page's result to this one. Policies already held are skipped, overlapping pages repeat some.
+        seen is the policy_index() of this result, a chain keeps it between merges instead of it being rebuilt
+        every page. Returns how many policies were skipped.
+        """
+        if seen is None:
+            seen = self.policy_index()
         if other.insured:
             if not self.insured: 
                 self.insured = other.insured    
@@ -47,7 +114,14 @@ class ScrapeResult:
             if not self.agency: 
                 self.agency = other.agency
             
-        self.policies.extend(other.policies)
+        skipped = 0
+        for policy in other.policies:
+            identity = policy_identity(policy)
+            if identity in seen:
+                skipped += 1
+                continue
+            seen.add(identity)
+            self.policies.append(policy)
         # merge raw data
         for key, value in other.raw_data.items():
             if key not in self.raw_data:
@@ -57,3 +131,23 @@ class ScrapeResult:
                     self.raw_data[key].get("tables", []).extend(value.get("tables", []))
                     self.raw_data[key].get("lists", []).extend(value.get("lists", []))
                     self.raw_data[key].get("kv_pairs", {}).update(value.get("kv_pairs", {}))
+        return skipped
+
+
+def _from_dict(cls, data: Dict[str, Any]):
+    # json.loads makes a new string for every key of every policy, interning folds them back together
+    extra = data.get("additional_data")
+    if extra:
+        data = dict(data, additional_data=intern_keys(extra))
+    normalized = data.get("normalized")
+    if normalized:
+        data = dict(data, normalized={name: _typed_from_dict(name, value) for name, value in normalized.items()})
+    return cls(**data)
+
+
+def _typed_from_dict(name: str, data: Dict[str, Any]) -> TypedValue:
+    # json has the iso date and the amount's digits as strings
+    value = data["value"]
+    if value is not None:
+        value = date.fromisoformat(value) if name in DATE_FIELDS else Decimal(value)
+    return TypedValue(value, data["confidence"])
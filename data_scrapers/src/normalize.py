@@ -0,0 +1,180 @@
+import re
+from datetime import date
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from models import AMOUNT_FIELDS, DATE_FIELDS, Policy, TypedValue
+
+
+# how sure a typed value is
+# read with the format the column was detected to have, and no other format fits the column as well
+EXACT = "exact"
+# the column fits several formats equally (e.g. only days up to 12), the default one was used and another would
+# read this value differently
+AMBIGUOUS = "ambiguous"
+# the value doesn't have the column's format, it was read with the first format it does have
+GUESSED = "guessed"
+# no format fits, the value is None
+FAILED = "failed"
+
+_MONTHS = {name: i + 1 for i, name in enumerate(("january", "february", "march", "april", "may", "june", "july",
+                                                  "august", "september", "october", "november", "december"))}
+_MONTHS.update({name[:3]: month for name, month in list(_MONTHS.items())})
+_MONTHS["sept"] = 9
+
+
+def _year(text: str) -> int:
+    year = int(text)
+    if len(text) == 2:
+        # the same pivot as strptime's %y
+        year += 1900 if year >= 69 else 2000
+    return year
+
+
+def _date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+class _Format():
+    """One way a column can write its values: a regex and how its groups make the typed value"""
+    __slots__ = ('name', 'regex', 'convert')
+
+    def __init__(self, name: str, pattern: str, convert: Callable[[re.Match], object]):
+        self.name = name
+        # cells come with whatever whitespace the page had around them
+        self.regex = re.compile(r"\s*(?:%s)\s*" % pattern, re.IGNORECASE)
+        self.convert = convert
+
+    def parse(self, text: str):
+        match = self.regex.fullmatch(text)
+        return self.convert(match) if match is not None else None
+
+
+def _numeric_date(year: int, month: int, day: int) -> Callable[[re.Match], Optional[date]]:
+    return lambda m: _date(_year(m.group(year)), int(m.group(month)), int(m.group(day)))
+
+
+def _named_date(year: int, month: int, day: int) -> Callable[[re.Match], Optional[date]]:
+    def convert(m: re.Match) -> Optional[date]:
+        month_number = _MONTHS.get(m.group(month).lower())
+        return _date(int(m.group(year)), month_number, int(m.group(day))) if month_number else None
+    return convert
+
+
+# in order of preference, month first before day first when a column fits both (these are mostly us carriers)
+DATE_FORMATS = (
+    _Format("y-m-d", r"(\d{4})([-/.])(\d{1,2})\2(\d{1,2})", _numeric_date(1, 3, 4)),
+    _Format("m/d/y", r"(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})", _numeric_date(4, 1, 3)),
+    _Format("d/m/y", r"(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})", _numeric_date(4, 3, 1)),
+    _Format("mon d, y", r"([a-z]{3,9})\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})", _named_date(3, 1, 2)),
+    _Format("d mon y", r"(\d{1,2})(?:st|nd|rd|th)?[\s-]+([a-z]{3,9})\.?,?[\s-]+(\d{4})", _named_date(3, 2, 1)),
+)
+
+
+# distinct texts of a column every format is tried on, the rest are read with the formats that did best on these
+SAMPLE = 64
+
+# a currency symbol or code on either side, minus or parentheses for negative amounts, %s is the number
+_AMOUNT = (r"(\()?\s*(-)?\s*(?:[a-z]{3}|[a-z]{0,2}[$¢-¥€₹])?\s*(-)?\s*"
+           r"(%s)\s*(-)?\s*(?:[a-z]{3}|[$¢-¥€₹])?\s*(\))?")
+
+
+def _amount_format(name: str, group_separators: str, decimal_mark: str) -> _Format:
+    separators, mark = re.escape(group_separators), re.escape(decimal_mark)
+    number = r"\d{1,3}(?:[%s]\d{3})+(?:%s\d+)?|\d+(?:%s\d+)?" % (separators, mark, mark)
+    strip = str.maketrans("", "", group_separators)
+
+    def convert(m: re.Match) -> Optional[Decimal]:
+        opening, minus, inner_minus, digits, trailing_minus, closing = m.groups()
+        negative = bool(minus or inner_minus or trailing_minus)
+        if opening or closing:
+            if not (opening and closing) or negative:
+                return None
+            negative = True
+        amount = Decimal(digits.translate(strip).replace(decimal_mark, "."))
+        return -amount if negative else amount
+    return _Format(name, _AMOUNT % number, convert)
+
+
+AMOUNT_FORMATS = (
+    _amount_format("1,234.56", ",' \u00a0\u202f", "."),
+    _amount_format("1.234,56", ".' \u00a0\u202f", ","),
+)
+
+
+def _read_column(formats: Sequence[_Format], texts: Iterable[str]) -> Dict[str, TypedValue]:
+    """
+    Typed value for every distinct text of a column. The column's format is the one that reads the most of its
+    texts, the first of those on a tie. Formats that tie with it are the column's rivals, a text one of them reads
+    as another value is only AMBIGUOUS.
+
+    Only the first SAMPLE texts are tried with every format, the rest with the formats that read the most of the
+    sample, and with all of them only when none of those can read it.
+    """
+    texts = list(texts)
+    sample = [[f.parse(text) for f in formats] for text in texts[:SAMPLE]]
+    candidates = _most_read(range(len(formats)), sample)
+    parsed = [[values[i] for i in candidates] for values in sample]
+    if len(candidates) == 1:
+        # the usual case, one format fits the column and nothing can be ambiguous
+        parse = formats[candidates[0]].parse
+        parsed.extend([parse(text)] for text in texts[SAMPLE:])
+    else:
+        parsed.extend([formats[i].parse(text) for i in candidates] for text in texts[SAMPLE:])
+    found = _most_read(range(len(candidates)), parsed)
+    best = candidates[found[0]]
+    rivals = found[1:]
+
+    typed = {}
+    for text, values in zip(texts, parsed):
+        value = values[found[0]]
+        if value is not None:
+            same = not rivals or all(values[i] is None or values[i] == value for i in rivals)
+            typed[text] = TypedValue(value, EXACT if same else AMBIGUOUS)
+            continue
+        other = next((v for v in (f.parse(text) for i, f in enumerate(formats) if i != best) if v is not None), None)
+        typed[text] = TypedValue(other, GUESSED if other is not None else FAILED)
+    return typed
+
+
+def _most_read(indexes: Iterable[int], parsed: List[List[object]]) -> List[int]:
+    """The indexes whose values are None least often in parsed, in order"""
+    indexes = list(indexes)
+    counts = [0] * len(indexes)
+    for values in parsed:
+        for i, value in enumerate(values):
+            if value is not None:
+                counts[i] += 1
+    most = max(counts)
+    return [index for index, count in zip(indexes, counts) if count == most]
+
+
+def normalize_policies(policies: List[Policy]) -> int:
+    """
+    Typed values for the date and premium fields of a batch of policies, e.g. the ones one table gave. Each field
+    is taken as a column: its format is worked out once from the column's distinct texts and each distinct text
+    is read once, policies with the same text share the TypedValue. The strings stay in their fields, the typed
+    values go to policy.normalized by field name. Returns how many values were set.
+    """
+    set_count = 0
+    for fields, formats in ((DATE_FIELDS, DATE_FORMATS), (AMOUNT_FIELDS, AMOUNT_FORMATS)):
+        for field in fields:
+            column = [getattr(policy, field) for policy in policies]
+            # distinct texts in the order the batch has them, the sample has to be the same on every run
+            texts = [text for text in dict.fromkeys(column) if text]
+            if not texts:
+                continue
+            typed = _read_column(formats, texts)
+            for policy, text in zip(policies, column):
+                found = typed.get(text)
+                if found is None:
+                    continue
+                if policy.normalized is None:
+                    policy.normalized = {field: found}
+                else:
+                    policy.normalized[field] = found
+                set_count += 1
+    return set_count
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Cache key for a url: lowercase scheme and host, no default port, no fragment, sorted query params
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+class CachedPage():
+
+    def __init__(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str], fetched_at: float):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+class PageCache():
+    """
+    On-disk cache of fetched pages keyed by normalized url.
+
+    Bodies are zlib compressed and stored once per content hash under objects/, so identical pages share a file.
+    A sqlite index keeps ETag/Last-Modified for conditional revalidation, when each page was fetched (for the ttl)
+    and when it was last read (for lru eviction once the objects grow past max_bytes).
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float = 24 * 3600, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # pages read since the last write, their last_access goes in with the next commit so a read never
+        # takes the write lock
+        self._accessed: Dict[str, float] = {}
+        # bytes under objects/ as far as this process knows, summed from the index once and kept up to date
+        # by put and delete. Other processes sharing the cache aren't seen, eviction sums again before it starts
+        self._total: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # opened on first use so a scraper that never touches the cache (e.g. in a parser process) costs nothing
+        if self._conn is None:
+            os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, size INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access);
+                CREATE INDEX IF NOT EXISTS pages_hash ON pages (hash);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Cached page whether fresh or not, None if never cached"""
+        key = normalize_url(url)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT hash, etag, last_modified, fetched_at FROM pages WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[key] = time.time()
+        digest, etag, last_modified, fetched_at = row
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                body = zlib.decompress(f.read()).decode('utf-8')
+        except (OSError, zlib.error):
+            self.delete(url)
+            return None
+        return CachedPage(url, body, etag, last_modified, fetched_at)
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl_seconds
+
+    def lookup(self, url: str, allow_stale: bool = False) -> Optional[str]:
+        """Cached html if it is still within the ttl (or at all with allow_stale)"""
+        page = self.get(url)
+        if page is None:
+            return None
+        if allow_stale or self.is_fresh(page):
+            return page.body
+        return None
+
+    def put(self, url: str, body: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        now = time.time()
+        with self._lock:
+            self._touch_accessed()
+            known = self.conn.execute("SELECT size FROM objects WHERE hash = ?", (digest,)).fetchone()
+            if not known or not os.path.exists(path):
+                compressed = zlib.compress(data, 6)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp, path)
+                self.conn.execute("INSERT OR REPLACE INTO objects (hash, size) VALUES (?, ?)", (digest, len(compressed)))
+                self._grow(len(compressed) - (known[0] if known else 0))
+            old = self.conn.execute("SELECT hash FROM pages WHERE url = ?", (normalize_url(url),)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (url, hash, etag, last_modified, fetched_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), digest, etag, last_modified, now, now))
+            if old and old[0] != digest:
+                self._drop_if_unused(old[0])
+            self.conn.commit()
+            self._evict()
+
+    def touch(self, url: str):
+        """A 304 came back, the cached body counts as freshly fetched again"""
+        now = time.time()
+        with self._lock:
+            self._touch_accessed()
+            self.conn.execute("UPDATE pages SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, normalize_url(url)))
+            self.conn.commit()
+
+    def delete(self, url: str):
+        with self._lock:
+            self._touch_accessed()
+            row = self.conn.execute("SELECT hash FROM pages WHERE url = ?", (normalize_url(url),)).fetchone()
+            self.conn.execute("DELETE FROM pages WHERE url = ?", (normalize_url(url),))
+            if row:
+                self._drop_if_unused(row[0])
+            self.conn.commit()
+
+    def _touch_accessed(self):
+        """Writes the buffered last_access times into the open transaction, caller holds the lock"""
+        if self._accessed:
+            self.conn.executemany("UPDATE pages SET last_access = ? WHERE url = ?",
+                                  [(seen, key) for key, seen in self._accessed.items()])
+            self._accessed.clear()
+
+    def _grow(self, size: int):
+        if self._total is not None:
+            self._total += size
+
+    def _drop_if_unused(self, digest: str):
+        if self.conn.execute("SELECT 1 FROM pages WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+            return
+        size = self.conn.execute("SELECT size FROM objects WHERE hash = ?", (digest,)).fetchone()
+        self.conn.execute("DELETE FROM objects WHERE hash = ?", (digest,))
+        self._grow(-size[0] if size else 0)
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def _evict(self):
+        """Least recently read pages go first until the objects fit in max_bytes, caller holds the lock"""
+        if not self.max_bytes:
+            return
+        if self._total is None or self._total > self.max_bytes:
+            # the only full sum over the objects, on the first write and when over budget
+            self._total = self.total_bytes()
+        if self._total <= self.max_bytes:
+            return
+        for url, digest in self.conn.execute("SELECT url, hash FROM pages ORDER BY last_access").fetchall():
+            self.conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._drop_if_unused(digest)
+            if self._total <= self.max_bytes:
+                break
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._touch_accessed()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
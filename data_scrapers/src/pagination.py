@@ -0,0 +1,166 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+
+# link texts taken for "next page", lowercased
+NEXT_LINK_TEXTS = ('next', 'next >', '>', 'next page', 'more')
+
+# query params that count rows rather than pages, a page 1 url without them starts at 0 not 1
+OFFSET_PARAMS = {'offset', 'start', 'skip', 'from', 'startrow', 'first'}
+
+
+def _tokens(url: str):
+    parts = urlsplit(url)
+    # the raw query pieces, so a url rebuilt from them is byte for byte what the site would link to
+    query = parts.query.split('&') if parts.query else []
+    return parts, parts.path.split('/'), query
+
+
+def _query_key(piece: str) -> str:
+    return piece.split('=', 1)[0]
+
+
+def _query_value(piece: str) -> Optional[str]:
+    return piece.split('=', 1)[1] if '=' in piece else None
+
+
+def _int_slot(a_url: str, b_url: str) -> Optional[Tuple[Tuple[str, int], Optional[int], int]]:
+    """
+    When two urls differ in exactly one integer, a path segment or a query value, returns (slot in b_url,
+    value in a_url, value in b_url). The value in a_url is None when only b_url carries the param (?page=2 after
+    a bare page 1 url).
+    """
+    pa, path_a, query_a = _tokens(a_url)
+    pb, path_b, query_b = _tokens(b_url)
+    if (pa.scheme, pa.netloc) != (pb.scheme, pb.netloc) or len(path_a) != len(path_b):
+        return None
+
+    diffs = [(('path', i), x, y) for i, (x, y) in enumerate(zip(path_a, path_b)) if x != y]
+    keys_a = [_query_key(q) for q in query_a]
+    keys_b = [_query_key(q) for q in query_b]
+    if keys_a == keys_b:
+        diffs.extend((('query', i), _query_value(x), _query_value(y))
+                     for i, (x, y) in enumerate(zip(query_a, query_b)) if x != y)
+    elif len(keys_b) == len(keys_a) + 1:
+        extra = [i for i, key in enumerate(keys_b) if key not in keys_a]
+        if len(extra) != 1 or [q for i, q in enumerate(query_b) if i != extra[0]] != query_a:
+            return None
+        diffs.append((('query', extra[0]), None, _query_value(query_b[extra[0]])))
+    else:
+        return None
+
+    if len(diffs) != 1:
+        return None
+    slot, old, new = diffs[0]
+    if new is None or not new.isdigit() or (old is not None and not old.isdigit()):
+        return None
+    return slot, (int(old) if old is not None else None), int(new)
+
+
+def _with_value(url: str, slot: Tuple[str, int], value: int) -> str:
+    parts, path, query = _tokens(url)
+    kind, i = slot
+    if kind == 'path':
+        path[i] = str(value)
+        return urlunsplit(parts._replace(path='/'.join(path)))
+    query[i] = f"{_query_key(query[i])}={value}"
+    return urlunsplit(parts._replace(query='&'.join(query)))
+
+
+def numbered_links(soup, current_url: str) -> Dict[int, str]:
+    """Page number -> absolute url for every link whose text is just a number (the "1 2 3 ... N" kind)"""
+    pages: Dict[int, str] = {}
+    for a in soup.find_all('a', href=True):
+        text = a.get_text(strip=True)
+        if text.isdigit():
+            pages.setdefault(int(text), urljoin(current_url, a['href']))
+    return pages
+
+
+def page_links(current_url: str, anchors: Iterable[Tuple[str, Optional[str]]]) -> Tuple[Optional[str], Dict[int, str]]:
+    """
+    The next page link and the numbered links (page number -> absolute url) among a page's anchors,
+    given as (stripped text, href) pairs in document order, for trees that aren't a soup
+    """
+    next_link: Optional[str] = None
+    pages: Dict[int, str] = {}
+    for label, href in anchors:
+        if href is None:
+            continue
+        try:
+            if next_link is None and label.lower() in NEXT_LINK_TEXTS:
+                next_link = urljoin(current_url, href)
+            if label.isdigit():
+                pages.setdefault(int(label), urljoin(current_url, href))
+        except ValueError:
+            pass
+    return next_link, pages
+
+
+def _from_numbered_links(pages: Dict[int, str], next_link: str, limit: int) -> List[str]:
+    next_number = next((n for n, url in pages.items() if url == next_link), None)
+    if next_number is None:
+        return []
+    later = sorted(n for n in pages if n > next_number)
+    if not later:
+        return []
+
+    # "1 2 3 ... 40" only links a few pages, when the page number sits in the url the gap can be filled in
+    last = later[-1]
+    fill = None
+    found = _int_slot(next_link, pages[last])
+    if found is not None and found[1] is not None:
+        slot, first_value, last_value = found
+        step, remainder = divmod(last_value - first_value, last - next_number)
+        if step > 0 and not remainder:
+            fill = (slot, first_value, step)
+
+    predicted = []
+    for n in range(next_number + 1, last + 1):
+        if n in pages:
+            predicted.append(pages[n])
+        elif fill is not None:
+            slot, first_value, step = fill
+            predicted.append(_with_value(next_link, slot, first_value + (n - next_number) * step))
+        if len(predicted) >= limit:
+            break
+    return predicted
+
+
+def _from_step(current_url: str, next_link: str, limit: int) -> List[str]:
+    found = _int_slot(current_url, next_link)
+    if found is None:
+        return []
+    slot, old, new = found
+    if old is None:
+        key = _query_key(_tokens(next_link)[2][slot[1]]).lower() if slot[0] == 'query' else ''
+        step = new if key in OFFSET_PARAMS else 1
+    else:
+        step = new - old
+    if step <= 0:
+        return []
+    return [_with_value(next_link, slot, new + k * step) for k in range(1, limit + 1)]
+
+
+def predict_pages(soup, current_url: str, next_link: Optional[str], limit: int,
+                  pages: Optional[Dict[int, str]] = None) -> List[str]:
+    """
+    Guesses the pages after next_link, in order: from numbered page links when the page has them (soup may be
+    None, or pass the numbered links in when they were already collected), otherwise by repeating the step from
+    current_url to next_link (?page=3 -> ?page=4, /p/20 -> /p/40).
+    These are only prefetch hints, a crawl still just follows each page's own next link.
+    """
+    if not next_link or limit <= 0:
+        return []
+    if pages is None:
+        pages = numbered_links(soup, current_url) if soup is not None else {}
+    predicted = _from_numbered_links(pages, next_link, limit) if pages else []
+    if not predicted:
+        # don't step past the last page the listing links to
+        last_url = pages[max(pages)] if pages else None
+        if next_link == last_url:
+            return []
+        predicted = _from_step(current_url, next_link, limit)
+        if last_url in predicted:
+            predicted = predicted[:predicted.index(last_url) + 1]
+    return predicted[:limit]
@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import Metrics
+from models import ScrapeResult
+
+
+# one scraper per parser process, created by the pool initializer so it is not pickled for every page
+_parser_scraper = None
+
+
+def _init_parser(scraper_kwargs: Dict[str, Any]):
+    global _parser_scraper
+    from generic_scraper import GenericScraper
+    _parser_scraper = GenericScraper(**scraper_kwargs)
+
+
+def _parse_in_worker(html: str, url: str):
+    result, next_link = _parser_scraper.parse_page(html, url)
+    # what this page's parse recorded goes back with it, the parent merges it into the run's metrics
+    return result, next_link, _parser_scraper.metrics.drain()
+
+
+class PipelinedScraper():
+    """
+    Runs fetching and parsing as two separate stages so a slow parse never holds up the next fetch.
+
+    Fetch workers are threads, each with its own GenericScraper (playwright's sync api is bound to one thread),
+    they push html into a bounded queue. A dispatcher hands pages from the queue to a process pool of parsers.
+    When the queue is full fetchers block, which is the backpressure. Next page links found by the parsers are
+    fed back to the fetchers and every chain is merged in page order once its last page is parsed.
+    """
+
+    def __init__(self, fetch_workers: int = 2, parse_workers: Optional[int] = None, queue_size: int = 8,
+                 scraper_kwargs: Optional[Dict[str, Any]] = None, frontier=None):
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = max(1, queue_size)
+        self.scraper_kwargs = dict(scraper_kwargs or {})
+        # the fetch threads share this one, parser processes send theirs back per page
+        self.metrics = self.scraper_kwargs.get("metrics") or Metrics()
+        self.scraper_kwargs["metrics"] = self.metrics
+        # optional Frontier, parsed pages are checkpointed into it and run() resumes chains from it
+        self.frontier = frontier
+
+    def run(self, start_urls: List[str],
+            on_result: Optional[Callable[[str, Optional[ScrapeResult]], None]] = None) -> List[ScrapeResult]:
+        """
+        Returns a result per start url in input order, or hands each one to on_result (from the calling thread)
+        as soon as its chain is finished and keeps nothing
+        """
+        if not start_urls:
+            return []
+        results: Dict[int, Optional[ScrapeResult]] = {}
+        with self._stages():
+            for url in start_urls:
+                self._add_chain(url)
+            for _ in start_urls:
+                chain, result = self._next_finished(on_result)
+                if on_result is None:
+                    results[chain] = result
+        return [results[i] for i in sorted(results)]
+
+    def run_frontier(self, on_result: Optional[Callable[[str, Optional[ScrapeResult]], None]] = None):
+        """
+        Crawls chains claimed from the frontier until none are left, on one set of fetchers and parsers. Only about
+        as many chains as the stages can work on at once are claimed, another one each time one finishes, so a
+        claimed chain never sits in a queue while its lease runs out.
+        """
+        wanted = self.fetch_workers + self.parse_workers + self.queue_size
+        active = 0
+        with self._stages():
+            while True:
+                if active < wanted:
+                    for url in self.frontier.claim(wanted - active):
+                        self._add_chain(url)
+                        active += 1
+                if not active:
+                    break
+                self._next_finished(on_result)
+                active -= 1
+
+    @contextmanager
+    def _stages(self):
+        """Fetch threads, the parser pool and its dispatcher, up for as long as the block runs"""
+        self._tasks: "queue.Queue" = queue.Queue()
+        self._pages: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        # limits pages submitted to the pool but not parsed yet, the bounded queue does the real buffering
+        self._in_flight = threading.BoundedSemaphore(self.parse_workers)
+        self._lock = threading.Lock()
+        # per chain, indexed by the order chains were added: pages not finished yet, page urls seen and
+        # parsed pages by index (the last two are dropped once the chain is handed over)
+        self._start_urls: List[str] = []
+        self._chain_pending: List[int] = []
+        self._visited: List[Optional[Set[str]]] = []
+        self._parsed: List[Optional[Dict[int, ScrapeResult]]] = []
+        # finished chains' indexes
+        self._completed: "queue.Queue" = queue.Queue()
+        # chains another worker took over from the frontier, their remaining pages are dropped
+        self._lost: Set[int] = set()
+
+        fetchers = [threading.Thread(target=self._fetch_loop, daemon=True) for _ in range(self.fetch_workers)]
+        # spawn rather than fork, forking a process that already runs playwright threads is asking for trouble
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=ctx,
+                                 initializer=_init_parser, initargs=(self.scraper_kwargs,)) as pool:
+            dispatcher = threading.Thread(target=self._dispatch_loop, args=(pool,), daemon=True)
+            dispatcher.start()
+            for t in fetchers:
+                t.start()
+            try:
+                yield
+            finally:
+                for _ in fetchers:
+                    self._tasks.put(None)
+                self._pages.put(None)
+                for t in fetchers:
+                    t.join()
+                dispatcher.join()
+
+    def _add_chain(self, url: str):
+        with self._lock:
+            chain = len(self._start_urls)
+            self._start_urls.append(url)
+            self._chain_pending.append(0)
+            self._visited.append(set())
+            self._parsed.append({})
+        if self.frontier is None:
+            self._schedule(chain, 0, url)
+            return
+        restored, visited, resume_url, page_index = self.frontier.restore(url)
+        self._visited[chain].update(visited)
+        # what earlier attempts merged sorts before every page parsed now
+        self._parsed[chain][-1] = restored
+        if not (resume_url and self._schedule(chain, page_index, resume_url)):
+            # every page was checkpointed, only the result is missing
+            self._completed.put(chain)
+
+    def _next_finished(self, on_result) -> Tuple[int, Optional[ScrapeResult]]:
+        """Waits for a chain to finish and merges it, hands it to on_result and completes it in the frontier"""
+        chain = self._completed.get()
+        url = self._start_urls[chain]
+        pages = self._parsed[chain]
+        # drop the pages as soon as they are merged
+        self._parsed[chain] = None
+        self._visited[chain] = None
+        if chain in self._lost:
+            # the worker that has it now hands the result over and completes it
+            return chain, None
+        all_results = ScrapeResult()
+        seen = set()
+        with self.metrics.timer("merge", url):
+            for page_index in sorted(pages):
+                self.metrics.inc("duplicates", all_results.merge(pages[page_index], seen), url)
+        error = None
+        if self.frontier is not None and not self.frontier.checkpointed(url):
+            # every page failed, e.g. the host is down, the chain goes back for another attempt
+            error = f"No page of {url} could be loaded"
+            print(f"Error scraping {url}: {error}")
+            all_results = None
+        if on_result is not None:
+            on_result(url, all_results)
+        if self.frontier is not None and not self.frontier.complete(url, all_results is not None, error):
+            print(f"{url} was taken over by another worker, its result may be written twice")
+        return chain, all_results
+
+    def _schedule(self, chain: int, page_index: int, url: str) -> bool:
+        with self._lock:
+            if url in self._visited[chain]:
+                return False
+            self._visited[chain].add(url)
+            self._chain_pending[chain] += 1
+        self._tasks.put((chain, page_index, url))
+        return True
+
+    def _finish(self, chain: int):
+        with self._lock:
+            self._chain_pending[chain] -= 1
+            if self._chain_pending[chain] == 0:
+                self._completed.put(chain)
+
+    def _fetch_loop(self):
+        from generic_scraper import GenericScraper
+
+        with GenericScraper(**self.scraper_kwargs) as scraper:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    break
+                chain, page_index, url = task
+                if chain in self._lost:
+                    self._finish(chain)
+                    continue
+                try:
+                    html = scraper.fetch(url)
+                except Exception as e:
+                    print(f"Error scraping {url}: {e}")
+                    html = ""
+                if not html:
+                    print(f"Failed to fetch {url}")
+                    self.metrics.inc("failures", url=url)
+                    self._finish(chain)
+                    continue
+                # blocks while the parsers are behind
+                self._pages.put((chain, page_index, url, html))
+
+    def _dispatch_loop(self, pool: ProcessPoolExecutor):
+        while True:
+            item = self._pages.get()
+            if item is None:
+                break
+            chain, page_index, url, html = item
+            if chain in self._lost:
+                self._finish(chain)
+                continue
+            self._in_flight.acquire()
+            try:
+                future = pool.submit(_parse_in_worker, html, url)
+            except Exception as e:
+                self._in_flight.release()
+                print(f"Error scraping {url}: {e}")
+                self._finish(chain)
+                continue
+            future.add_done_callback(partial(self._on_parsed, chain, page_index, url))
+
+    def _on_parsed(self, chain: int, page_index: int, url: str, future: Future):
+        self._in_flight.release()
+        try:
+            result, next_link, recorded = future.result()
+            self.metrics.merge(recorded)
+            if chain in self._lost:
+                return
+            start_url = self._start_urls[chain]
+            if self.frontier is not None and not self.frontier.checkpoint(start_url, page_index, url, result, next_link):
+                # our lease ran out and the chain was claimed again, its next pages aren't ours to fetch
+                print(f"{start_url} was taken over by another worker, stopping it here")
+                self._lost.add(chain)
+                return
+            self._parsed[chain][page_index] = result
+            # schedule before finishing this page so the pending count can't touch zero in between
+            if next_link and self._schedule(chain, page_index + 1, next_link):
+                print(f"Found next page: {next_link}")
+        except Exception as e:
+            print(f"Error scraping {url}: {e}")
+            self.metrics.inc("failures", url=url)
+        finally:
+            self._finish(chain)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from columnar import json_default
+from fingerprints import policy_content, policy_key
+from models import Agency, Insured, Policy, ScrapeResult, intern_keys
+from serialize import model_json
+
+
+# policies written per transaction, results are held until this many have piled up or the store is flushed
+BATCH_SIZE = 5000
+
+# the Policy columns stored as they are, additional_data goes in as json
+POLICY_COLUMNS = ("policy_number", "effective_date", "expiration_date", "premium", "status", "carrier", "coverage_type")
+
+
+def _policy_row(policy: Policy) -> Tuple[str, str, Tuple]:
+    """The policy's key (fingerprints.policy_key, like the change reports), content hash and column values"""
+    data = policy_content(policy)
+    content_hash = hashlib.sha1(json.dumps(data, sort_keys=True, default=json_default).encode('utf-8')).hexdigest()
+    key = policy_key(policy)
+    values = tuple(data[name] for name in POLICY_COLUMNS)
+    return key, content_hash, values + (json.dumps(policy.additional_data, default=json_default),)
+
+
+class ResultStore():
+    """
+    Results in SQLite, queryable by policy number, carrier and source url instead of only as a jsonl file.
+
+    Works as an output sink: every url's insured and agency get a row and its policies one row each, keyed by
+    (source_url, policy key) like the incremental change reports (the policy number with its effective date, a
+    hash of the policy when it has no number). Scraping a url again upserts: a policy whose content hash is the same only has its last_seen
+    moved, a changed one is updated in place and new ones are added. Policies a later run doesn't find anymore
+    stay, their last_seen tells. Writes are batched, executemany in one IMMEDIATE transaction per BATCH_SIZE
+    policies, so a big run doesn't pay a commit per url.
+    """
+
+    def __init__(self, path: str, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, ScrapeResult]] = []
+        self._pending_policies = 0
+        self.stats: Counter = Counter()
+        self.count = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS results (
+                    source_url TEXT PRIMARY KEY,
+                    insured TEXT,
+                    agency TEXT,
+                    policies INTEGER NOT NULL,
+                    scraped_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS policies (
+                    id INTEGER PRIMARY KEY,
+                    source_url TEXT NOT NULL,
+                    policy_key TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    policy_number TEXT,
+                    effective_date TEXT,
+                    expiration_date TEXT,
+                    premium TEXT,
+                    status TEXT,
+                    carrier TEXT,
+                    coverage_type TEXT,
+                    additional_data TEXT NOT NULL,
+                    first_seen REAL NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+                -- also the index for lookups by source_url, it's the leading column
+                CREATE UNIQUE INDEX IF NOT EXISTS policies_key ON policies (source_url, policy_key);
+                CREATE INDEX IF NOT EXISTS policies_number ON policies (policy_number);
+                CREATE INDEX IF NOT EXISTS policies_carrier ON policies (carrier);
+            """)
+            self._conn = conn
+        return self._conn
+
+    # sink interface
+
+    def write(self, url: str, result: ScrapeResult):
+        with self._lock:
+            self._pending.append((url, result))
+            self._pending_policies += len(result.policies)
+            full = self._pending_policies >= self.batch_size
+        self.count += 1
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_policies = 0
+            if pending:
+                self._store(pending)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _store(self, pending: List[Tuple[str, ScrapeResult]]):
+        now = time.time()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for url, result in pending:
+                self._store_result(conn, url, result, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _store_result(self, conn: sqlite3.Connection, url: str, result: ScrapeResult, now: float):
+        stored = dict(conn.execute("SELECT policy_key, content_hash FROM policies WHERE source_url = ?", (url,)))
+        new, changed, unchanged = [], [], []
+        for policy in result.policies:
+            key, content_hash, values = _policy_row(policy)
+            previous = stored.get(key)
+            if previous is None:
+                new.append((url, key, content_hash) + values + (now, now))
+            elif previous != content_hash:
+                changed.append((content_hash,) + values + (now, url, key))
+            else:
+                unchanged.append((now, url, key))
+            # the same key twice in one result, the later one updates the row the first inserts
+            stored[key] = content_hash
+
+        columns = ", ".join(POLICY_COLUMNS)
+        conn.executemany(f"INSERT INTO policies (source_url, policy_key, content_hash, {columns}, additional_data, "
+                         f"first_seen, last_seen) VALUES (?, ?, ?, {', '.join('?' for _ in POLICY_COLUMNS)}, ?, ?, ?)", new)
+        conn.executemany("UPDATE policies SET content_hash = ?, "
+                         + ", ".join(f"{name} = ?" for name in POLICY_COLUMNS)
+                         + ", additional_data = ?, last_seen = ? WHERE source_url = ? AND policy_key = ?", changed)
+        conn.executemany("UPDATE policies SET last_seen = ? WHERE source_url = ? AND policy_key = ?", unchanged)
+        conn.execute("INSERT INTO results (source_url, insured, agency, policies, scraped_at) VALUES (?, ?, ?, ?, ?) "
+                     "ON CONFLICT (source_url) DO UPDATE SET insured = excluded.insured, agency = excluded.agency, "
+                     "policies = excluded.policies, scraped_at = excluded.scraped_at",
+                     (url, model_json(result.insured), model_json(result.agency), len(result.policies), now))
+        self.stats["results"] += 1
+        self.stats["added"] += len(new)
+        self.stats["updated"] += len(changed)
+        self.stats["unchanged"] += len(unchanged)
+
+    # lookups
+
+    def policies(self, policy_number: Optional[str] = None, carrier: Optional[str] = None,
+                 source_url: Optional[str] = None) -> List[Tuple[str, Policy]]:
+        """(source_url, Policy) for the stored policies matching every filter given"""
+        where, params = [], []
+        for column, value in (("policy_number", policy_number), ("carrier", carrier), ("source_url", source_url)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        sql = f"SELECT source_url, {', '.join(POLICY_COLUMNS)}, additional_data FROM policies"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self.conn.execute(sql + " ORDER BY id", params).fetchall()
+        found = []
+        for row in rows:
+            fields = dict(zip(POLICY_COLUMNS, row[1:-1]))
+            found.append((row[0], Policy(additional_data=intern_keys(json.loads(row[-1])), **fields)))
+        return found
+
+    def result(self, source_url: str) -> Optional[ScrapeResult]:
+        """A url's stored result without raw_data, policies in the order they were first stored"""
+        with self._lock:
+            row = self.conn.execute("SELECT insured, agency FROM results WHERE source_url = ?", (source_url,)).fetchone()
+        if row is None:
+            return None
+        insured, agency = (json.loads(value) for value in row)
+        return ScrapeResult(insured=Insured(**insured) if insured else None,
+                            agency=Agency(**agency) if agency else None,
+                            policies=[policy for _, policy in self.policies(source_url=source_url)])
+
+    def counts(self) -> Dict[str, Any]:
+        with self._lock:
+            results = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            policies = self.conn.execute("SELECT COUNT(*) FROM policies").fetchone()[0]
+        return {"results": results, "policies": policies}
+
+    def report(self) -> str:
+        counts = self.counts()
+        return (f"{counts['results']} results and {counts['policies']} policies stored, this run {self.stats['added']} "
+                f"added, {self.stats['updated']} updated, {self.stats['unchanged']} unchanged")
@@ -0,0 +1,317 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, TypeVar
+from urllib.parse import urlsplit
+
+
+T = TypeVar('T')
+
+# statuses that mean "not now" rather than "never", worth another try after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# set by HostScheduler.run/run_async for the fetch they are running, network_time() adds to it
+_network: ContextVar[Optional[List[float]]] = ContextVar('_network', default=None)
+
+
+class FetchError(Exception):
+    """A fetch that failed in a way the scheduler cares about, status is None for network errors and timeouts"""
+
+    def __init__(self, url: str, status: Optional[int] = None, retry_after: Optional[float] = None, message: str = ""):
+        super().__init__(message or (f"HTTP {status} for {url}" if status else f"Fetch failed for {url}"))
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        return self.status is not None and (self.status == 429 or self.status >= 500)
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRY_STATUSES
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, either delta seconds or an http date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_status(url: str, status: Optional[int], headers: Optional[Dict[str, str]] = None):
+    """FetchError for a status the scheduler should back off on, headers with lowercase names"""
+    if status in RETRY_STATUSES:
+        raise FetchError(url, status, parse_retry_after((headers or {}).get('retry-after')))
+
+
+@contextmanager
+def network_time():
+    """
+    Marks the part of a fetch spent waiting on the host. A fetch that marks some gives the scheduler that as its
+    latency sample instead of its whole run time, which also counts waits for our own slots, browser pages and
+    executor threads. Also counts from threads the fetch hands off to with asyncio.to_thread, they get a copy
+    of its context.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        spent = _network.get()
+        if spent is not None:
+            spent.append(time.monotonic() - started)
+
+
+class TokenBucket():
+    """rate requests per second on average with bursts of up to `burst`, rate <= 0 means unlimited. Thread safe."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how long to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class _Host():
+    """Per host state, guarded by the scheduler's lock"""
+
+    def __init__(self, bucket: TokenBucket, limit: float):
+        self.bucket = bucket
+        # concurrency allowed right now, a float so additive increase can creep up between whole numbers
+        self.limit = limit
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        # the best smoothed latency seen, what "not overloaded" looks like for this host
+        self.baseline: Optional[float] = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.waiters: List[Callable[[], None]] = []
+        self.requests = 0
+        self.throttled = 0
+
+
+class HostScheduler():
+    """
+    Politeness and retries around fetching, per host.
+
+    Each host gets a token bucket (rate requests/sec, bursts of `burst`) and an adaptive concurrency limit.
+    The limit follows AIMD: it grows by about one per round of successful requests while latency stays under
+    latency_factor times the best latency seen, and is cut by `decrease` when latency climbs past that or the
+    host answers 429/5xx, at most once per latency interval. Latency is the time a fetch marks with network_time(),
+    its whole run when it marks none. A Retry-After pauses the whole host.
+    Failed fetches are retried with jittered exponential backoff.
+
+    Works from threads (run) and from asyncio (run_async) at the same time.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: float = 4, initial_concurrency: int = 2, min_concurrency: int = 1,
+                 max_concurrency: int = 8, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 latency_factor: float = 2.0, decrease: float = 0.5, metrics=None):
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency_factor = latency_factor
+        self.decrease = decrease
+        # optional Metrics, counts retries
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._hosts: Dict[str, _Host] = {}
+
+    def __getstate__(self):
+        # parser processes get a copy of the scraper kwargs, only the settings travel
+        state = self.__dict__.copy()
+        for name in ('_lock', '_cond', '_hosts', 'metrics'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.metrics = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._hosts = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def _host(self, host: str) -> _Host:
+        # caller holds the lock
+        state = self._hosts.get(host)
+        if state is None:
+            limit = min(self.max_concurrency, max(self.min_concurrency, self.initial_concurrency))
+            state = self._hosts[host] = _Host(TokenBucket(self.rate, self.burst), float(limit))
+        return state
+
+    def _try_enter(self, state: _Host) -> bool:
+        if state.in_flight < int(state.limit):
+            state.in_flight += 1
+            return True
+        return False
+
+    def _delay(self, state: _Host) -> float:
+        """How long to hold a request that got a slot: host pause plus the rate limit"""
+        pause = max(0.0, state.paused_until - time.monotonic())
+        return pause + state.bucket.reserve()
+
+    # slots
+
+    def acquire(self, url: str):
+        with self._cond:
+            state = self._host(self.host_of(url))
+            while not self._try_enter(state):
+                self._cond.wait()
+        delay = self._delay(state)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, url: str):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                state = self._host(self.host_of(url))
+                if self._try_enter(state):
+                    break
+                ready = asyncio.Event()
+                state.waiters.append(lambda: loop.call_soon_threadsafe(ready.set))
+            await ready.wait()
+        delay = self._delay(state)
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release(url, None)
+                raise
+
+    def release(self, url: str, latency: Optional[float], error: Optional[FetchError] = None):
+        with self._cond:
+            state = self._host(self.host_of(url))
+            state.in_flight -= 1
+            self._adapt(state, latency, error)
+            waiters, state.waiters = state.waiters, []
+            self._cond.notify_all()
+        for wake in waiters:
+            wake()
+
+    def _adapt(self, state: _Host, latency: Optional[float], error: Optional[FetchError]):
+        if latency is None and error is None:
+            # given back without being used
+            return
+        now = time.monotonic()
+        state.requests += 1
+        overloaded = False
+        if error is not None and error.throttled:
+            state.throttled += 1
+            overloaded = True
+            if error.retry_after:
+                state.paused_until = max(state.paused_until, now + min(error.retry_after, self.backoff_max))
+        elif error is None and latency is not None:
+            state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            if state.baseline is None or state.latency < state.baseline:
+                state.baseline = state.latency
+            overloaded = state.latency > self.latency_factor * state.baseline
+
+        if overloaded:
+            # one cut per latency interval, the requests already in flight were sent at the old limit
+            if now - state.last_decrease >= (state.latency or 1.0):
+                state.limit = max(float(self.min_concurrency), state.limit * self.decrease)
+                state.last_decrease = now
+        elif error is None:
+            state.limit = min(float(self.max_concurrency), state.limit + 1.0 / state.limit)
+
+    def backoff(self, attempt: int, error: FetchError) -> float:
+        """Full jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if error.retry_after:
+            delay = max(delay, min(error.retry_after, self.backoff_max))
+        return delay
+
+    # running fetches
+
+    def run(self, url: str, fetch: Callable[[str], T]) -> T:
+        """Calls fetch(url) in a slot for its host, retrying FetchErrors, the last one is raised"""
+        attempt = 0
+        while True:
+            self.acquire(url)
+            started = time.monotonic()
+            spent = []
+            token = _network.set(spent)
+            latency = error = None
+            try:
+                result = fetch(url)
+                # the time on the network when the fetch marked it, all of it otherwise
+                latency = sum(spent) if spent else time.monotonic() - started
+                return result
+            except FetchError as e:
+                error = e
+            finally:
+                _network.reset(token)
+                # only a fetch that finished is a latency sample, another exception or a cancellation (a dropped
+                # prefetch) gives the slot back without telling anything about the host
+                self.release(url, latency, error)
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            if self.metrics is not None:
+                self.metrics.inc("retries", url=url)
+            time.sleep(self.backoff(attempt, error))
+            attempt += 1
+
+    async def run_async(self, url: str, fetch: Callable[[str], 'asyncio.Future']):
+        """run() for a coroutine function"""
+        attempt = 0
+        while True:
+            await self.acquire_async(url)
+            started = time.monotonic()
+            spent = []
+            token = _network.set(spent)
+            latency = error = None
+            try:
+                result = await fetch(url)
+                latency = sum(spent) if spent else time.monotonic() - started
+                return result
+            except FetchError as e:
+                error = e
+            finally:
+                _network.reset(token)
+                self.release(url, latency, error)
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            if self.metrics is not None:
+                self.metrics.inc("retries", url=url)
+            await asyncio.sleep(self.backoff(attempt, error))
+            attempt += 1
+
+    def report(self) -> str:
+        with self._lock:
+            return ", ".join(f"{host}: limit={int(s.limit)} requests={s.requests} throttled={s.throttled}"
+                             for host, s in sorted(self._hosts.items()))
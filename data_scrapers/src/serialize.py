@@ -0,0 +1,94 @@
+import io
+import json
+from dataclasses import fields
+from json.encoder import encode_basestring_ascii as _encode_str
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+from columnar import json_default
+from models import ScrapeResult
+
+
+# how many policies are joined into one string before it is written out
+WRITE_BATCH = 1000
+
+_PREFIXES: Dict[type, List[Tuple[str, str]]] = {}
+
+
+def _prefixes(cls) -> List[Tuple[str, str]]:
+    """(attribute, '"attribute": ') for every field of a model class, in declaration order"""
+    found = _PREFIXES.get(cls)
+    if found is None:
+        found = [(f.name, _encode_str(f.name) + ": ") for f in fields(cls)]
+        _PREFIXES[cls] = found
+    return found
+
+
+def _value_json(value: Any) -> str:
+    if value is None:
+        return "null"
+    if value.__class__ is str:
+        return _encode_str(value)
+    if value.__class__ is dict:
+        if not value:
+            return "{}"
+        return "{" + ", ".join(_encode_str(k) + ": " + _value_json(v) for k, v in value.items()) + "}"
+    return json.dumps(value, default=json_default)
+
+
+def model_json(model) -> str:
+    """
+    json for an Insured/Agency/Policy without copying the model first. The same text json.dumps(asdict(model)) gives,
+    except that a policy's normalized values (dates, Decimals) go through json_default, where plain json.dumps raises
+    """
+    if model is None:
+        return "null"
+    return "{" + ", ".join(prefix + _value_json(getattr(model, name)) for name, prefix in _prefixes(type(model))) + "}"
+
+
+def to_dict(model) -> Optional[Dict[str, Any]]:
+    """
+    Like dataclasses.asdict but shallow: nested models become dicts, additional_data and raw_data are the
+    model's own objects rather than deep copies, so don't mutate what comes back
+    """
+    if model is None:
+        return None
+    if isinstance(model, ScrapeResult):
+        return {
+            "insured": to_dict(model.insured),
+            "agency": to_dict(model.agency),
+            "policies": [to_dict(p) for p in model.policies],
+            "raw_data": model.raw_data,
+        }
+    return {name: getattr(model, name) for name, _ in _prefixes(type(model))}
+
+
+def write_result(out: IO[str], result: ScrapeResult, include_raw: bool = True, source_url: Optional[str] = None):
+    """
+    Writes a result as one line of json straight from the models, byte for byte what
+    json.dumps(asdict(result)) (plus "source_url" when given) would give except that normalized values go through
+    json_default, policies go out in batches
+    """
+    out.write('{"insured": ')
+    out.write(model_json(result.insured))
+    out.write(', "agency": ')
+    out.write(model_json(result.agency))
+    out.write(', "policies": [')
+    policies = result.policies
+    for start in range(0, len(policies), WRITE_BATCH):
+        if start:
+            out.write(", ")
+        out.write(", ".join(model_json(p) for p in policies[start:start + WRITE_BATCH]))
+    out.write("]")
+    if include_raw:
+        out.write(', "raw_data": ')
+        out.write(json.dumps(result.raw_data, default=json_default))
+    if source_url is not None:
+        out.write(', "source_url": ')
+        out.write(_encode_str(source_url))
+    out.write("}")
+
+
+def dumps(result: ScrapeResult, include_raw: bool = True, source_url: Optional[str] = None) -> str:
+    out = io.StringIO()
+    write_result(out, result, include_raw, source_url)
+    return out.getvalue()
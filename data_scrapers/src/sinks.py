@@ -0,0 +1,138 @@
+import gzip
+import json
+import os
+from typing import Any, Dict, IO, Optional
+
+from columnar import json_default
+from models import ScrapeResult
+from serialize import to_dict, write_result
+
+
+RAW_MODES = ("inline", "separate", "none")
+
+
+def result_record(url: str, result: ScrapeResult, include_raw: bool = True) -> Dict[str, Any]:
+    """The dict a result is written as, same shape main.py always produced"""
+    record = to_dict(result)
+    if not include_raw:
+        del record["raw_data"]
+    record["source_url"] = url
+    return record
+
+
+def _open_text(path: str, compress: bool, append: bool = False) -> IO[str]:
+    mode = 'a' if append else 'w'
+    if compress or path.endswith('.gz'):
+        # appending to a gzip file adds another member, readers see one stream
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if append:
+        _drop_partial_line(path)
+    return open(path, mode, encoding='utf-8')
+
+
+def _drop_partial_line(path: str):
+    """Cuts off a last line a crashed run didn't finish, so appended records start on a line of their own"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos != end:
+            f.truncate(pos)
+
+
+class JsonlSink():
+    """
+    Writes one json line per finished result as soon as it is handed over, so memory stays flat however many urls run.
+    raw_data can stay inline, go to its own jsonl file (keyed by source_url) or be dropped.
+    With append the files are added to, for runs resumed from a frontier.
+    """
+
+    def __init__(self, path: str, compress: bool = False, raw: str = "inline", raw_path: Optional[str] = None,
+                 append: bool = False):
+        if raw not in RAW_MODES:
+            raise ValueError(f"raw must be one of {RAW_MODES}")
+        self.path = path
+        self.raw = raw
+        self._out = _open_text(path, compress, append)
+        self._raw_out = None
+        if raw == "separate":
+            self._raw_out = _open_text(raw_path or self._default_raw_path(path), compress, append)
+        self.count = 0
+
+    @staticmethod
+    def _default_raw_path(path: str) -> str:
+        for ext in ('.jsonl.gz', '.jsonl', '.gz'):
+            if path.endswith(ext):
+                return path[:-len(ext)] + '.raw' + ext
+        return path + '.raw'
+
+    def write(self, url: str, result: ScrapeResult):
+        write_result(self._out, result, include_raw=self.raw == "inline", source_url=url)
+        self._out.write('\n')
+        if self._raw_out is not None:
+            self._raw_out.write(json.dumps({"source_url": url, "raw_data": result.raw_data}, default=json_default))
+            self._raw_out.write('\n')
+        self.count += 1
+
+    def flush(self):
+        self._out.flush()
+        if self._raw_out is not None:
+            self._raw_out.flush()
+
+    def close(self):
+        self._out.close()
+        if self._raw_out is not None:
+            self._raw_out.close()
+
+
+class JsonArraySink():
+    """
+    The original output.json format (one indented json array), written element by element instead of from a full list
+    """
+
+    def __init__(self, path: str, include_raw: bool = True):
+        self.path = path
+        self.include_raw = include_raw
+        self._out = open(path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, url: str, result: ScrapeResult):
+        item = json.dumps(result_record(url, result, include_raw=self.include_raw), indent=2, default=json_default)
+        self._out.write("[\n" if self.count == 0 else ",\n")
+        # same indentation json.dump(results, f, indent=2) gives list items
+        self._out.write("\n".join("  " + line for line in item.split("\n")))
+        self.count += 1
+
+    def flush(self):
+        self._out.flush()
+
+    def close(self):
+        self._out.write("\n]" if self.count else "[]")
+        self._out.close()
+
+
+class ConsoleSink():
+
+    def __init__(self, include_raw: bool = True):
+        self.include_raw = include_raw
+        self.count = 0
+
+    def write(self, url: str, result: ScrapeResult):
+        print(json.dumps(result_record(url, result, include_raw=self.include_raw), indent=2, default=json_default))
+        self.count += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
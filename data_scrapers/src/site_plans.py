@@ -0,0 +1,345 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+from bs4.element import Comment, ProcessingInstruction
+
+from columnar import ColumnarTable, json_default
+from extraction import KEY_TAGS, LIST_TAGS, DomExtractor
+from pagination import page_links
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+
+HEADER_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# strings under these aren't plain text to bs4, get_text() leaves them out
+NON_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+# anything under a header's sibling that can make the extractor output something
+CONTENT_TAGS = ('table', 'dl') + tuple(LIST_TAGS)
+
+# what to do with a sibling node of a section on planned pages
+SKIP = "skip"
+TABLE = "table"
+NODE = "node"
+
+# templates remembered per host, e.g. a list page and a detail page
+MAX_PLANS_PER_HOST = 4
+# pages on which a host's learned plan didn't reproduce the heuristics before the host is left alone
+MAX_LEARN_FAILURES = 3
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _collect(el, parts: List[str]):
+    if el.text:
+        text = el.text.strip()
+        if text:
+            parts.append(text)
+    for child in el:
+        # comments and processing instructions have a function as tag, only their tail is page text
+        if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+            _collect(child, parts)
+        if child.tail:
+            text = child.tail.strip()
+            if text:
+                parts.append(text)
+
+
+def text(el) -> str:
+    """bs4's get_text(strip=True) for an lxml element that isn't one of NON_TEXT_TAGS or inside one"""
+    if not len(el):
+        return el.text.strip() if el.text else ""
+    parts: List[str] = []
+    _collect(el, parts)
+    return "".join(parts)
+
+
+def _section_nodes(header) -> List:
+    """The elements after a header up to the next one, what _extract_generic_data extracts for its section"""
+    nodes = []
+    for sib in header.itersiblings():
+        tag = sib.tag
+        if not isinstance(tag, str):
+            continue
+        if tag in HEADER_TAGS:
+            break
+        nodes.append(sib)
+    return nodes
+
+
+def _has_label(el) -> bool:
+    """A "Label:" tag somewhere under el, the kind the extractor pairs with the value after it"""
+    for key in el.iterdescendants(*KEY_TAGS):
+        if text(key).endswith(':'):
+            return True
+    return False
+
+
+def _inert(el) -> bool:
+    """Nothing under el the extractor would pick up"""
+    if el.tag in CONTENT_TAGS or next(el.iterdescendants(*CONTENT_TAGS), None) is not None:
+        return False
+    return not _has_label(el)
+
+
+if lxml is not None:
+    # bs4 types every string under one of NON_TEXT_TAGS by it, even in tags nested in there. lxml never puts
+    # tags in a script or style, for the others text() would have to look up every element's ancestors
+    _TYPED = lxml.etree.XPath("boolean(//template/* | //rt/* | //rp/*)")
+    _NOT_PLAIN = lxml.etree.XPath("boolean(.//table | .//dl | .//ul | .//ol | .//script | .//style | .//template"
+                                  " | .//rt | .//rp | .//tr//tr)")
+
+
+def _simple_table(el) -> Optional[List[ColumnarTable]]:
+    """
+    DomExtractor's output for a plain table (no nested tables, lists, labels or script), straight from the lxml tree.
+    None when the table isn't that plain.
+    """
+    if el.tag != 'table':
+        return None
+    # rows inside rows would hand their cells to both
+    if _NOT_PLAIN(el) or _has_label(el):
+        return None
+
+    table = ColumnarTable([text(th) for th in el.iter('th')])
+    for row in el.iter('tr'):
+        cells = list(row.iter('td', 'th'))
+        if all(c.tag == 'th' for c in cells):
+            continue
+        table.add_row([text(c) for c in cells])
+    return [table] if table.row_count else []
+
+
+def _feed(soup: BeautifulSoup, el):
+    """
+    Replays an lxml element into soup through the same calls bs4's lxml tree builder makes while parsing,
+    returns its Tag
+    """
+    tag = el.tag
+    if not isinstance(tag, str):
+        soup.endData()
+        if tag is lxml.etree.ProcessingInstruction:
+            soup.handle_data(f"{el.target} {el.text or ''}")
+            soup.endData(ProcessingInstruction)
+        else:
+            soup.handle_data(el.text or '')
+            soup.endData(Comment)
+        return None
+    soup.handle_starttag(tag, None, None, dict(el.attrib))
+    started = soup.currentTag
+    if el.text:
+        soup.handle_data(el.text)
+    for child in el:
+        _feed(soup, child)
+        if child.tail:
+            soup.handle_data(child.tail)
+    soup.handle_endtag(tag)
+    return started
+
+
+def _classify(el) -> str:
+    if _inert(el):
+        return SKIP
+    if _simple_table(el) is not None:
+        return TABLE
+    return NODE
+
+
+class PlannedPage():
+    """A page parsed with lxml for the plan path, with its links"""
+    __slots__ = ('url', 'root', 'next_link', 'numbered')
+
+    def __init__(self, url: str, root):
+        self.url = url
+        self.root = root
+        # numbered is page number -> url, for predict_pages
+        self.next_link, self.numbered = page_links(url, ((text(a), a.get('href')) for a in root.iter('a')))
+
+
+class SitePlans():
+    """
+    Per host extraction plans learned from the heuristic pass, so pages of a known template skip the heuristics.
+
+    After a page goes through the full BeautifulSoup pass, its lxml tree is split the same way (headers and the
+    siblings under each) and every sibling gets a kind: skip (the extractor found nothing in it), table (a plain
+    table, read straight off the lxml tree) or node (anything else, re-parsed on its own and run through the
+    DomExtractor). The plan is only kept if running it on that page gives exactly the heuristic raw_data and next
+    link. Later pages of the host are parsed with lxml only and run the plan, which is many times faster than
+    building the whole soup. A page that doesn't fit (other headers, other siblings, content showing up where the
+    plan skips) goes through the heuristics again and the plan is relearned from it.
+
+    Plans are kept in a json file between runs, keyed by host, a few templates per host.
+    Needs lxml, and only matches the heuristics when they build their soup with lxml as well.
+    """
+
+    def __init__(self, path: Optional[str], extractor: DomExtractor):
+        self.path = path
+        self.extractor = extractor
+        self.enabled = lxml is not None
+        self.plans: Dict[str, List[Dict[str, Any]]] = {}
+        self.failures: Counter = Counter()
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.plans = json.load(f).get("hosts", {})
+
+    def has_plan(self, url: str) -> bool:
+        return self.enabled and bool(self.plans.get(_host(url)))
+
+    def page(self, html: str, url: str) -> Optional[PlannedPage]:
+        """The page parsed with lxml when its host has a plan, None to take the heuristic path"""
+        if not self.has_plan(url):
+            return None
+        root = self._parse(html)
+        return PlannedPage(url, root) if root is not None else None
+
+    @staticmethod
+    def _parse(html: str):
+        # plain etree elements, lxml.html's element classes cost a python lookup for every node touched
+        try:
+            root = lxml.etree.HTML(html)
+        except (ValueError, lxml.etree.ParserError):
+            # str input with an xml encoding declaration
+            return None
+        # pages with tags under templates or ruby text are left to the heuristics
+        if root is None or _TYPED(root):
+            return None
+        return root
+
+    def extract(self, page: PlannedPage) -> Optional[Dict[str, Any]]:
+        """raw_data by the first of the host's plans that fits the page, None if none does"""
+        host = _host(page.url)
+        for plan in list(self.plans.get(host, [])):
+            raw_data = self._run(plan, page.root)
+            if raw_data is not None:
+                with self._lock:
+                    self.stats["planned"] += 1
+                return raw_data
+        with self._lock:
+            self.stats["fallbacks"] += 1
+        return None
+
+    def _run(self, plan: Dict[str, Any], root) -> Optional[Dict[str, Any]]:
+        headers = list(root.iter(*HEADER_TAGS))
+        sections = plan["sections"]
+        if len(headers) != len(sections):
+            return None
+        tree = root.getroottree()
+        data = {"General": {"tables": [], "kv_pairs": {}, "lists": []}}
+        for header, section in zip(headers, sections):
+            if tree.getpath(header) != section["path"]:
+                return None
+            nodes = _section_nodes(header)
+            if [node.tag for node in nodes] != section["tags"]:
+                return None
+            tables, lists, kv_pairs = [], [], {}
+            for node, kind in zip(nodes, section["kinds"]):
+                if kind == SKIP:
+                    if not _inert(node):
+                        return None
+                    continue
+                if kind == TABLE:
+                    found = _simple_table(node)
+                    if found is None:
+                        return None
+                    tables.extend(found)
+                    continue
+                content = self._extract_node(node)
+                tables.extend(content["tables"])
+                lists.extend(content["lists"])
+                kv_pairs.update(content["kv_pairs"])
+
+            # merged by name like the heuristic pass does
+            name = text(header)
+            if name in data:
+                data[name]["tables"].extend(tables)
+                data[name]["lists"].extend(lists)
+                data[name]["kv_pairs"].update(kv_pairs)
+            else:
+                data[name] = {"tables": tables, "lists": lists, "kv_pairs": kv_pairs}
+        return data
+
+    def _extract_node(self, node) -> Dict[str, Any]:
+        # the node's soup is built from the lxml tree as is, serializing and parsing it again out of its
+        # context can nest things differently
+        soup = BeautifulSoup('', 'lxml')
+        fragment = _feed(soup, node)
+        soup.endData()
+        return self.extractor.extract(fragment)
+
+    def learn(self, html: str, url: str, raw_data: Dict[str, Any], next_link: Optional[str], root=None) -> bool:
+        """
+        Builds a plan from a page the heuristics just went through and keeps it if it reproduces their output.
+        Pages without headers are left to the heuristics. root is the page's lxml tree when page() already built it.
+        """
+        host = _host(url)
+        if not self.enabled or self.failures[host] >= MAX_LEARN_FAILURES:
+            return False
+        plan = self._plan(root if root is not None else self._parse(html), url, raw_data, next_link)
+        if plan is None:
+            with self._lock:
+                self.failures[host] += 1
+                self.stats["learn_failures"] += 1
+            return False
+        sections = plan["sections"]
+
+        with self._lock:
+            plans = [p for p in self.plans.get(host, []) if p["sections"] != sections]
+            # newest first, it's the template most likely to come next
+            self.plans[host] = [plan] + plans[:MAX_PLANS_PER_HOST - 1]
+            self.failures[host] = 0
+            self.stats["learned"] += 1
+        self.save()
+        return True
+
+    def _plan(self, root, url: str, raw_data: Dict[str, Any], next_link: Optional[str]) -> Optional[Dict[str, Any]]:
+        if root is None:
+            return None
+        tree = root.getroottree()
+        sections = []
+        for header in root.iter(*HEADER_TAGS):
+            nodes = _section_nodes(header)
+            sections.append({"path": tree.getpath(header), "tags": [node.tag for node in nodes],
+                             "kinds": [_classify(node) for node in nodes]})
+        if not sections:
+            return None
+
+        plan = {"sections": sections, "learned_at": time.time()}
+        if PlannedPage(url, root).next_link != next_link:
+            return None
+        produced = self._run(plan, root)
+        if produced is None or json.dumps(produced, default=json_default) != json.dumps(raw_data, default=json_default):
+            return None
+        return plan
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            hosts = dict(self.plans)
+        # other workers may have learned other hosts since this file was read, theirs are kept
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    hosts = dict(json.load(f).get("hosts", {}), **hosts)
+            except ValueError:
+                pass
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": 1, "hosts": hosts}, f)
+        os.replace(tmp, self.path)
+
+    def report(self) -> str:
+        return (f"{len(self.plans)} hosts, {self.stats['planned']} pages planned, {self.stats['fallbacks']} fell back, "
+                f"{self.stats['learned']} plans learned, {self.stats['learn_failures']} could not be learned")
@@ -0,0 +1,311 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from extraction import KEY_TAGS, LIST_TAGS
+from field_mapping import FieldMapper, RowPlan
+from models import Policy, intern_keys
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+
+HEADER_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# bs4 gives strings under these their own types, they're never page text
+NON_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+# elements whose whole text is used once they end
+TEXT_TAGS = HEADER_TAGS | {'td', 'th', 'li', 'dt', 'dd', 'a'}
+# a "Label:" tag is only taken when its text is at most this long, like DomExtractor
+MAX_LABEL = 50
+# anchor texts longer than this can't be a next link or a page number
+MAX_LINK_TEXT = 12
+
+# html is fed to the parser this many characters at a time, what was found in a chunk is handed out before the next
+CHUNK = 64 * 1024
+
+# kinds of events
+SECTION = "section"
+KV = "kv"
+ITEM = "item"
+POLICY = "policy"
+ANCHOR = "anchor"
+
+
+class _Table():
+    """A table being read, only its headers and the row before the current one are kept"""
+    __slots__ = ('headers', 'started', 'keys', 'positions', 'plan', 'values_plan', 'last_policy')
+
+    def __init__(self):
+        self.headers: List[str] = []
+        # a data row was seen, header rows after it don't count anymore
+        self.started = False
+        self.keys: Tuple[str, ...] = ()
+        self.positions: List[int] = []
+        self.plan: Optional[RowPlan] = None
+        self.values_plan: Optional[RowPlan] = None
+        # held back until the next row, a row with another cell count may still add to it
+        self.last_policy: Optional[Policy] = None
+
+
+class _Frame():
+    """An element that is open, where its text starts and what it collects"""
+    __slots__ = ('tag', 'start', 'raw', 'item', 'label_value', 'state')
+
+    def __init__(self, tag: str, start: int, raw: int):
+        self.tag = tag
+        # index of the first text piece inside it, and how much text came before it
+        self.start = start
+        self.raw = raw
+        # an li directly in a ul/ol, its (key, value) pairs
+        self.item: Optional[List[Tuple[str, str]]] = None
+        # the key when this is the element right after a "Label:" tag
+        self.label_value: Optional[str] = None
+        # _Table for a table, its cells for a tr, ([dt], [dd]) for a dl
+        self.state: Any = None
+
+
+class _Target():
+    """
+    lxml parser target, turns start/end/data events into the page's sections, key-value pairs, list items and
+    policies without building a tree. Finished events pile up in `out` until the generator hands them over.
+    """
+
+    def __init__(self, mapper: FieldMapper, parse_mashed: Callable[[str], Dict[str, str]]):
+        self.mapper = mapper
+        self.parse_mashed = parse_mashed
+        self.out: List[Tuple[str, Any]] = []
+        self.stack: List[_Frame] = []
+        # stripped strings of the page, only from the oldest open element that still needs its text on
+        self.pieces: List[str] = []
+        self.dropped = 0
+        # length of all page text so far, unstripped
+        self.raw = 0
+        self.buffer: List[str] = []
+        # open script/style/template/rt/rp elements
+        self.typed = 0
+        # (key, depth) of a "Label:" tag whose value is the next string or element at that depth
+        self.label: Optional[Tuple[str, int]] = None
+        # depth of the last header, the heuristics extract the nodes next to it and never take one of those
+        # as a label itself
+        self.section_depth: Optional[int] = None
+
+    # text
+
+    def _text(self, frame: _Frame) -> str:
+        return "".join(self.pieces[frame.start - self.dropped:])
+
+    def _flush(self):
+        """Ends the current string, bs4 joins the data between two tags into one"""
+        if not self.buffer:
+            return
+        string = "".join(self.buffer)
+        self.buffer = []
+        if not self.typed:
+            self.raw += len(string)
+            stripped = string.strip()
+            if stripped:
+                self.pieces.append(stripped)
+        self._label_string(string)
+
+    def trim(self):
+        """Drops the text no open element needs anymore, tables and lists don't pile up their text"""
+        keep = self.dropped + len(self.pieces)
+        for frame in self.stack:
+            tag = frame.tag
+            if (tag in TEXT_TAGS or frame.label_value is not None
+                    or (tag in KEY_TAGS and self.raw - frame.raw <= MAX_LABEL)):
+                keep = frame.start
+                break
+        if keep > self.dropped:
+            del self.pieces[:keep - self.dropped]
+            self.dropped = keep
+
+    # "Label:" pairs
+
+    def _label_string(self, string: str):
+        if self.label is not None and self.label[1] == len(self.stack):
+            value = string.strip()
+            if value:
+                self._pair(self.label[0], value)
+                self.label = None
+
+    def _pair(self, key: str, value: str):
+        self.out.append((KV, (key, value)))
+        for frame in self.stack:
+            if frame.item is not None:
+                frame.item.append((key, value))
+
+    # parser target interface
+
+    def start(self, tag: str, attrib, nsmap=None):
+        self._flush()
+        parent = self.stack[-1] if self.stack else None
+        frame = _Frame(tag, self.dropped + len(self.pieces), self.raw)
+        if self.label is not None and self.label[1] == len(self.stack):
+            frame.label_value = self.label[0]
+            self.label = None
+        if tag in NON_TEXT_TAGS:
+            self.typed += 1
+        elif tag == 'table':
+            frame.state = _Table()
+        elif tag == 'tr':
+            frame.state = []
+        elif tag == 'dl':
+            frame.state = ([], [])
+        elif tag == 'li' and parent is not None and parent.tag in LIST_TAGS:
+            frame.item = []
+        elif tag == 'a':
+            frame.state = attrib.get('href')
+        self.stack.append(frame)
+
+    def end(self, tag: str):
+        self._flush()
+        frame = self.stack.pop()
+        tag = frame.tag
+        if tag in NON_TEXT_TAGS:
+            self.typed -= 1
+        if self.label is not None and self.label[1] > len(self.stack):
+            # the label's parent ended before anything came after the label
+            self.label = None
+
+        if tag in HEADER_TAGS:
+            self.out.append((SECTION, self._text(frame)))
+            self.section_depth = len(self.stack)
+        elif tag in ('td', 'th'):
+            row = self._innermost('tr')
+            if row is not None:
+                row.state.append((tag, self._text(frame)))
+        elif tag == 'tr':
+            table = self._innermost('table')
+            if table is not None:
+                self._row(table.state, frame.state)
+        elif tag == 'table':
+            self._flush_policy(frame.state)
+        elif tag in ('dt', 'dd'):
+            dl = self._innermost('dl')
+            if dl is not None:
+                dl.state[0 if tag == 'dt' else 1].append(self._text(frame))
+        elif tag == 'dl':
+            for dt, dd in zip(*frame.state):
+                self._pair(dt.rstrip(':'), dd)
+        elif tag == 'a' and frame.state is not None:
+            text = self._text(frame)
+            if len(text) <= MAX_LINK_TEXT:
+                self.out.append((ANCHOR, (text, frame.state)))
+
+        if frame.item is not None:
+            self._item(frame)
+        if frame.label_value is not None:
+            value = self._text(frame)
+            if value:
+                self._pair(frame.label_value, value)
+        if tag in KEY_TAGS and self.raw - frame.raw <= MAX_LABEL and len(self.stack) != self.section_depth:
+            text = self._text(frame)
+            if text.endswith(':'):
+                self.label = (text.rstrip(':'), len(self.stack))
+
+    def data(self, data: str):
+        self.buffer.append(data)
+
+    def comment(self, text: str):
+        self._flush()
+        # a comment right after a label is its value to bs4 too
+        self._label_string(text)
+
+    def close(self):
+        self._flush()
+
+    # tables and lists
+
+    def _innermost(self, tag: str) -> Optional[_Frame]:
+        for frame in reversed(self.stack):
+            if frame.tag == tag:
+                return frame
+        return None
+
+    def _row(self, table: _Table, cells: List[Tuple[str, str]]):
+        """_policies_from_columns for one row, rows are mapped as they're read and dropped"""
+        values = [text for _, text in cells]
+        if all(tag == 'th' for tag, _ in cells):
+            if not table.started:
+                table.headers.extend(values)
+            return
+        if not table.started:
+            table.started = True
+            last: Dict[str, int] = {}
+            for i, header in enumerate(table.headers):
+                last[header] = i
+            table.keys, table.positions = tuple(last), list(last.values())
+            table.plan = self.mapper.row_plan(table.keys)
+            table.values_plan = self.mapper.row_plan(("values",))
+
+        if len(values) == len(table.headers):
+            if table.plan is not None:
+                self._flush_policy(table)
+                table.last_policy = table.plan.build([values[i] for i in table.positions])
+        elif table.values_plan is not None:
+            self._flush_policy(table)
+            table.last_policy = table.values_plan.build((values,))
+        elif table.last_policy is not None:
+            # a row that doesn't fit the headers continues the policy above it
+            for value in values:
+                parsed = self.parse_mashed(value)
+                if parsed:
+                    table.last_policy.additional_data.update(intern_keys(parsed))
+
+    def _flush_policy(self, table: _Table):
+        if table.last_policy is not None:
+            self.out.append((POLICY, table.last_policy))
+            table.last_policy = None
+
+    def _item(self, frame: _Frame):
+        item = dict(frame.item)
+        if not item:
+            parsed = self.parse_mashed(self._text(frame))
+            if len(parsed) <= 1:
+                return
+            item = parsed
+        self.out.append((ITEM, item))
+        plan = self.mapper.row_plan(tuple(item))
+        if plan is not None:
+            self.out.append((POLICY, plan.build(item.values())))
+
+
+class StreamingExtractor():
+    """
+    Extraction for pages too big to hold as a tree. The html goes through lxml's parser in chunks with a target
+    that gets start/end/data events, no tree is built. Sections, key-value pairs, list items and policies come out
+    of a generator as they're read: a table row is mapped to a Policy (with the same row plans _find_policies
+    uses) when its </tr> is reached and then dropped, so memory depends on the widest row, not on the table.
+
+    The section is the last header before a node in document order, and the whole page is read, content before
+    the first header counts as General. The heuristics look at each header's siblings instead. Headers are the
+    th's of the header rows before a table's first data row and nested tables are read on their own.
+    """
+
+    def __init__(self, mapper: FieldMapper, parse_mashed: Callable[[str], Dict[str, str]]):
+        self.mapper = mapper
+        self.parse_mashed = parse_mashed
+
+    @staticmethod
+    def available() -> bool:
+        return lxml is not None
+
+    def events(self, html: str) -> Iterator[Tuple[str, Any]]:
+        """
+        (kind, value) in document order: (SECTION, name), (KV, (key, value)), (ITEM, dict) for a list item's
+        key-value pairs, (POLICY, Policy) and (ANCHOR, (text, href)) for links short enough to be pagination
+        """
+        target = _Target(self.mapper, self.parse_mashed)
+        parser = lxml.etree.HTMLParser(target=target, recover=True)
+        for i in range(0, len(html), CHUNK):
+            parser.feed(html[i:i + CHUNK])
+            yield from self._drain(target)
+        parser.close()
+        yield from self._drain(target)
+
+    @staticmethod
+    def _drain(target: _Target) -> Iterator[Tuple[str, Any]]:
+        out, target.out = target.out, []
+        target.trim()
+        yield from out